@@ -1,6 +1,7 @@
 """Application implementation - ASGI."""
 
 import os
+import threading
 
 from fastapi import FastAPI, Request
 from fastapi.exceptions import RequestValidationError
@@ -12,6 +13,8 @@ from loguru import logger
 from app.config import config
 from app.models.exception import HttpException
 from app.router import root_api_router
+from app.services import bgm_library, scratch
+from app.services.manifest import RenderManifest
 from app.utils import utils
 
 
@@ -77,6 +80,17 @@ def shutdown_event():
     logger.info("shutdown event")
 
 
+def _has_checkpointed_clips(task_id: str) -> bool:
+    # RenderManifest.for_task would create the task directory of every orphaned scratch dir
+    manifest_file = os.path.join(task_dir, task_id, "manifest.json")
+    return os.path.isfile(manifest_file) and RenderManifest(manifest_file).has_clips()
+
+
 @app.on_event("startup")
 def startup_event():
     logger.info("startup event")
+    # scratch left behind by tasks of a previous run, clips of interrupted renders are kept for /resume
+    scratch.space.cleanup_orphans(keep=_has_checkpointed_clips)
+    # songs added, replaced or deleted in the song directory while the server was down, decoded in
+    # the background so startup is not held up
+    threading.Thread(target=bgm_library.library.refresh, name="bgm-refresh", daemon=True).start()
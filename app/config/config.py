@@ -47,6 +47,7 @@ whisper = _cfg.get("whisper", {})
 proxy = _cfg.get("proxy", {})
 azure = _cfg.get("azure", {})
 siliconflow = _cfg.get("siliconflow", {})
+encoder_profiles = _cfg.get("encoder_profiles", {})
 ui = _cfg.get(
     "ui",
     {
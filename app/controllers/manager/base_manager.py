@@ -1,29 +1,66 @@
 import threading
 from typing import Any, Callable, Dict
 
+from app.models import const
+from app.services import memory_budget
+from app.services import state as sm
+from app.services import task as tm
+
 
 class TaskManager:
-    def __init__(self, max_concurrent_tasks: int):
+    def __init__(self, max_concurrent_tasks: int, memory_budget_mb: int = 0):
         self.max_concurrent_tasks = max_concurrent_tasks
         self.current_tasks = 0
+        # tasks only start while the estimates of the running tasks and the sampled memory
+        # usage leave room for them, 0 disables the budget
+        self.memory_budget_mb = memory_budget_mb
+        self.reserved = {}
+        self.sampler = memory_budget.RssSampler() if memory_budget_mb > 0 else None
         self.lock = threading.Lock()
         self.queue = self.create_queue()
 
     def create_queue(self):
         raise NotImplementedError()
 
+    @staticmethod
+    def estimate_memory(kwargs: Dict) -> int:
+        params = kwargs.get("params")
+        if params is None and kwargs.get("task_id"):
+            # promoted tasks render with the params saved by the preview
+            params = tm.load_saved_params(kwargs["task_id"])
+        return memory_budget.estimate_task_memory(params, kwargs.get("stop_at", "video"))
+
+    def can_start(self, estimate: int) -> bool:
+        if self.current_tasks >= self.max_concurrent_tasks:
+            return False
+        if not self.sampler or self.current_tasks == 0:
+            # a task larger than the whole budget still runs, but only on its own
+            return True
+        in_use = max(sum(self.reserved.values()), self.sampler.used_mb)
+        return in_use + estimate <= self.memory_budget_mb
+
     def add_task(self, func: Callable, *args: Any, **kwargs: Any):
+        estimate = self.estimate_memory(kwargs)
+        if kwargs.get("task_id"):
+            sm.state.update_task(kwargs["task_id"], memory_estimate_mb=estimate)
         with self.lock:
-            if self.current_tasks < self.max_concurrent_tasks:
-                print(f"add task: {func.__name__}, current_tasks: {self.current_tasks}")
-                self.execute_task(func, *args, **kwargs)
+            if self.is_queue_empty() and self.can_start(estimate):
+                print(f"add task: {func.__name__}, current_tasks: {self.current_tasks}, memory estimate: {estimate} MB")
+                self.execute_task(func, estimate, *args, **kwargs)
             else:
                 print(
-                    f"enqueue task: {func.__name__}, current_tasks: {self.current_tasks}"
+                    f"enqueue task: {func.__name__}, current_tasks: {self.current_tasks}, memory estimate: {estimate} MB"
                 )
-                self.enqueue({"func": func, "args": args, "kwargs": kwargs})
+                # the estimate is kept with the queued task, it is not computed again while holding the lock
+                self.enqueue({"func": func, "args": args, "kwargs": kwargs, "memory_estimate": estimate})
 
-    def execute_task(self, func: Callable, *args: Any, **kwargs: Any):
+    def execute_task(self, func: Callable, memory_estimate: int, *args: Any, **kwargs: Any):
+        # the task is counted before its thread starts, so the next admission decision sees it
+        self.current_tasks += 1
+        task_id = kwargs.get("task_id")
+        self.reserved[task_id] = memory_estimate
+        if self.sampler:
+            self.sampler.start_task(task_id)
         thread = threading.Thread(
             target=self.run_task, args=(func, *args), kwargs=kwargs
         )
@@ -31,27 +68,38 @@ class TaskManager:
 
     def run_task(self, func: Callable, *args: Any, **kwargs: Any):
         try:
-            with self.lock:
-                self.current_tasks += 1
             func(*args, **kwargs)  # call the function here, passing *args and **kwargs.
         finally:
-            self.task_done()
+            self.task_done(kwargs.get("task_id"))
 
     def check_queue(self):
         with self.lock:
-            if (
-                self.current_tasks < self.max_concurrent_tasks
-                and not self.is_queue_empty()
-            ):
+            # start queued tasks in order while they fit, a finished large task can make room for several
+            while not self.is_queue_empty():
+                task_info = self.peek()
+                if not task_info:
+                    break
+                estimate = task_info.get("memory_estimate", 0)
+                if not self.can_start(estimate):
+                    break
                 task_info = self.dequeue()
                 func = task_info["func"]
                 args = task_info.get("args", ())
-                kwargs = task_info.get("kwargs", {})
-                self.execute_task(func, *args, **kwargs)
+                self.execute_task(func, estimate, *args, **task_info.get("kwargs", {}))
 
-    def task_done(self):
+    def task_done(self, task_id: str = None):
         with self.lock:
             self.current_tasks -= 1
+            self.reserved.pop(task_id, None)
+        if self.sampler and task_id:
+            peak = self.sampler.finish_task(task_id)
+            task = sm.state.get_task(task_id) or {}
+            sm.state.update_task(
+                task_id,
+                state=task.get("state", const.TASK_STATE_PROCESSING),
+                progress=task.get("progress", 0),
+                memory_peak_mb=peak,
+            )
         self.check_queue()
 
     def enqueue(self, task: Dict):
@@ -60,5 +108,8 @@ class TaskManager:
     def dequeue(self):
         raise NotImplementedError()
 
+    def peek(self):
+        raise NotImplementedError()
+
     def is_queue_empty(self):
         raise NotImplementedError()
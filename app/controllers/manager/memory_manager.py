@@ -14,5 +14,8 @@ class InMemoryTaskManager(TaskManager):
     def dequeue(self):
         return self.queue.get()
 
+    def peek(self):
+        return self.queue.queue[0]
+
     def is_queue_empty(self):
         return self.queue.empty()
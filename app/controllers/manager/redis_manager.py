@@ -9,14 +9,15 @@ from app.services import task as tm
 
 FUNC_MAP = {
     "start": tm.start,
+    "promote": tm.promote,
     # 'start_test': tm.start_test
 }
 
 
 class RedisTaskManager(TaskManager):
-    def __init__(self, max_concurrent_tasks: int, redis_url: str):
+    def __init__(self, max_concurrent_tasks: int, redis_url: str, memory_budget_mb: int = 0):
         self.redis_client = redis.Redis.from_url(redis_url)
-        super().__init__(max_concurrent_tasks)
+        super().__init__(max_concurrent_tasks, memory_budget_mb)
 
     def create_queue(self):
         return "task_queue"
@@ -36,7 +37,13 @@ class RedisTaskManager(TaskManager):
         self.redis_client.rpush(self.queue, json.dumps(task_with_serializable_params))
 
     def dequeue(self):
-        task_json = self.redis_client.lpop(self.queue)
+        return self._decode(self.redis_client.lpop(self.queue))
+
+    def peek(self):
+        return self._decode(self.redis_client.lindex(self.queue, 0))
+
+    @staticmethod
+    def _decode(task_json):
         if task_json:
             task_info = json.loads(task_json)
             # 将函数名称转换回函数对象
@@ -26,6 +26,7 @@ from app.models.schema import (
     TaskResponse,
     TaskVideoRequest,
 )
+from app.services import bgm_library
 from app.services import state as sm
 from app.services import task as tm
 from app.utils import utils
@@ -40,15 +41,20 @@ _redis_port = config.app.get("redis_port", 6379)
 _redis_db = config.app.get("redis_db", 0)
 _redis_password = config.app.get("redis_password", None)
 _max_concurrent_tasks = config.app.get("max_concurrent_tasks", 5)
+_memory_budget_mb = config.app.get("memory_budget_mb", 0)
 
 redis_url = f"redis://:{_redis_password}@{_redis_host}:{_redis_port}/{_redis_db}"
 # 根据配置选择合适的任务管理器
 if _enable_redis:
     task_manager = RedisTaskManager(
-        max_concurrent_tasks=_max_concurrent_tasks, redis_url=redis_url
+        max_concurrent_tasks=_max_concurrent_tasks,
+        redis_url=redis_url,
+        memory_budget_mb=_memory_budget_mb,
     )
 else:
-    task_manager = InMemoryTaskManager(max_concurrent_tasks=_max_concurrent_tasks)
+    task_manager = InMemoryTaskManager(
+        max_concurrent_tasks=_max_concurrent_tasks, memory_budget_mb=_memory_budget_mb
+    )
 
 
 @router.post("/videos", response_model=TaskResponse, summary="Generate a short video")
@@ -58,6 +64,17 @@ def create_video(
     return create_task(request, body, stop_at="video")
 
 
+@router.post(
+    "/videos/preview",
+    response_model=TaskResponse,
+    summary="Generate a low resolution preview of a short video",
+)
+def create_preview(
+    background_tasks: BackgroundTasks, request: Request, body: TaskVideoRequest
+):
+    return create_task(request, body, stop_at="preview")
+
+
 @router.post("/subtitle", response_model=TaskResponse, summary="Generate subtitle only")
 def create_subtitle(
     background_tasks: BackgroundTasks, request: Request, body: SubtitleRequest
@@ -132,7 +149,7 @@ def get_task(
 
         def file_to_uri(file):
             if not file.startswith(endpoint):
-                _uri_path = v.replace(task_dir, "tasks").replace("\\", "/")
+                _uri_path = file.replace(task_dir, "tasks").replace("\\", "/")
                 _uri_path = f"{endpoint}/{_uri_path}"
             else:
                 _uri_path = file
@@ -150,6 +167,10 @@ def get_task(
             for v in combined_videos:
                 urls.append(file_to_uri(v))
             task["combined_videos"] = urls
+        if "playlists" in task:
+            task["playlists"] = [file_to_uri(p) for p in task["playlists"]]
+        if task.get("preview_video"):
+            task["preview_video"] = file_to_uri(task["preview_video"])
         return utils.get_response(200, task)
 
     raise HttpException(
@@ -157,6 +178,50 @@ def get_task(
     )
 
 
+@router.post(
+    "/tasks/{task_id}/promote",
+    response_model=TaskResponse,
+    summary="Render the full quality video of a previewed task (exactly one video, video_count is ignored)",
+)
+def promote_preview(request: Request, task_id: str = Path(..., description="Task ID")):
+    request_id = base.get_task_id(request)
+    task = sm.state.get_task(task_id)
+    if not task or not task.get("timeline"):
+        raise HttpException(
+            task_id=task_id, status_code=404, message=f"{request_id}: preview not found"
+        )
+
+    sm.state.update_task(task_id)
+    task_manager.add_task(tm.promote, task_id=task_id)
+    logger.success(f"Task promoted: {task_id}")
+    return utils.get_response(200, {"task_id": task_id, "request_id": request_id})
+
+
+@router.post(
+    "/tasks/{task_id}/resume",
+    response_model=TaskResponse,
+    summary="Resume an interrupted task from its render manifest",
+)
+def resume_task(
+    request: Request,
+    task_id: str = Path(..., description="Task ID"),
+    stop_at: str = Query("video", description="Stage to stop at"),
+):
+    request_id = base.get_task_id(request)
+    params = tm.load_saved_params(task_id)
+    if not params:
+        raise HttpException(
+            task_id=task_id, status_code=404, message=f"{request_id}: task not found"
+        )
+
+    sm.state.update_task(task_id)
+    task_manager.add_task(
+        tm.start, task_id=task_id, params=params, stop_at=stop_at, resume=True
+    )
+    logger.success(f"Task resumed: {task_id}")
+    return utils.get_response(200, {"task_id": task_id, "request_id": request_id})
+
+
 @router.delete(
     "/tasks/{task_id}",
     response_model=TaskDeletionResponse,
@@ -200,12 +265,19 @@ def get_bgm_list(request: Request):
     return utils.get_response(200, response)
 
 
+def _index_bgm_file(file_path: str):
+    try:
+        bgm_library.library.get(file_path)
+    except Exception as e:
+        logger.error(f"failed to index bgm {file_path}: {str(e)}")
+
+
 @router.post(
     "/musics",
     response_model=BgmUploadResponse,
     summary="Upload the BGM file to the songs directory",
 )
-def upload_bgm_file(request: Request, file: UploadFile = File(...)):
+def upload_bgm_file(background_tasks: BackgroundTasks, request: Request, file: UploadFile = File(...)):
     request_id = base.get_task_id(request)
     # check file ext
     if file.filename.endswith("mp3"):
@@ -216,6 +288,8 @@ def upload_bgm_file(request: Request, file: UploadFile = File(...)):
             # If the file already exists, it will be overwritten
             file.file.seek(0)
             buffer.write(file.file.read())
+        # decode and analyse the new song after the response instead of in the first task that picks it
+        background_tasks.add_task(_index_bgm_file, save_path)
         response = {"file": save_path}
         return utils.get_response(200, response)
 
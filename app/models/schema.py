@@ -70,6 +70,25 @@ class MaterialInfo:
     duration: int = 0
 
 
+class TimelineClip(BaseModel):
+    file_path: str
+    start_time: float
+    end_time: float
+    transition: Optional[str] = None
+    transition_side: Optional[str] = None
+
+
+class Timeline(BaseModel):
+    width: int
+    height: int
+    fps: int = 30
+    duration: float
+    clips: List[TimelineClip] = []
+    audio_file: str
+    subtitle_path: str = ""
+    bgm_file: str = ""
+
+
 class VideoParams(BaseModel):
     video_subject: str
     # MODIFIED: O roteiro pode ser fornecido como um texto completo, que será então dividido em cenas, ou deixado em branco para a IA gerar tudo.
@@ -95,9 +114,13 @@ class VideoParams(BaseModel):
     bgm_type: Optional[str] = "random"
     bgm_file: Optional[str] = ""
     bgm_volume: Optional[float] = 0.2
+    # gain of the bgm while the narration speaks, 1.0 disables ducking, defaults to bgm_ducking in config.toml
+    bgm_ducking: Optional[float] = None
 
     subtitle_enabled: Optional[bool] = True
     subtitle_position: Optional[str] = "bottom"
+    # "overlay", "ass" or "textclip", defaults to subtitle_renderer in config.toml
+    subtitle_renderer: Optional[str] = None
     custom_position: float = 70.0
     font_name: Optional[str] = "STHeitiMedium.ttc"
     text_fore_color: Optional[str] = "#FFFFFF"
@@ -108,6 +131,17 @@ class VideoParams(BaseModel):
     stroke_width: float = 1.5
     n_threads: Optional[int] = 2
     paragraph_number: Optional[int] = 1
+    # "multi_pass" or "single_pass", defaults to render_mode in config.toml
+    render_mode: Optional[str] = None
+    # "draft", "standard", "archive" or a profile from config.toml, defaults to encoder_profile in config.toml
+    encoder_profile: Optional[str] = None
+    # short side in pixels of smaller renditions encoded alongside the final video, e.g. [720, 480]
+    video_renditions: Optional[List[int]] = None
+    # a jpeg of one frame and a sheet of evenly spaced thumbnails, written next to the final video
+    video_poster: Optional[bool] = False
+    video_sprite: Optional[bool] = False
+    # also write the final video as an hls playlist that can be played while it is encoded
+    video_hls: Optional[bool] = False
 
 
 class SubtitleRequest(BaseModel):
@@ -0,0 +1,212 @@
+import glob
+import hashlib
+import os
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from typing import List
+
+import numpy as np
+from loguru import logger
+
+from app.config import config
+from app.services.utils import audio_mix, ffmpeg_utils
+from app.utils import utils
+
+_columns = [
+    "pcm_file",
+    "frames",
+    "duration",
+    "loudness",
+    "loop_start",
+    "loop_end",
+]
+
+# windows quieter than this rms (about -50 dBFS) are silence around the music, not looped
+_silence_threshold = 0.003 * 32768
+_silence_window = 0.01
+# leading and trailing silence is only searched for in the first and last seconds of a song
+_silence_scan = 30
+# normalization never boosts a quiet song by more than this
+_max_gain_db = 10.0
+
+
+def _loop_points(pcm: np.ndarray) -> tuple:
+    """
+    the first and last frames of the song that are not silence.
+    """
+    hop = int(_silence_window * audio_mix.sample_rate)
+    scan = min(int(_silence_scan * audio_mix.sample_rate) // hop * hop, len(pcm) // hop * hop)
+    if not scan:
+        return 0, len(pcm)
+
+    def loud_windows(samples):
+        windows = samples.astype(np.float32).reshape(-1, hop, audio_mix.channels)
+        rms = np.sqrt(np.mean(windows**2, axis=(1, 2)))
+        return np.flatnonzero(rms > _silence_threshold)
+
+    head = loud_windows(pcm[:scan])
+    tail = loud_windows(pcm[len(pcm) - scan :])
+    loop_start = int(head[0]) * hop if len(head) else 0
+    loop_end = len(pcm) - scan + (int(tail[-1]) + 1) * hop if len(tail) else len(pcm)
+    if loop_end <= loop_start:
+        return 0, len(pcm)
+    return loop_start, loop_end
+
+
+class BgmLibrary:
+    """
+    index of the background music. every song is decoded once into a raw 16-bit pcm file that
+    the mixer memory-maps, and analysed for its duration, integrated loudness and loop points.
+    entries are keyed by path, mtime and size like the media index, a changed song is analysed again.
+    """
+
+    def __init__(self, db_file: str, cache_dir: str, target_loudness: float = 0):
+        self.db_file = db_file
+        self.cache_dir = cache_dir
+        # LUFS every song is normalized to, 0 disables the normalization
+        self.target_loudness = target_loudness
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        # the connection's own context manager commits or rolls back but never closes it
+        with closing(sqlite3.connect(self.db_file, timeout=30)) as conn, conn:
+            yield conn
+
+    def _init_db(self):
+        with self.lock, self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS songs (
+                    path TEXT PRIMARY KEY,
+                    mtime REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    pcm_file TEXT NOT NULL,
+                    frames INTEGER NOT NULL,
+                    duration REAL NOT NULL,
+                    loudness REAL NOT NULL,
+                    loop_start INTEGER NOT NULL,
+                    loop_end INTEGER NOT NULL
+                )
+                """
+            )
+
+    @staticmethod
+    def _identity(file_path: str):
+        stat = os.stat(file_path)
+        return os.path.abspath(file_path), stat.st_mtime, stat.st_size
+
+    def _load(self, path: str, mtime: float, size: int):
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(_columns)} FROM songs WHERE path=? AND mtime=? AND size=?",
+                (path, mtime, size),
+            ).fetchone()
+        if not row or not os.path.isfile(row[0]):
+            return None
+        return {"path": path, **dict(zip(_columns, row))}
+
+    def _analyse(self, path: str, mtime: float, size: int) -> dict:
+        key = hashlib.sha256(f"{path}:{mtime}:{size}".encode("utf-8")).hexdigest()[:32]
+        pcm_file = os.path.join(self.cache_dir, f"{key}.pcm")
+        temp_file = f"{pcm_file}.tmp"
+        loudness = ffmpeg_utils.decode_pcm(path, temp_file, audio_mix.sample_rate, audio_mix.channels)
+        os.replace(temp_file, pcm_file)
+
+        pcm = self._map(pcm_file)
+        loop_start, loop_end = _loop_points(pcm)
+        info = {
+            "path": path,
+            "pcm_file": pcm_file,
+            "frames": len(pcm),
+            "duration": len(pcm) / audio_mix.sample_rate,
+            "loudness": loudness,
+            "loop_start": loop_start,
+            "loop_end": loop_end,
+        }
+        with self._connect() as conn:
+            old = conn.execute("SELECT pcm_file FROM songs WHERE path=?", (path,)).fetchone()
+            conn.execute(
+                f"INSERT OR REPLACE INTO songs (path, mtime, size, {', '.join(_columns)}) "
+                f"VALUES (?, ?, ?, {', '.join('?' * len(_columns))})",
+                (path, mtime, size, *[info[c] for c in _columns]),
+            )
+        if old and old[0] != pcm_file and os.path.isfile(old[0]):
+            os.remove(old[0])
+        logger.info(
+            f"bgm indexed: {os.path.basename(path)}, {info['duration']:.1f}s, {loudness:.1f} LUFS, "
+            f"loop {loop_start / audio_mix.sample_rate:.2f}s - {loop_end / audio_mix.sample_rate:.2f}s"
+        )
+        return info
+
+    @staticmethod
+    def _map(pcm_file: str) -> np.ndarray:
+        if not os.path.getsize(pcm_file):
+            return np.zeros((0, audio_mix.channels), dtype="<i2")
+        return np.memmap(pcm_file, dtype="<i2", mode="r").reshape(-1, audio_mix.channels)
+
+    def get(self, file_path: str) -> dict:
+        """
+        returns pcm_file, frames, duration, loudness (LUFS), loop_start and loop_end (frames),
+        the song is decoded and analysed on first access.
+        """
+        path, mtime, size = self._identity(file_path)
+        # one song is decoded at a time, tasks asking for the same song wait for it
+        with self.lock:
+            info = self._load(path, mtime, size)
+            if info:
+                return info
+            return self._analyse(path, mtime, size)
+
+    def gain(self, info: dict) -> float:
+        """
+        linear gain that brings the song to the target loudness.
+        """
+        if not self.target_loudness:
+            return 1.0
+        gain_db = min(self.target_loudness - info["loudness"], _max_gain_db)
+        return float(10 ** (gain_db / 20))
+
+    def samples(self, file_path: str, duration: float) -> np.ndarray:
+        """
+        float32 samples of the song looped over duration and normalized, sliced from its pcm
+        cache without decoding.
+        """
+        info = self.get(file_path)
+        frames = int(round(duration * audio_mix.sample_rate))
+        looped = audio_mix.loop(self._map(info["pcm_file"]), frames, info["loop_start"], info["loop_end"])
+        return looped.astype(np.float32) * np.float32(self.gain(info) / 32768)
+
+    def refresh(self, song_dir: str = "") -> List[dict]:
+        """
+        index new and changed songs of song_dir and forget the ones that were removed.
+        """
+        song_dir = song_dir or utils.song_dir()
+        songs = []
+        for file_path in sorted(glob.glob(os.path.join(song_dir, "*.mp3"))):
+            try:
+                songs.append(self.get(file_path))
+            except Exception as e:
+                logger.error(f"failed to index bgm {file_path}: {str(e)}")
+
+        song_dir = os.path.abspath(song_dir)
+        with self.lock, self._connect() as conn:
+            rows = conn.execute("SELECT path, pcm_file FROM songs").fetchall()
+            for path, pcm_file in rows:
+                if os.path.dirname(path) == song_dir and not os.path.isfile(path):
+                    conn.execute("DELETE FROM songs WHERE path=?", (path,))
+                    if os.path.isfile(pcm_file):
+                        os.remove(pcm_file)
+                    logger.info(f"bgm removed from the library: {os.path.basename(path)}")
+        return songs
+
+
+library = BgmLibrary(
+    db_file=os.path.join(utils.storage_dir(create=True), "bgm_library.db"),
+    cache_dir=utils.storage_dir("cache_bgm"),
+    target_loudness=float(config.app.get("bgm_target_loudness", -20.0)),
+)
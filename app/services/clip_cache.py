@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from loguru import logger
+
+from app.config import config
+from app.utils import utils
+
+
+class ClipCache:
+    """
+    content-addressed cache of normalized subclips shared by all tasks.
+    entries are evicted least-recently-used first once the cache grows beyond max_size.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        if self.enabled and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    @staticmethod
+    def make_key(file_path: str, start_time: float, end_time: float, **target) -> str:
+        """
+        the key covers the source file identity (path, size and mtime), the window
+        and every setting that changes the encoded output.
+        """
+        stat = os.stat(file_path)
+        payload = {
+            "file": os.path.abspath(file_path),
+            "size": stat.st_size,
+            "mtime": int(stat.st_mtime),
+            "start": round(float(start_time), 3),
+            "end": round(float(end_time), 3),
+            **target,
+        }
+        text = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.mp4")
+
+    def get(self, key: str, target_file: str) -> bool:
+        """
+        materialize a cached clip at target_file, returns False on a cache miss.
+        """
+        if not self.enabled:
+            return False
+        entry = self._entry_path(key)
+        with self.lock:
+            if not os.path.isfile(entry):
+                return False
+            # touch the entry, eviction order is based on mtime
+            os.utime(entry, None)
+            _link_or_copy(entry, target_file)
+        logger.debug(f"clip cache hit: {key}")
+        return True
+
+    def put(self, key: str, clip_file: str):
+        if not self.enabled or not os.path.isfile(clip_file):
+            return
+        entry = self._entry_path(key)
+        temp_entry = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with self.lock:
+                _link_or_copy(clip_file, temp_entry)
+                os.replace(temp_entry, entry)
+                self._evict()
+        except Exception as e:
+            logger.warning(f"failed to cache clip {clip_file}: {str(e)}")
+            if os.path.exists(temp_entry):
+                os.remove(temp_entry)
+
+    def _evict(self):
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".mp4"):
+                continue
+            file_path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_path))
+            total_size += stat.st_size
+
+        if total_size <= self.max_size:
+            return
+
+        entries.sort()
+        for _, size, file_path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(file_path)
+                total_size -= size
+                logger.debug(f"clip cache evicted: {file_path}")
+            except FileNotFoundError:
+                pass
+
+
+def _link_or_copy(src: str, dst: str):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        # a hard link costs nothing and deleting the temp clip keeps the cache entry
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _cache_dir() -> str:
+    cache_dir = config.app.get("clip_cache_directory", "").strip()
+    if not cache_dir:
+        cache_dir = utils.storage_dir("cache_clips")
+    return cache_dir
+
+
+cache = ClipCache(
+    cache_dir=_cache_dir(),
+    max_size=int(config.app.get("clip_cache_max_size_mb", 0)) * 1024 * 1024,
+)
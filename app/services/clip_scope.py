@@ -0,0 +1,82 @@
+import gc
+import threading
+import time
+
+from loguru import logger
+
+
+def close_clip(clip):
+    """
+    close the readers of a clip, its audio, mask, background and child clips, which terminates
+    the ffmpeg processes behind them. memory is released by reference counting, no garbage
+    collection is run here, a ClipScope collects once at the end of the stage.
+    closing a clip twice is harmless.
+    """
+    stack = [clip]
+    seen = set()
+    while stack:
+        clip = stack.pop()
+        # subclips share readers and children with their source, close every object once
+        if clip is None or id(clip) in seen:
+            continue
+        seen.add(id(clip))
+        try:
+            reader = getattr(clip, "reader", None)
+            if reader is not None:
+                reader.close()
+            stack.append(getattr(clip, "audio", None))
+            stack.append(getattr(clip, "mask", None))
+            if getattr(clip, "created_bg", False):
+                stack.append(getattr(clip, "bg", None))
+            stack.extend(getattr(clip, "clips", None) or [])
+
+            # drop the references, frames held by the children can be freed right away
+            if getattr(clip, "audio", None) is not None:
+                clip.audio = None
+            if getattr(clip, "mask", None) is not None:
+                clip.mask = None
+            if hasattr(clip, "clips"):
+                clip.clips = []
+        except Exception as e:
+            logger.error(f"failed to close clip: {str(e)}")
+
+
+class ClipScope:
+    """
+    moviepy clips opened during one render stage.
+    tracked clips are closed when the scope exits, also when the stage fails, and the garbage
+    collector runs once for the whole stage instead of once per closed clip.
+    scopes nested in a stage pass collect=False.
+    """
+
+    def __init__(self, name: str, collect: bool = True):
+        self.name = name
+        self.collect = collect
+        self.clips = []
+        self.lock = threading.Lock()
+
+    def track(self, clip):
+        with self.lock:
+            self.clips.append(clip)
+        return clip
+
+    def close(self):
+        with self.lock:
+            clips, self.clips = self.clips, []
+        for clip in reversed(clips):
+            close_clip(clip)
+        return len(clips)
+
+    def __enter__(self) -> "ClipScope":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        closed = self.close()
+        if not self.collect:
+            return
+        start = time.perf_counter()
+        collected = gc.collect()
+        logger.debug(
+            f"clip scope {self.name}: closed {closed} clips, "
+            f"collected {collected} objects in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
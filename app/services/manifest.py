@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import threading
+from typing import List
+
+from loguru import logger
+
+from app.utils import utils
+
+
+def file_checksum(file_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def params_fingerprint(params: dict) -> str:
+    text = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class RenderManifest:
+    """
+    checkpoints of one task, kept in storage/tasks/<task_id>/manifest.json.
+    completed stages, normalized clips and output files are recorded with their checksums,
+    a resumed task only reuses artifacts whose files are still intact.
+    """
+
+    def __init__(self, manifest_file: str):
+        self.manifest_file = manifest_file
+        self.lock = threading.RLock()
+        self.data = self._load()
+
+    @classmethod
+    def for_task(cls, task_id: str) -> "RenderManifest":
+        return cls(os.path.join(utils.task_dir(task_id), "manifest.json"))
+
+    @staticmethod
+    def _empty(fingerprint: str = "") -> dict:
+        return {"fingerprint": fingerprint, "stages": {}, "plan": None, "clips": {}, "files": {}}
+
+    def _load(self) -> dict:
+        if not os.path.isfile(self.manifest_file):
+            return self._empty()
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                return {**self._empty(), **json.load(f)}
+        except Exception as e:
+            logger.warning(f"invalid render manifest {self.manifest_file}, starting over: {str(e)}")
+            return self._empty()
+
+    def save(self):
+        # write to a temp file first, a crash never leaves a truncated manifest behind
+        temp_file = f"{self.manifest_file}.tmp"
+        with self.lock:
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_file, self.manifest_file)
+
+    def reset(self, fingerprint: str = ""):
+        with self.lock:
+            self.data = self._empty(fingerprint)
+            self.save()
+
+    @property
+    def fingerprint(self) -> str:
+        return self.data["fingerprint"]
+
+    def _record(self, file_path: str) -> dict:
+        return {"size": os.path.getsize(file_path), "sha256": file_checksum(file_path)}
+
+    def _is_intact(self, file_path: str, record: dict) -> bool:
+        if not record or not os.path.isfile(file_path):
+            return False
+        if os.path.getsize(file_path) != record["size"]:
+            return False
+        return file_checksum(file_path) == record["sha256"]
+
+    def add_file(self, file_path: str):
+        record = self._record(file_path)
+        with self.lock:
+            self.data["files"][file_path] = record
+            self.save()
+
+    def has_file(self, file_path: str) -> bool:
+        with self.lock:
+            record = self.data["files"].get(file_path)
+        return self._is_intact(file_path, record)
+
+    def complete_stage(self, name: str, outputs: dict, files: List[str] = None):
+        files = [file_path for file_path in files or [] if file_path]
+        records = {file_path: self._record(file_path) for file_path in files}
+        with self.lock:
+            self.data["stages"][name] = {"outputs": outputs, "files": records}
+            self.save()
+
+    def get_stage(self, name: str) -> dict | None:
+        """
+        outputs of a completed stage, None if it never completed or one of its files changed.
+        """
+        with self.lock:
+            stage = self.data["stages"].get(name)
+        if not stage:
+            return None
+        for file_path, record in stage["files"].items():
+            if not self._is_intact(file_path, record):
+                logger.warning(f"checkpoint of stage {name} is invalid, {file_path} is missing or changed")
+                return None
+        return stage["outputs"]
+
+    def get_plan(self):
+        with self.lock:
+            return self.data["plan"]
+
+    def set_plan(self, plan: dict):
+        with self.lock:
+            self.data["plan"] = plan
+            self.save()
+
+    def add_clip(self, key: str, file_path: str = None, **info):
+        """
+        record a normalized clip, file_path is None for a window that failed to normalize.
+        """
+        record = self._record(file_path) if file_path else {}
+        with self.lock:
+            self.data["clips"][key] = {"file_path": file_path, **info, **record}
+            self.save()
+
+    def get_clips(self) -> dict:
+        """
+        recorded clips whose files are still intact, failed windows are kept as well.
+        """
+        with self.lock:
+            clips = dict(self.data["clips"])
+        return {
+            key: clip
+            for key, clip in clips.items()
+            if not clip["file_path"] or self._is_intact(clip["file_path"], clip)
+        }
+
+    def has_clips(self) -> bool:
+        with self.lock:
+            return bool(self.data["clips"])
+
+    def clear_clips(self):
+        with self.lock:
+            self.data["clips"] = {}
+            self.save()
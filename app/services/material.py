@@ -5,10 +5,10 @@ from urllib.parse import urlencode
 
 import requests
 from loguru import logger
-from moviepy.video.io.VideoFileClip import VideoFileClip
-
 from app.config import config
 from app.models.schema import MaterialInfo, VideoAspect, VideoConcatMode
+from app.services import media_index
+from app.services.utils import ffmpeg_utils
 from app.utils import utils
 
 requested_count = 0
@@ -179,12 +179,13 @@ def save_video(video_url: str, save_dir: str = "") -> str:
 
     if os.path.exists(video_path) and os.path.getsize(video_path) > 0:
         try:
-            clip = VideoFileClip(video_path)
-            duration = clip.duration
-            fps = clip.fps
-            clip.close()
-            if duration > 0 and fps > 0:
-                return video_path
+            info = media_index.index.get(video_path)
+            if not info["codec"] or info["duration"] <= 0 or info["fps"] <= 0:
+                raise ValueError(f"codec: {info['codec']}, duration: {info['duration']}, fps: {info['fps']}")
+            # a truncated download passes the probe, its last second can not be decoded
+            if not ffmpeg_utils.decodes_tail(video_path, info["duration"]):
+                raise ValueError("truncated, no frame could be decoded at the end")
+            return video_path
         except Exception as e:
             try:
                 os.remove(video_path)
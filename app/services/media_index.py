@@ -0,0 +1,126 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+from typing import List
+
+from loguru import logger
+
+from app.services.utils import ffmpeg_utils
+from app.utils import utils
+
+_columns = [
+    "duration",
+    "width",
+    "height",
+    "fps",
+    "codec",
+    "pix_fmt",
+    "time_base",
+    "has_audio",
+]
+
+
+class MediaIndex:
+    """
+    persistent cache of probed media metadata, keyed by path, mtime and size.
+    a stale or missing entry is probed again on first access.
+    """
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.lock = threading.Lock()
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        # the connection's own context manager commits or rolls back but never closes it
+        with closing(sqlite3.connect(self.db_file, timeout=30)) as conn, conn:
+            yield conn
+
+    def _init_db(self):
+        with self.lock, self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS media (
+                    path TEXT PRIMARY KEY,
+                    mtime REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    duration REAL,
+                    width INTEGER,
+                    height INTEGER,
+                    fps REAL,
+                    codec TEXT,
+                    pix_fmt TEXT,
+                    time_base TEXT,
+                    has_audio INTEGER,
+                    keyframes TEXT
+                )
+                """
+            )
+
+    @staticmethod
+    def _identity(file_path: str):
+        stat = os.stat(file_path)
+        return os.path.abspath(file_path), stat.st_mtime, stat.st_size
+
+    def _load(self, path: str, mtime: float, size: int):
+        with self.lock, self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(_columns)}, keyframes FROM media WHERE path=? AND mtime=? AND size=?",
+                (path, mtime, size),
+            ).fetchone()
+        if not row:
+            return None
+        info = dict(zip(_columns, row[:-1]))
+        info["has_audio"] = bool(info["has_audio"])
+        info["keyframes"] = json.loads(row[-1]) if row[-1] else None
+        return info
+
+    def get(self, file_path: str) -> dict:
+        """
+        returns duration, width, height, fps, codec, pix_fmt, time_base, has_audio
+        and keyframes (None until get_keyframes was called for the file).
+        """
+        path, mtime, size = self._identity(file_path)
+        try:
+            info = self._load(path, mtime, size)
+            if info:
+                return info
+        except sqlite3.Error as e:
+            logger.warning(f"failed to read media index: {str(e)}")
+
+        info = ffmpeg_utils.probe(file_path)
+        info["keyframes"] = None
+        try:
+            with self.lock, self._connect() as conn:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO media (path, mtime, size, {', '.join(_columns)}) "
+                    f"VALUES (?, ?, ?, {', '.join('?' * len(_columns))})",
+                    (path, mtime, size, *[info[c] for c in _columns]),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"failed to update media index: {str(e)}")
+        return info
+
+    def get_keyframes(self, file_path: str) -> List[float]:
+        info = self.get(file_path)
+        if info["keyframes"] is not None:
+            return info["keyframes"]
+
+        keyframes = ffmpeg_utils.probe_keyframes(file_path)
+        path, mtime, size = self._identity(file_path)
+        try:
+            with self.lock, self._connect() as conn:
+                conn.execute(
+                    "UPDATE media SET keyframes=? WHERE path=? AND mtime=? AND size=?",
+                    (json.dumps(keyframes), path, mtime, size),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"failed to update media index: {str(e)}")
+        return keyframes
+
+
+index = MediaIndex(db_file=os.path.join(utils.storage_dir(create=True), "media_index.db"))
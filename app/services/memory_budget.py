@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+
+from loguru import logger
+
+from app.config import config
+from app.models.schema import VideoAspect
+from app.services.utils import frame_pipeline
+
+_mb = 1024 * 1024
+
+# a task that only calls the llm, the tts or downloads materials
+light_task_mb = 150
+# ffmpeg processes and python buffers of one render, independent of the resolution
+render_overhead_mb = 250
+# rgb frames held at once by one moviepy render: decoder pipes, composite, letterbox canvas, writer pipe
+render_frames = 24
+# yuv420p frames kept by the x264 encoders (lookahead, reference and b-frames, frame threads)
+encoder_frames = 120
+# extra memory of a spawned clip worker process on top of its frames
+clip_worker_mb = 120
+# characters of narration per subtitle line
+chars_per_subtitle_line = 25
+
+
+def _frame_mb(width: int, height: int, bytes_per_pixel: float) -> float:
+    return width * height * bytes_per_pixel / _mb
+
+
+def estimate_task_memory(params=None, stop_at: str = "video") -> int:
+    """
+    rough peak memory of one task in MB, computed from its params before it starts.
+    it grows with the output resolution, the number of variants rendered at the same time,
+    the clip worker processes and the subtitle images held by the textclip and overlay renderers.
+    """
+    if stop_at not in ("video", "preview"):
+        return light_task_mb
+
+    width, height = VideoAspect(getattr(params, "video_aspect", None) or VideoAspect.portrait).to_resolution()
+    if stop_at == "preview":
+        scale = config.app.get("preview_scale", 1 / 3)
+        width, height = int(width * scale), int(height * scale)
+
+    rgb_frame = _frame_mb(width, height, 3)
+    yuv_frame = _frame_mb(width, height, 1.5)
+    pipeline_frames = 0
+    queue_size = int(config.app.get("frame_queue_size", 4))
+    if queue_size > 0:
+        # buffer pool of the frame pipeline of the final encode
+        pipeline_frames = frame_pipeline.pool_size(queue_size)
+    render = render_overhead_mb + rgb_frame * (render_frames + pipeline_frames) + yuv_frame * encoder_frames
+
+    video_count = getattr(params, "video_count", None) or 1
+    variants = min(video_count, max(1, int(config.app.get("variant_workers", 1))))
+
+    subtitles = 0
+    renderer = getattr(params, "subtitle_renderer", None) or config.app.get("subtitle_renderer", "overlay")
+    if getattr(params, "subtitle_enabled", True) and renderer != "ass":
+        # every subtitle line is kept as an rgba image (textclip) or an rgb image and a mask (overlay)
+        script = getattr(params, "video_script", "") or ""
+        characters = len(script) or (getattr(params, "paragraph_number", None) or 1) * 300
+        lines = characters / chars_per_subtitle_line
+        font_size = getattr(params, "font_size", 60)
+        subtitles = lines * _frame_mb(int(width * 0.9), int(font_size * 2.5), 4)
+
+    clip_workers = max(1, int(config.app.get("clip_workers", 1)))
+    workers = 0
+    if clip_workers > 1:
+        workers = clip_workers * (clip_worker_mb + render)
+
+    return int(light_task_mb + variants * (render + subtitles) + workers)
+
+
+def process_tree_rss(pid: int = None) -> int:
+    """
+    resident memory of a process and all its descendants (ffmpeg, clip workers) in bytes.
+    it is read from /proc, 0 on platforms without it.
+    """
+    pid = pid or os.getpid()
+    if not os.path.isdir("/proc"):
+        return 0
+
+    children = {}
+    rss_pages = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat", "r") as f:
+                # the command name in parentheses may contain spaces
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(name))
+        rss_pages[int(name)] = int(fields[21])
+
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        total += rss_pages.get(current, 0)
+        stack.extend(children.get(current, []))
+    return total * os.sysconf("SC_PAGE_SIZE")
+
+
+class RssSampler:
+    """
+    samples the resident memory of the server process tree in a background thread.
+    tracks the current value and the peak reached while each running task was active.
+    """
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.current = process_tree_rss()
+        # memory of the process with no task running, estimates are compared against the usage above it
+        self.idle = self.current
+        self.peaks = {}
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                rss = process_tree_rss()
+            except Exception as e:
+                logger.warning(f"failed to sample memory usage: {str(e)}")
+                continue
+            with self.lock:
+                self.current = rss
+                if not self.peaks:
+                    self.idle = rss
+                for task_id in self.peaks:
+                    self.peaks[task_id] = max(self.peaks[task_id], rss)
+
+    @property
+    def used_mb(self) -> int:
+        """
+        memory used by running tasks, as sampled.
+        """
+        with self.lock:
+            return max(0, self.current - self.idle) // _mb
+
+    def start_task(self, task_id: str):
+        with self.lock:
+            self.peaks[task_id] = self.current
+
+    def finish_task(self, task_id: str) -> int:
+        """
+        peak memory of the process tree above idle while the task ran, in MB.
+        it includes tasks that ran at the same time.
+        """
+        with self.lock:
+            peak = self.peaks.pop(task_id, self.current)
+            return max(0, peak - self.idle) // _mb
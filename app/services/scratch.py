@@ -0,0 +1,167 @@
+import os
+import shutil
+import threading
+from typing import Callable, List
+
+from loguru import logger
+
+from app.config import config
+from app.utils import utils
+
+
+def _dir_size(directory: str) -> int:
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                # deleted while walking
+                pass
+    return total
+
+
+class TaskScratch:
+    """
+    intermediates of one task (normalized clips, audio mix, video tracks before muxing).
+    files go to the scratch root while the task and global quotas allow it, and spill over
+    into the task directory once either quota is reached.
+    """
+
+    def __init__(self, space: "ScratchSpace", task_id: str):
+        self.space = space
+        self.task_id = task_id
+        self.scratch_dir = os.path.join(space.root, task_id)
+        self.spill_dir = os.path.join(utils.task_dir(task_id), "scratch")
+        self.peak_bytes = 0
+        # expected sizes of files handed out but not written yet, they count against the quotas
+        self.expected = {}
+        self.lock = threading.Lock()
+        os.makedirs(self.scratch_dir, exist_ok=True)
+
+    @property
+    def used_bytes(self) -> int:
+        used = _dir_size(self.scratch_dir)
+        if self.spill_dir != self.scratch_dir and os.path.isdir(self.spill_dir):
+            used += _dir_size(self.spill_dir)
+        return used
+
+    def measure(self) -> int:
+        used = self.used_bytes
+        with self.lock:
+            self.peak_bytes = max(self.peak_bytes, used)
+        return used
+
+    def reserved_bytes(self) -> int:
+        with self.lock:
+            self.expected = {path: size for path, size in self.expected.items() if not os.path.exists(path)}
+            return sum(self.expected.values())
+
+    def path(self, name: str, expected_bytes: int = 0) -> str:
+        """
+        path for a new intermediate file of about expected_bytes.
+        the quotas are checked before the file is written, against the files already written
+        and the expected sizes of the ones handed out before.
+        """
+        self.measure()
+        reserved = self.reserved_bytes() + expected_bytes
+        if self.space.task_quota and _dir_size(self.scratch_dir) + reserved > self.space.task_quota:
+            return self._spill(name, "task quota")
+        if self.space.total_quota and self.space.used_bytes + reserved > self.space.total_quota:
+            return self._spill(name, "global quota")
+        file_path = os.path.join(self.scratch_dir, name)
+        with self.lock:
+            self.expected[file_path] = expected_bytes
+        return file_path
+
+    def _spill(self, name: str, reason: str) -> str:
+        logger.warning(f"scratch {reason} reached, writing {name} to {self.spill_dir}")
+        os.makedirs(self.spill_dir, exist_ok=True)
+        return os.path.join(self.spill_dir, name)
+
+    def delete(self, files: List[str] | str):
+        # measure first, the peak is reached right before intermediates are released
+        self.measure()
+        if isinstance(files, str):
+            files = [files]
+        for file in files:
+            if os.path.isfile(file):
+                os.remove(file)
+
+    def close(self, keep: bool = False):
+        self.measure()
+        self.space.release(self.task_id, keep)
+
+
+class ScratchSpace:
+    """
+    scratch root shared by all tasks of this server, one directory per task.
+    the root can be on tmpfs (e.g. /dev/shm/moneyprinter) to keep hot intermediates in RAM.
+    """
+
+    def __init__(self, root: str, task_quota: int = 0, total_quota: int = 0):
+        self.root = root
+        self.task_quota = task_quota
+        self.total_quota = total_quota
+        self.lock = threading.Lock()
+        self.active = set()
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def used_bytes(self) -> int:
+        return _dir_size(self.root)
+
+    def open(self, task_id: str) -> TaskScratch:
+        with self.lock:
+            self.active.add(task_id)
+        return TaskScratch(self, task_id)
+
+    def release(self, task_id: str, keep: bool = False):
+        with self.lock:
+            self.active.discard(task_id)
+        if keep:
+            logger.info(f"keeping scratch of task {task_id} for a resumed run")
+            return
+        self.cleanup(task_id)
+
+    def cleanup(self, task_id: str):
+        for directory in (os.path.join(self.root, task_id), os.path.join(utils.task_dir(), task_id, "scratch")):
+            if os.path.isdir(directory):
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def cleanup_orphans(self, keep: Callable[[str], bool] = None):
+        """
+        remove the scratch left behind by tasks of a previous run of the server,
+        except the ones keep() asks for. tasks running in this process are never touched.
+        """
+        removed = 0
+        tasks_dir = utils.task_dir()
+        task_ids = set(os.listdir(self.root)) | {
+            task_id
+            for task_id in os.listdir(tasks_dir)
+            if os.path.isdir(os.path.join(tasks_dir, task_id, "scratch"))
+        }
+        for task_id in sorted(task_ids):
+            with self.lock:
+                if task_id in self.active:
+                    continue
+            if keep and keep(task_id):
+                continue
+            self.cleanup(task_id)
+            removed += 1
+        if removed:
+            logger.info(f"removed the scratch of {removed} finished tasks from {self.root}")
+
+
+def _scratch_root() -> str:
+    root = config.app.get("scratch_directory", "").strip()
+    if not root:
+        root = utils.storage_dir("scratch")
+    return root
+
+
+space = ScratchSpace(
+    root=_scratch_root(),
+    task_quota=int(config.app.get("scratch_task_quota_mb", 0)) * 1024 * 1024,
+    total_quota=int(config.app.get("scratch_total_quota_mb", 0)) * 1024 * 1024,
+)
@@ -43,7 +43,9 @@ class MemoryState(BaseState):
         if progress > 100:
             progress = 100
 
+        # fields of earlier updates are kept (e.g. the memory estimate), as in RedisState
         self._tasks[task_id] = {
+            **self._tasks.get(task_id, {}),
             "task_id": task_id,
             "state": state,
             "progress": progress,
@@ -1,8 +1,10 @@
 # app/services/task.py
 
+import json
 import math
 import os.path
 import re
+from contextlib import contextmanager
 from os import path
 
 from loguru import logger
@@ -10,9 +12,10 @@ from loguru import logger
 from app.config import config
 from app.models import const
 # MODIFIED: Importando os novos schemas para o roteiro estruturado
-from app.models.schema import VideoConcatMode, VideoParams, StructuredScript, Scene
-from app.services import llm, material, subtitle, video, voice
+from app.models.schema import VideoConcatMode, VideoParams, StructuredScript, Scene, Timeline
+from app.services import llm, material, media_index, scratch, subtitle, video, voice
 from app.services import state as sm
+from app.services.manifest import RenderManifest, params_fingerprint
 from app.utils import utils
 
 # MODIFIED: Esta função foi reescrita para gerar um roteiro estruturado.
@@ -152,7 +155,10 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
     
     if params.video_source == "local":
         materials = video.preprocess_video(
-            materials=params.video_materials, clip_duration=params.video_clip_duration
+            materials=params.video_materials,
+            clip_duration=params.video_clip_duration,
+            encoder_profile=params.encoder_profile,
+            max_workers=config.app.get("clip_workers", 1),
         )
         if not materials:
             sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
@@ -176,84 +182,293 @@ def get_video_materials(task_id, params, video_terms, audio_duration):
         return downloaded_videos
 
 
-def generate_final_videos(task_id, params, downloaded_videos, audio_file, subtitle_path):
+@contextmanager
+def scratch_scope(task_id: str, manifest: RenderManifest = None):
     """
-    Função auxiliar para combinar clipes e renderizar o vídeo final com áudio e legendas.
+    Espaço de rascunho dos arquivos intermediários da tarefa, removido ao final com sucesso ou falha.
+    Clipes registrados no manifesto por uma combinação interrompida são mantidos para a retomada.
     """
-    logger.info("\n\n## 5. Gerando Vídeos Finais")
-    final_video_paths = []
-    combined_video_paths = []
-    
-    _progress = 50
-    for i in range(params.video_count):
-        index = i + 1
-        combined_video_path = path.join(utils.task_dir(task_id), f"combined-{index}.mp4")
-        logger.info(f"Combinando vídeo: {index} => {combined_video_path}")
-        video.combine_videos(
-            combined_video_path=combined_video_path,
-            video_paths=downloaded_videos,
-            audio_file=audio_file,
-            video_aspect=params.video_aspect,
-            video_concat_mode=params.video_concat_mode,
-            video_transition_mode=params.video_transition_mode,
-            max_clip_duration=params.video_clip_duration,
-            threads=params.n_threads,
+    task_scratch = scratch.space.open(task_id)
+    try:
+        yield task_scratch
+    finally:
+        task_scratch.close(keep=manifest is not None and manifest.has_clips())
+        logger.info(f"Espaço de rascunho usado pela tarefa: {task_scratch.peak_bytes / 1024 / 1024:.1f} MB")
+        task = sm.state.get_task(task_id) or {}
+        sm.state.update_task(
+            task_id,
+            state=task.get("state", const.TASK_STATE_PROCESSING),
+            progress=task.get("progress", 0),
+            scratch_bytes=task_scratch.peak_bytes,
         )
 
-        _progress += 50 / params.video_count / 2
-        sm.state.update_task(task_id, progress=_progress)
-
-        final_video_path = path.join(utils.task_dir(task_id), f"final-{index}.mp4")
-        logger.info(f"Renderizando vídeo final: {index} => {final_video_path}")
-        video.generate_video(
-            video_path=combined_video_path,
-            audio_path=audio_file,
-            subtitle_path=subtitle_path,
-            output_file=final_video_path,
-            params=params,
-        )
 
-        _progress += 50 / params.video_count / 2
-        sm.state.update_task(task_id, progress=_progress)
+def generate_final_videos(task_id, params, downloaded_videos, audio_file, subtitle_path, manifest: RenderManifest = None, task_scratch=None):
+    """
+    Função auxiliar para combinar clipes e renderizar o vídeo final com áudio e legendas.
+    Com um manifesto, as variantes já concluídas em uma execução interrompida são mantidas.
+    """
+    logger.info("\n\n## 5. Gerando Vídeos Finais")
+    combined_video_paths = []
 
-        final_video_paths.append(final_video_path)
-        combined_video_paths.append(combined_video_path)
+    render_mode = params.render_mode or config.app.get("render_mode", "multi_pass")
+    variant_workers = config.app.get("variant_workers", 1)
+    indexes = range(1, params.video_count + 1)
+    final_video_paths = [path.join(utils.task_dir(task_id), f"final-{index}.mp4") for index in indexes]
+    # Vídeos finais íntegros de uma execução anterior não são renderizados de novo.
+    pending = [
+        i for i, final_video_path in enumerate(final_video_paths)
+        if not (manifest and manifest.has_file(final_video_path))
+    ]
+    if len(pending) < len(final_video_paths):
+        logger.info(f"Retomando: {len(final_video_paths) - len(pending)} vídeo(s) final(is) já concluído(s)")
+    if not pending:
+        if render_mode != "single_pass":
+            combined_video_paths = [path.join(utils.task_dir(task_id), f"combined-{index}.mp4") for index in indexes]
+        sm.state.update_task(task_id, progress=100)
+        return final_video_paths, combined_video_paths
+
+    if params.video_hls:
+        # As playlists ficam disponíveis enquanto os vídeos finais ainda são codificados.
+        playlists = [video.hls_playlist_file(final_video_path) for final_video_path in final_video_paths]
+        sm.state.update_task(task_id, progress=50, playlists=playlists)
+
+    if render_mode == "single_pass":
+        # Monta uma linha do tempo por variante e codifica cada vídeo final uma só vez.
+        # Legendas e mixagem de áudio são geradas uma vez e compartilhadas entre as variantes.
+        logger.info(f"Renderizando {len(pending)} vídeo(s) final(is) em passagem única")
+        timelines = []
+        for _ in pending:
+            timeline = video.build_timeline(
+                video_paths=downloaded_videos,
+                audio_file=audio_file,
+                subtitle_path=subtitle_path,
+                params=params,
+            )
+            if timelines:
+                timeline = timeline.model_copy(update={"bgm_file": timelines[0].bgm_file})
+            timelines.append(timeline)
+        pending_paths = [final_video_paths[i] for i in pending]
+        video.render_timelines(timelines, pending_paths, params, max_workers=variant_workers, scratch=task_scratch)
+        if manifest:
+            for final_video_path in pending_paths:
+                for output_file in video.final_output_files(final_video_path, params):
+                    manifest.add_file(output_file)
+        sm.state.update_task(task_id, progress=100)
+        logger.success("Vídeos finais gerados com sucesso.")
+        return final_video_paths, combined_video_paths
+
+    # As variantes compartilham os mesmos clipes normalizados, mudando apenas a ordem.
+    combined_video_paths = [path.join(utils.task_dir(task_id), f"combined-{index}.mp4") for index in indexes]
+    # O plano de clipes é calculado antes de qualquer codificação e fica visível no estado da tarefa.
+    plan = video.plan_video_variants(
+        video_paths=downloaded_videos,
+        audio_duration=media_index.index.get(audio_file)["duration"],
+        count=len(combined_video_paths),
+        video_concat_mode=VideoConcatMode(params.video_concat_mode),
+        video_transition_mode=params.video_transition_mode,
+        max_clip_duration=params.video_clip_duration,
+        manifest=manifest,
+    )
+    sm.state.update_task(task_id, progress=50, plan=plan)
+    logger.info(f"Combinando vídeos: {', '.join(combined_video_paths)}")
+    video.combine_video_variants(
+        combined_video_paths=combined_video_paths,
+        video_paths=downloaded_videos,
+        audio_file=audio_file,
+        video_aspect=params.video_aspect,
+        video_concat_mode=params.video_concat_mode,
+        video_transition_mode=params.video_transition_mode,
+        max_clip_duration=params.video_clip_duration,
+        threads=params.n_threads,
+        max_workers=config.app.get("clip_workers", 1),
+        encoder_profile=params.encoder_profile,
+        variant_workers=variant_workers,
+        manifest=manifest,
+        scratch=task_scratch,
+        plan=plan,
+    )
+    sm.state.update_task(task_id, progress=75)
+
+    pending_paths = [final_video_paths[i] for i in pending]
+    logger.info(f"Renderizando vídeos finais: {', '.join(pending_paths)}")
+    video.generate_videos(
+        video_paths=[combined_video_paths[i] for i in pending],
+        audio_path=audio_file,
+        subtitle_path=subtitle_path,
+        output_files=pending_paths,
+        params=params,
+        max_workers=variant_workers,
+        scratch=task_scratch,
+    )
+    if manifest:
+        for final_video_path in pending_paths:
+            for output_file in video.final_output_files(final_video_path, params):
+                manifest.add_file(output_file)
+    sm.state.update_task(task_id, progress=100)
 
     logger.success("Vídeos finais gerados com sucesso.")
     return final_video_paths, combined_video_paths
 
 
-def start(task_id: str, params: VideoParams, stop_at: str = "video"):
+def save_timeline(task_id: str, timeline: Timeline):
+    """
+    Salva a linha do tempo (plano de clipes, áudio, legendas e BGM) no diretório da tarefa.
+    """
+    timeline_file = path.join(utils.task_dir(task_id), "timeline.json")
+    with open(timeline_file, "w", encoding="utf-8") as f:
+        f.write(timeline.model_dump_json(indent=4))
+    logger.info(f"Linha do tempo salva em: {timeline_file}")
+    return timeline_file
+
+
+def load_timeline(task_id: str) -> Timeline | None:
+    timeline_file = path.join(utils.task_dir(task_id), "timeline.json")
+    if not os.path.exists(timeline_file):
+        return None
+    with open(timeline_file, "r", encoding="utf-8") as f:
+        return Timeline.model_validate_json(f.read())
+
+
+def load_saved_params(task_id: str) -> VideoParams | None:
+    script_file = path.join(utils.task_dir(task_id), "script.json")
+    if not os.path.exists(script_file):
+        return None
+    with open(script_file, "r", encoding="utf-8") as f:
+        script_data = json.load(f)
+    return VideoParams(**script_data["params"])
+
+
+def generate_preview(task_id, params, downloaded_videos, audio_file, subtitle_path, task_scratch=None):
+    """
+    Renderiza uma prévia em baixa resolução a partir da mesma linha do tempo usada no render final.
+    """
+    logger.info("\n\n## 5. Gerando Prévia")
+    timeline = video.build_timeline(
+        video_paths=downloaded_videos,
+        audio_file=audio_file,
+        subtitle_path=subtitle_path,
+        params=params,
+    )
+    save_timeline(task_id, timeline)
+
+    preview_path = path.join(utils.task_dir(task_id), "preview.mp4")
+    video.render_preview(
+        timeline,
+        preview_path,
+        params,
+        scale=config.app.get("preview_scale", 1 / 3),
+        preview_fps=config.app.get("preview_fps", 12),
+        scratch=task_scratch,
+    )
+    logger.success(f"Prévia gerada com sucesso: {preview_path}")
+    return preview_path, timeline
+
+
+def promote(task_id: str, params: VideoParams = None):
+    """
+    Promove uma prévia para o render final, reaproveitando o áudio, as legendas e o plano de clipes.
+    A prévia tem um único plano de clipes, então a promoção gera exatamente um vídeo (final-1.mp4),
+    mesmo que params.video_count seja maior.
+    """
+    logger.info(f"Promovendo prévia da tarefa: {task_id}")
+    timeline = load_timeline(task_id)
+    params = params or load_saved_params(task_id)
+    if not timeline or not params:
+        logger.error(f"Nenhuma prévia encontrada para a tarefa: {task_id}")
+        sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
+        return None
+
+    if (params.video_count or 1) > 1:
+        logger.warning(f"A prévia tem um único plano de clipes, video_count={params.video_count} é ignorado.")
+    final_video_path = path.join(utils.task_dir(task_id), "final-1.mp4")
+    # A playlist fica disponível enquanto o vídeo final ainda é codificado.
+    playlists = [video.hls_playlist_file(final_video_path)] if params.video_hls else []
+    sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50, playlists=playlists)
+    with scratch_scope(task_id) as task_scratch:
+        video.render_timeline(timeline, final_video_path, params, scratch=task_scratch)
+
+    kwargs = {
+        "videos": video.final_output_files(final_video_path, params),
+        "combined_videos": [],
+        "playlists": playlists,
+        "audio_file": timeline.audio_file,
+        "subtitle_path": timeline.subtitle_path,
+        "materials": list(dict.fromkeys(clip.file_path for clip in timeline.clips)),
+        "timeline": timeline.model_dump(),
+    }
+    sm.state.update_task(task_id, state=const.TASK_STATE_COMPLETE, progress=100, **kwargs)
+    logger.success(f"Tarefa {task_id} promovida: {final_video_path}")
+    return kwargs
+
+
+def open_manifest(task_id: str, params: VideoParams, resume: bool = False) -> RenderManifest:
+    """
+    Abre o manifesto de renderização da tarefa. Sem resume, ou se os parâmetros mudaram,
+    os checkpoints anteriores são descartados e a tarefa recomeça do início.
+    """
+    manifest = RenderManifest.for_task(task_id)
+    fingerprint = params_fingerprint(params.dict(exclude_none=True))
+    if resume and manifest.fingerprint == fingerprint:
+        logger.info(f"Retomando tarefa a partir do manifesto: {manifest.manifest_file}")
+        return manifest
+    if resume:
+        logger.warning("Nenhum checkpoint compatível com estes parâmetros, recomeçando do início.")
+    manifest.reset(fingerprint)
+    return manifest
+
+
+def start(task_id: str, params: VideoParams, stop_at: str = "video", resume: bool = False):
     """
     Função principal que orquestra todo o processo de criação de vídeo.
+    Com resume=True, as etapas registradas no manifesto da tarefa cujos arquivos
+    continuam íntegros (mesmo checksum) não são executadas de novo.
     """
-    logger.info(f"Iniciando tarefa: {task_id}, Parar em: {stop_at}")
+    logger.info(f"Iniciando tarefa: {task_id}, Parar em: {stop_at}, Retomar: {resume}")
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=5)
+    manifest = open_manifest(task_id, params, resume)
 
     # Passo 1: Gerar Roteiro Estruturado
-    structured_script = generate_structured_script(task_id, params)
-    if not structured_script:
-        return  # A função interna já definiu a tarefa como falha
+    checkpoint = manifest.get_stage("script")
+    if checkpoint:
+        logger.info("Roteiro retomado do checkpoint.")
+        structured_script = StructuredScript(**checkpoint["script"])
+        video_terms = checkpoint["terms"]
+    else:
+        structured_script = generate_structured_script(task_id, params)
+        if not structured_script:
+            return  # A função interna já definiu a tarefa como falha
 
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=15, script=structured_script.dict())
     
     # Passo 2: Agregar dados do roteiro estruturado para os próximos serviços.
     # Junta a narração de todas as cenas em um único texto para o TTS.
     full_narration_text = " ".join([scene.voiceover_text for scene in structured_script.scenes])
-    # Agrega palavras-chave de todas as cenas para a busca de materiais.
-    video_terms = llm.get_aggregated_keywords_from_script(structured_script)
-    
-    # Salva o roteiro e os parâmetros no disco.
-    save_script_data(task_id, structured_script, params)
+    if not checkpoint:
+        # Agrega palavras-chave de todas as cenas para a busca de materiais.
+        video_terms = llm.get_aggregated_keywords_from_script(structured_script)
+
+        # Salva o roteiro e os parâmetros no disco.
+        save_script_data(task_id, structured_script, params)
+        manifest.complete_stage("script", {"script": structured_script.dict(), "terms": video_terms})
 
     if stop_at == "script":
         sm.state.update_task(task_id, state=const.TASK_STATE_COMPLETE, progress=100, script=structured_script.dict())
         return {"script": structured_script.dict()}
 
     # Passo 3: Gerar Áudio
-    audio_file, audio_duration, sub_maker = generate_audio(task_id, params, full_narration_text)
-    if not audio_file:
-        return
+    # O áudio e as legendas formam um único checkpoint, as legendas dependem do sub_maker,
+    # que só existe em memória durante a geração do áudio.
+    checkpoint = manifest.get_stage("audio")
+    if checkpoint:
+        logger.info("Áudio e legendas retomados do checkpoint.")
+        audio_file = checkpoint["audio_file"]
+        audio_duration = checkpoint["audio_duration"]
+        subtitle_path = checkpoint["subtitle_path"]
+    else:
+        audio_file, audio_duration, sub_maker = generate_audio(task_id, params, full_narration_text)
+        if not audio_file:
+            return
 
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=30)
     if stop_at == "audio":
@@ -261,7 +476,13 @@ def start(task_id: str, params: VideoParams, stop_at: str = "video"):
         return {"audio_file": audio_file, "audio_duration": audio_duration}
 
     # Passo 4: Gerar Legendas
-    subtitle_path = generate_subtitle(task_id, params, full_narration_text, sub_maker, audio_file)
+    if not checkpoint:
+        subtitle_path = generate_subtitle(task_id, params, full_narration_text, sub_maker, audio_file)
+        manifest.complete_stage(
+            "audio",
+            {"audio_file": audio_file, "audio_duration": audio_duration, "subtitle_path": subtitle_path},
+            [audio_file, subtitle_path],
+        )
     if stop_at == "subtitle":
         sm.state.update_task(task_id, state=const.TASK_STATE_COMPLETE, progress=100, subtitle_path=subtitle_path)
         return {"subtitle_path": subtitle_path}
@@ -269,9 +490,15 @@ def start(task_id: str, params: VideoParams, stop_at: str = "video"):
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=40)
 
     # Passo 5: Obter Materiais de Vídeo
-    downloaded_videos = get_video_materials(task_id, params, video_terms, audio_duration)
-    if not downloaded_videos:
-        return
+    checkpoint = manifest.get_stage("materials")
+    if checkpoint:
+        logger.info("Materiais de vídeo retomados do checkpoint.")
+        downloaded_videos = checkpoint["materials"]
+    else:
+        downloaded_videos = get_video_materials(task_id, params, video_terms, audio_duration)
+        if not downloaded_videos:
+            return
+        manifest.complete_stage("materials", {"materials": downloaded_videos}, downloaded_videos)
 
     if stop_at == "materials":
         sm.state.update_task(task_id, state=const.TASK_STATE_COMPLETE, progress=100, materials=downloaded_videos)
@@ -279,13 +506,48 @@ def start(task_id: str, params: VideoParams, stop_at: str = "video"):
 
     sm.state.update_task(task_id, state=const.TASK_STATE_PROCESSING, progress=50)
 
+    if stop_at == "preview":
+        with scratch_scope(task_id) as task_scratch:
+            preview_path, timeline = generate_preview(
+                task_id, params, downloaded_videos, audio_file, subtitle_path, task_scratch
+            )
+        kwargs = {
+            "preview_video": preview_path,
+            "timeline": timeline.model_dump(),
+            "audio_file": audio_file,
+            "audio_duration": audio_duration,
+            "subtitle_path": subtitle_path,
+            "materials": downloaded_videos,
+        }
+        sm.state.update_task(task_id, state=const.TASK_STATE_COMPLETE, progress=100, **kwargs)
+        return kwargs
+
     # Passo 6: Gerar Vídeos Finais
-    final_video_paths, combined_video_paths = generate_final_videos(
-        task_id, params, downloaded_videos, audio_file, subtitle_path
-    )
+    checkpoint = manifest.get_stage("videos")
+    if checkpoint:
+        logger.info("Vídeos finais retomados do checkpoint.")
+        final_video_paths = checkpoint["videos"]
+        combined_video_paths = checkpoint["combined_videos"]
+    else:
+        with scratch_scope(task_id, manifest) as task_scratch:
+            final_video_paths, combined_video_paths = generate_final_videos(
+                task_id, params, downloaded_videos, audio_file, subtitle_path, manifest, task_scratch
+            )
+        # Cada vídeo final é seguido pelas renditions, pôster e sprite gerados junto com ele.
+        final_video_paths = [
+            output_file
+            for final_video_path in final_video_paths
+            for output_file in video.final_output_files(final_video_path, params)
+        ]
     if not final_video_paths:
         sm.state.update_task(task_id, state=const.TASK_STATE_FAILED)
         return
+    if not checkpoint:
+        manifest.complete_stage(
+            "videos",
+            {"videos": final_video_paths, "combined_videos": combined_video_paths},
+            final_video_paths,
+        )
 
     logger.success(f"Tarefa {task_id} finalizada. Gerados {len(final_video_paths)} vídeos.")
 
@@ -293,6 +555,11 @@ def start(task_id: str, params: VideoParams, stop_at: str = "video"):
     kwargs = {
         "videos": final_video_paths,
         "combined_videos": combined_video_paths,
+        "playlists": [
+            video.hls_playlist_file(final_video_path)
+            for final_video_path in final_video_paths
+            if path.isfile(video.hls_playlist_file(final_video_path))
+        ],
         "script": structured_script.dict(),
         "terms": video_terms,
         "audio_file": audio_file,
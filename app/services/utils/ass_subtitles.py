@@ -0,0 +1,150 @@
+import os
+from typing import List, Tuple
+
+from PIL import ImageColor, ImageFont
+
+from app.models.schema import VideoParams
+
+
+def ass_color(color, alpha: int = 0) -> str:
+    """
+    convert "#RRGGBB" or a color name into the &HAABBGGRR form used by ASS.
+    """
+    r, g, b = ImageColor.getrgb(color)[:3]
+    return f"&H{alpha:02X}{b:02X}{g:02X}{r:02X}"
+
+
+def ass_time(seconds: float) -> str:
+    centiseconds = int(round(seconds * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    secs, centiseconds = divmod(centiseconds, 100)
+    return f"{hours:d}:{minutes:02d}:{secs:02d}.{centiseconds:02d}"
+
+
+def font_family(font_path: str) -> str:
+    try:
+        return ImageFont.truetype(font_path, 10).getname()[0]
+    except Exception:
+        return os.path.splitext(os.path.basename(font_path))[0]
+
+
+# libass has no escape for a backslash ("\\" renders as two backslashes), an invisible word joiner
+# after it keeps sequences like "\N" or "\{" in the text literal
+_word_joiner = "\u2060"
+
+
+def _escape_text(text: str) -> str:
+    # backslashes first, the brace escapes below add backslashes of their own
+    text = text.replace("\\", "\\" + _word_joiner)
+    text = text.replace("{", "\\{").replace("}", "\\}")
+    return text.replace("\n", "\\N")
+
+
+def build_ass(
+    items: List[Tuple[float, float, str]],
+    params: VideoParams,
+    video_width: int,
+    video_height: int,
+    font_path: str,
+) -> str:
+    """
+    build an ASS script that reproduces the TextClip styling of generate_video.
+    items are (start, end, text) with line breaks already applied.
+    """
+    font_size = int(params.font_size)
+    margin_h = int(video_width * 0.05)
+    margin_v = int(video_height * 0.05)
+
+    # opaque box behind the text only when an explicit background color is set
+    border_style = 1
+    back_color = ass_color("#000000", alpha=0xFF)
+    if isinstance(params.text_background_color, str) and params.text_background_color:
+        border_style = 3
+        back_color = ass_color(params.text_background_color)
+
+    alignment = 2
+    if params.subtitle_position == "top":
+        alignment = 8
+    elif params.subtitle_position in ("center", "custom"):
+        alignment = 5
+
+    style = ",".join(
+        [
+            "Default",
+            font_family(font_path),
+            str(font_size),
+            ass_color(params.text_fore_color or "#FFFFFF"),
+            ass_color(params.text_fore_color or "#FFFFFF"),
+            ass_color(params.stroke_color or "#000000"),
+            back_color,
+            "0",
+            "0",
+            "0",
+            "0",
+            "100",
+            "100",
+            "0",
+            "0",
+            str(border_style),
+            str(params.stroke_width),
+            "0",
+            str(alignment),
+            str(margin_h),
+            str(margin_h),
+            str(margin_v),
+            "1",
+        ]
+    )
+
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {video_width}",
+        f"PlayResY: {video_height}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
+        "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, "
+        "Shadow, Alignment, MarginL, MarginR, MarginV, Encoding",
+        f"Style: {style}",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    for start, end, text in items:
+        override = ""
+        if params.subtitle_position == "custom":
+            # same clamping as generate_video, the text height is estimated from the line count
+            text_height = font_size * 1.25 * (text.count("\n") + 1)
+            margin = 10
+            custom_y = (video_height - text_height) * (params.custom_position / 100)
+            custom_y = max(margin, min(custom_y, video_height - text_height - margin))
+            override = f"{{\\an8\\pos({int(video_width / 2)},{int(custom_y)})}}"
+        lines.append(
+            f"Dialogue: 0,{ass_time(start)},{ass_time(end)},Default,,0,0,0,,{override}{_escape_text(text)}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def write_ass(ass_path: str, content: str) -> str:
+    with open(ass_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return ass_path
+
+
+def _escape_filter_value(value: str) -> str:
+    value = value.replace("\\", "/")
+    return value.replace(":", "\\:").replace("'", "\\'")
+
+
+def subtitles_filter(ass_path: str, fonts_dir: str = "") -> str:
+    """
+    ffmpeg filter that burns the ASS file in with libass.
+    """
+    vf = f"subtitles=filename='{_escape_filter_value(ass_path)}'"
+    if fonts_dir:
+        vf += f":fontsdir='{_escape_filter_value(fonts_dir)}'"
+    return vf
@@ -0,0 +1,120 @@
+import wave
+
+import numpy as np
+
+from app.services.utils import ffmpeg_utils
+
+sample_rate = 44100
+channels = 2
+
+# narration louder than this rms (about -40 dBFS) ducks the bgm
+ducking_threshold = 0.01
+# rms window of the narration envelope
+ducking_window = 0.02
+# the bgm stays ducked through pauses between words shorter than this
+ducking_hold = 0.3
+# length of the gain ramps into and out of the ducked level
+ducking_ramp = 0.15
+
+
+def decode_pcm(file_path: str) -> np.ndarray:
+    """
+    decode an audio file to float32 samples of shape (frames, channels) with a single ffmpeg run.
+    """
+    args = ["-i", file_path, "-vn", "-f", "f32le", "-ac", str(channels), "-ar", str(sample_rate), "-"]
+    samples = np.frombuffer(ffmpeg_utils.run_ffmpeg(args).stdout, dtype=np.float32)
+    # copy, the buffer of the ffmpeg output is read-only
+    return samples[: len(samples) // channels * channels].reshape(-1, channels).copy()
+
+
+def loop(samples: np.ndarray, frames: int, loop_start: int = 0, loop_end: int = None) -> np.ndarray:
+    """
+    exactly frames of the samples: played once up to loop_end, then the section between
+    loop_start and loop_end repeated. works on memory-mapped samples, only the slices
+    that are used are read.
+    """
+    loop_end = min(loop_end or len(samples), len(samples))
+    if loop_end >= frames or loop_end <= loop_start:
+        looped = samples[: min(frames, len(samples))]
+    else:
+        section = samples[loop_start:loop_end]
+        repeats = -(-(frames - loop_end) // len(section))
+        looped = np.concatenate([samples[:loop_end], np.tile(section, (repeats, 1))])[:frames]
+    if len(looped) < frames:
+        # silence after a song too short to loop
+        looped = np.concatenate([looped, np.zeros((frames - len(looped), looped.shape[1]), dtype=looped.dtype)])
+    return looped
+
+
+def fade_out(samples: np.ndarray, duration: float) -> np.ndarray:
+    frames = min(int(duration * sample_rate), len(samples))
+    if frames > 0:
+        samples[-frames:] *= np.linspace(1, 0, frames, dtype=np.float32)[:, None]
+    return samples
+
+
+def ducking_gain(voice: np.ndarray, frames: int, ducked_gain: float) -> np.ndarray:
+    """
+    gain of the bgm for every frame, ducked_gain while the narration is speaking and 1 otherwise,
+    like a sidechain compressor keyed by the narration.
+    """
+    hop = int(ducking_window * sample_rate)
+    windows = -(-frames // hop)
+    mono = np.zeros(windows * hop, dtype=np.float32)
+    speech = voice[:frames].mean(axis=1)
+    mono[: len(speech)] = speech
+    rms = np.sqrt(np.mean(mono.reshape(windows, hop) ** 2, axis=1))
+
+    active = (rms > ducking_threshold).astype(np.float32)
+    hold = max(int(ducking_hold / ducking_window), 1)
+    # keep ducking after each spoken window, short pauses do not pump the bgm back up
+    active = np.convolve(active, np.ones(hold, dtype=np.float32))[:windows] > 0
+    gain = np.where(active, ducked_gain, 1.0).astype(np.float32)
+
+    ramp = max(int(ducking_ramp / ducking_window), 1)
+    padded = np.pad(gain, (ramp // 2, ramp - 1 - ramp // 2), mode="edge")
+    gain = np.convolve(padded, np.ones(ramp, dtype=np.float32) / ramp, mode="valid")
+
+    # window centers to sample positions
+    centers = (np.arange(windows) + 0.5) * hop
+    return np.interp(np.arange(frames), centers, gain).astype(np.float32)
+
+
+def write_wav(samples: np.ndarray, output_file: str) -> str:
+    pcm = (np.clip(samples, -1, 1) * 32767).astype("<i2")
+    with wave.open(output_file, "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+    return output_file
+
+
+def mix(
+    voice_file: str,
+    output_file: str,
+    voice_volume: float = 1.0,
+    bgm: np.ndarray = None,
+    bgm_volume: float = 0.2,
+    bgm_fade_out: float = 3,
+    ducked_gain: float = 1.0,
+) -> str:
+    """
+    mix the narration and the bgm samples (float32, already looped to the video duration) into
+    one wav file. the bgm is faded out at the end and, with a ducked_gain below 1, lowered under
+    the narration. the result lasts as long as the longer of the two.
+    """
+    voice = decode_pcm(voice_file)
+    voice *= voice_volume
+    if bgm is None or not len(bgm):
+        return write_wav(voice, output_file)
+
+    bgm = bgm * bgm_volume
+    fade_out(bgm, bgm_fade_out)
+    if ducked_gain < 1:
+        bgm *= ducking_gain(voice, len(bgm), ducked_gain)[:, None]
+
+    mixed = np.zeros((max(len(voice), len(bgm)), channels), dtype=np.float32)
+    mixed[: len(voice)] += voice
+    mixed[: len(bgm)] += bgm
+    return write_wav(mixed, output_file)
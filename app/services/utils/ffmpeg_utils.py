@@ -0,0 +1,501 @@
+import hashlib
+import os
+import re
+import subprocess
+from typing import List
+
+from loguru import logger
+from moviepy.config import FFMPEG_BINARY
+
+
+def ffmpeg_binary() -> str:
+    return FFMPEG_BINARY
+
+
+def run_ffmpeg(args: List[str]) -> subprocess.CompletedProcess:
+    cmd = [ffmpeg_binary(), "-hide_banner", "-y", "-loglevel", "error", *args]
+    logger.debug(f"running ffmpeg: {' '.join(cmd)}")
+    result = subprocess.run(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL
+    )
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"ffmpeg failed ({result.returncode}): {result.stderr.decode(errors='ignore')}"
+        )
+    return result
+
+
+_duration_re = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+_video_stream_re = re.compile(r"Stream #\d+:\d+.*?: Video: (\w+)(.*)")
+_size_re = re.compile(r",\s*(\d{2,5})x(\d{2,5})")
+_fps_re = re.compile(r"([\d.]+)\s*fps")
+_tbn_re = re.compile(r"([\d.]+k?)\s*tbn")
+_top_level_comma_re = re.compile(r",\s*(?![^(]*\))")
+_rotation_re = re.compile(r"rotation of (-?[\d.]+) degrees")
+
+
+def probe(file_path: str) -> dict:
+    """
+    read basic stream information from the ffmpeg banner without decoding any frame.
+    """
+    cmd = [ffmpeg_binary(), "-hide_banner", "-i", file_path]
+    result = subprocess.run(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL
+    )
+    output = result.stderr.decode(errors="ignore")
+
+    info = {
+        "duration": 0.0,
+        "width": 0,
+        "height": 0,
+        "fps": 0.0,
+        "codec": "",
+        "pix_fmt": "",
+        "time_base": "",
+        "has_audio": " Audio: " in output,
+    }
+    match = _duration_re.search(output)
+    if match:
+        hours, minutes, seconds = match.groups()
+        info["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    match = _video_stream_re.search(output)
+    if match:
+        info["codec"] = match.group(1)
+        details = match.group(2)
+        size = _size_re.search(details)
+        if size:
+            info["width"], info["height"] = int(size.group(1)), int(size.group(2))
+        fps = _fps_re.search(details)
+        if fps:
+            info["fps"] = float(fps.group(1))
+        tbn = _tbn_re.search(details)
+        if tbn:
+            info["time_base"] = tbn.group(1)
+        # "h264 (High) (avc1 / 0x31637661), yuv420p(tv, bt709), 1080x1920, ..."
+        parts = _top_level_comma_re.split(details)
+        if len(parts) > 1:
+            pix_fmt = re.match(r"([a-z0-9_]+)", parts[1].strip())
+            if pix_fmt:
+                info["pix_fmt"] = pix_fmt.group(1)
+        # phone videos are often stored sideways with a display matrix,
+        # report the size the frames are decoded at
+        rotation = _rotation_re.search(output[match.end() :])
+        if rotation and round(abs(float(rotation.group(1)))) % 180 == 90:
+            info["width"], info["height"] = info["height"], info["width"]
+    return info
+
+
+_pts_time_re = re.compile(r"pts_time:\s*(-?[\d.]+)")
+
+
+def probe_keyframes(file_path: str) -> List[float]:
+    """
+    list keyframe timestamps, only keyframes are decoded so this stays cheap.
+    """
+    cmd = [
+        ffmpeg_binary(),
+        "-hide_banner",
+        "-skip_frame",
+        "nokey",
+        "-i",
+        file_path,
+        "-map",
+        "0:v:0",
+        "-vf",
+        "showinfo",
+        "-f",
+        "null",
+        "-",
+    ]
+    result = subprocess.run(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL
+    )
+    output = result.stderr.decode(errors="ignore")
+    return [round(float(t), 6) for t in _pts_time_re.findall(output)]
+
+
+def decodes_tail(file_path: str, duration: float) -> bool:
+    """
+    decode one video frame from the last second of the file. a truncated download still has an
+    intact header, so probe reports the full duration, but no frame can be decoded near its end.
+    """
+    result = run_ffmpeg(
+        [
+            "-ss",
+            f"{max(duration - 1, 0):.3f}",
+            "-i",
+            file_path,
+            "-map",
+            "0:v:0",
+            "-frames:v",
+            "1",
+            "-f",
+            "framemd5",
+            "-",
+        ]
+    )
+    # framemd5 writes one line per decoded frame after its "#" header
+    lines = result.stdout.decode(errors="ignore").splitlines()
+    return any(line and not line.startswith("#") for line in lines)
+
+
+_loudness_re = re.compile(r"Summary:.*?I:\s*(-?[\d.]+|-inf)\s*LUFS", re.S)
+
+
+def decode_pcm(file_path: str, output_file: str, sample_rate: int = 44100, channels: int = 2) -> float:
+    """
+    decode the audio of a file to raw 16-bit pcm and measure its integrated loudness (EBU R128)
+    in the same run. returns the loudness in LUFS, -70 for silence.
+    """
+    cmd = [
+        ffmpeg_binary(),
+        "-hide_banner",
+        "-nostats",
+        "-y",
+        "-loglevel",
+        "info",
+        "-i",
+        file_path,
+        "-vn",
+        "-af",
+        "ebur128=peak=none:framelog=quiet",
+        "-ac",
+        str(channels),
+        "-ar",
+        str(sample_rate),
+        "-f",
+        "s16le",
+        output_file,
+    ]
+    logger.debug(f"running ffmpeg: {' '.join(cmd)}")
+    result = subprocess.run(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL
+    )
+    output = result.stderr.decode(errors="ignore")
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {output[-2000:]}")
+    match = _loudness_re.search(output)
+    if not match or match.group(1) == "-inf":
+        return -70.0
+    return max(float(match.group(1)), -70.0)
+
+
+def _stream_signature(info: dict) -> tuple:
+    return (
+        info["codec"],
+        info["width"],
+        info["height"],
+        round(info["fps"], 3),
+        info["pix_fmt"],
+        info["time_base"],
+    )
+
+
+def parameter_sets(file_path: str) -> str:
+    """
+    digest of the h264 sps and pps of a file. mp4 keeps them once per file, so clips
+    joined by stream copy must share them or the later clips decode with the wrong ones.
+    """
+    cmd = [
+        ffmpeg_binary(),
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-i",
+        file_path,
+        "-map",
+        "0:v:0",
+        "-c:v",
+        "copy",
+        "-frames:v",
+        "1",
+        "-f",
+        "h264",
+        "-",
+    ]
+    result = subprocess.run(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL
+    )
+    digest = hashlib.sha1()
+    for nal in result.stdout.split(b"\x00\x00\x01"):
+        nal = nal.rstrip(b"\x00")
+        # nal unit types 7 (sps) and 8 (pps)
+        if nal and nal[0] & 0x1F in (7, 8):
+            digest.update(nal)
+    return digest.hexdigest()
+
+
+def can_stream_copy(file_paths: List[str]) -> bool:
+    """
+    clips can be joined without re-encoding only if every stream parameter matches.
+    """
+    signatures = set()
+    # looped clips repeat the same file, probe each one only once
+    for file_path in dict.fromkeys(file_paths):
+        info = probe(file_path)
+        if not info["codec"]:
+            return False
+        signature = _stream_signature(info)
+        if info["codec"] == "h264":
+            signature += (parameter_sets(file_path),)
+        signatures.add(signature)
+        if len(signatures) > 1:
+            return False
+    return len(signatures) == 1
+
+
+def cut(file_path: str, start_time: float, duration: float, output_file: str, fps: float = 30) -> str:
+    """
+    copy a window of the video stream without decoding it. the window must start on a
+    keyframe and end on one (or at the end of the file): it is limited by frame count,
+    since -t keeps reordered b-frames from past the end.
+    """
+    run_ffmpeg(
+        [
+            "-ss",
+            f"{start_time:.6f}",
+            "-i",
+            file_path,
+            "-frames:v",
+            str(max(int(round(duration * fps)), 1)),
+            "-map",
+            "0:v:0",
+            "-an",
+            "-c:v",
+            "copy",
+            "-avoid_negative_ts",
+            "make_zero",
+            output_file,
+        ]
+    )
+    return output_file
+
+
+def _escape_concat_path(file_path: str) -> str:
+    file_path = os.path.abspath(file_path).replace("\\", "/")
+    return file_path.replace("'", "'\\''")
+
+
+def write_concat_list(file_paths: List[str], list_file: str) -> str:
+    with open(list_file, "w", encoding="utf-8") as f:
+        for file_path in file_paths:
+            f.write(f"file '{_escape_concat_path(file_path)}'\n")
+    return list_file
+
+
+def concat(
+    file_paths: List[str],
+    output_file: str,
+    encoder_args: List[str] = None,
+    fps: int = 30,
+    threads: int = 2,
+) -> str:
+    """
+    join clips in a single pass with the concat demuxer.
+    streams are copied when all clips share the same codec parameters, otherwise
+    the joined result is encoded exactly once.
+    """
+    list_file = f"{output_file}.concat.txt"
+    write_concat_list(file_paths, list_file)
+    args = ["-f", "concat", "-safe", "0", "-i", list_file, "-map", "0:v", "-an"]
+    try:
+        if can_stream_copy(file_paths):
+            logger.info(f"concatenating {len(file_paths)} clips with stream copy")
+            run_ffmpeg([*args, "-c:v", "copy", output_file])
+        else:
+            logger.info(f"concatenating {len(file_paths)} clips with a single encode")
+            run_ffmpeg(
+                [
+                    *args,
+                    *(encoder_args or ["-c:v", "libx264"]),
+                    "-r",
+                    str(fps),
+                    "-pix_fmt",
+                    "yuv420p",
+                    "-threads",
+                    str(threads),
+                    output_file,
+                ]
+            )
+    finally:
+        try:
+            os.remove(list_file)
+        except Exception:
+            pass
+    return output_file
+
+
+def mux(video_file: str, audio_file: str, output_file: str, audio_args: List[str] = None) -> str:
+    """
+    put an audio track next to an encoded video without re-encoding the video.
+    the audio is copied unless audio_args encode it (e.g. a wav mix), and cut to the length of the video.
+    """
+    run_ffmpeg(
+        [
+            "-i",
+            video_file,
+            "-i",
+            audio_file,
+            "-map",
+            "0:v:0",
+            "-map",
+            "1:a:0",
+            "-c:v",
+            "copy",
+            *(audio_args or ["-c:a", "copy"]),
+            "-shortest",
+            "-movflags",
+            "+faststart",
+            output_file,
+        ]
+    )
+    return output_file
+
+
+def tee_escape(value: str) -> str:
+    """
+    escape a file name or an option value for the tee muxer.
+    """
+    for char in "\\:|[]'":
+        value = value.replace(char, "\\" + char)
+    return value
+
+
+def hls_tee_target(output_file: str, playlist_file: str, segment_time: float) -> str:
+    """
+    target of the tee muxer (-f tee) that writes a single encode both into output_file and progressively
+    into an event hls playlist of fragmented mp4 segments next to playlist_file, playable while the encode
+    runs. the encoder needs keyframes every segment_time seconds and global headers (-flags +global_header).
+    """
+    segment_file = os.path.join(os.path.dirname(playlist_file), "segment-%05d.m4s")
+    hls_options = [
+        "f=hls",
+        f"hls_time={segment_time}",
+        "hls_list_size=0",
+        "hls_playlist_type=event",
+        "hls_segment_type=fmp4",
+        # segments and the playlist are renamed into place once complete, clients never see partial files
+        "hls_flags=temp_file+independent_segments",
+        "hls_fmp4_init_filename=init.mp4",
+        # option values are unescaped once more than the file names
+        f"hls_segment_filename={tee_escape(tee_escape(segment_file))}",
+        "onfail=abort",
+    ]
+    return (
+        f"[f=mp4:movflags=+faststart:onfail=abort]{tee_escape(output_file)}"
+        f"|[{':'.join(hls_options)}]{tee_escape(playlist_file)}"
+    )
+
+
+def xfade_concat(
+    file_paths: List[str],
+    durations: List[float],
+    transitions: List[str],
+    output_file: str,
+    transition_duration: float = 1,
+    encoder_args: List[str] = None,
+    fps: int = 30,
+    threads: int = 2,
+    start_times: List[float] = None,
+    size: tuple = None,
+) -> str:
+    """
+    join clips with overlapping xfade transitions, encoded once.
+    transitions[i] is the xfade transition between clip i and clip i + 1,
+    every boundary shortens the result by transition_duration.
+    with start_times and size the inputs are raw sources: each window is cut,
+    scaled to fit and padded to size inside the same filter graph.
+    """
+    args = []
+    filters = []
+    for i, file_path in enumerate(file_paths):
+        if start_times is not None:
+            args += ["-ss", f"{start_times[i]:.3f}", "-t", f"{durations[i]:.3f}"]
+        args += ["-i", file_path]
+        chain = f"[{i}:v]"
+        if size:
+            width, height = size
+            chain += (
+                f"scale={width}:{height}:force_original_aspect_ratio=decrease:force_divisible_by=2,"
+                f"pad={width}:{height}:-1:-1:color=black,setsar=1,"
+            )
+        # xfade needs identical time bases, frame rates and pixel formats on both inputs
+        filters.append(f"{chain}settb=AVTB,setpts=PTS-STARTPTS,fps={fps},format=yuv420p[s{i}]")
+
+    last = "s0"
+    offset = 0
+    for i in range(1, len(file_paths)):
+        offset += durations[i - 1] - transition_duration
+        filters.append(
+            f"[{last}][s{i}]xfade=transition={transitions[i - 1]}"
+            f":duration={transition_duration:.3f}:offset={offset:.3f}[x{i}]"
+        )
+        last = f"x{i}"
+
+    logger.info(f"concatenating {len(file_paths)} clips with xfade transitions")
+    run_ffmpeg(
+        [
+            *args,
+            "-filter_complex",
+            ";".join(filters),
+            "-map",
+            f"[{last}]",
+            "-an",
+            *(encoder_args or ["-c:v", "libx264"]),
+            "-r",
+            str(fps),
+            "-pix_fmt",
+            "yuv420p",
+            "-threads",
+            str(threads),
+            output_file,
+        ]
+    )
+    return output_file
+
+
+def image_to_video(
+    image_file: str,
+    output_file: str,
+    duration: float,
+    zoom: float = 0.0,
+    size: tuple = None,
+    encoder_args: List[str] = None,
+    fps: int = 30,
+    threads: int = 2,
+) -> str:
+    """
+    turn a still image into a clip that slowly zooms into its center (ken burns).
+    the image is decoded once and zoompan crops and scales every frame natively,
+    the zoom grows linearly from 1 to 1 + zoom over the duration.
+    """
+    frames = max(int(round(duration * fps)), 1)
+    if size is None:
+        info = probe(image_file)
+        size = (info["width"], info["height"])
+    # libx264 needs even dimensions
+    width, height = max(size[0] // 2 * 2, 2), max(size[1] // 2 * 2, 2)
+    zoompan = (
+        f"zoompan=z='1+{zoom:.6f}*on/{frames}'"
+        f":x='iw/2-iw/zoom/2':y='ih/2-ih/zoom/2'"
+        f":d={frames}:s={width}x{height}:fps={fps}"
+    )
+    run_ffmpeg(
+        [
+            "-i",
+            image_file,
+            "-vf",
+            f"{zoompan},format=yuv420p",
+            "-frames:v",
+            str(frames),
+            "-an",
+            *(encoder_args or ["-c:v", "libx264"]),
+            "-r",
+            str(fps),
+            "-threads",
+            str(threads),
+            output_file,
+        ]
+    )
+    return output_file
@@ -0,0 +1,233 @@
+import queue
+import subprocess
+import threading
+import time
+from typing import Callable, List
+
+import numpy as np
+from loguru import logger
+
+from app.services.utils import ffmpeg_utils
+
+stages = ("decode", "composite", "encode")
+
+
+class _Stopped(Exception):
+    pass
+
+
+def pool_size(queue_size: int) -> int:
+    # both queues full, one frame in each stage and one more for the decoder, so it never waits on the pool
+    return 2 * queue_size + 3
+
+
+class FramePipeline:
+    """
+    streams the frames of a clip into an ffmpeg encoder with three threads connected by bounded queues:
+    decode (clip.get_frame, copied into a pooled buffer), composite (in-place, e.g. the subtitle overlay)
+    and encode (the raw buffer written to the encoder pipe). the numpy work, the decoder pipes and the
+    encoder pipe overlap instead of taking turns on one thread, and frame buffers come from a fixed pool
+    so no frame is allocated per frame.
+    """
+
+    def __init__(self, clip, fps: float, composite: Callable[[np.ndarray, float], np.ndarray] = None, queue_size: int = 4):
+        self.clip = clip
+        self.fps = fps
+        self.composite = composite
+        self.queue_size = queue_size
+        self.width, self.height = clip.size
+        # the same frame times as moviepy's iter_frames
+        self.frames = int(clip.duration * fps)
+
+        self.pool = queue.Queue()
+        for _ in range(pool_size(queue_size)):
+            self.pool.put(np.empty((self.height, self.width, 3), dtype=np.uint8))
+        self.queues = {
+            "decoded": queue.Queue(queue_size),
+            "composited": queue.Queue(queue_size),
+        }
+        self.stop = threading.Event()
+        self.errors = []
+        self.busy = dict.fromkeys(stages, 0.0)
+        self.done = dict.fromkeys(stages, 0)
+        # sum of the queue lengths seen by every put, and the number of puts
+        self.occupancy = {name: [0, 0] for name in self.queues}
+
+    def _get(self, q: queue.Queue):
+        while True:
+            if self.stop.is_set():
+                raise _Stopped()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def _put(self, name: str, item):
+        q = self.queues[name]
+        while True:
+            if self.stop.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        occupancy = self.occupancy[name]
+        occupancy[0] += q.qsize()
+        occupancy[1] += 1
+
+    def _decode(self):
+        for index in range(self.frames):
+            buffer = self._get(self.pool)
+            start = time.perf_counter()
+            t = index / self.fps
+            frame = self.clip.get_frame(t)
+            # masks are dropped like moviepy does for yuv420p output
+            np.copyto(buffer, frame[:, :, :3], casting="unsafe")
+            self.busy["decode"] += time.perf_counter() - start
+            self.done["decode"] += 1
+            self._put("decoded", (t, buffer))
+        self._put("decoded", None)
+
+    def _composite(self):
+        while (item := self._get(self.queues["decoded"])) is not None:
+            if self.composite:
+                start = time.perf_counter()
+                self.composite(item[1], item[0])
+                self.busy["composite"] += time.perf_counter() - start
+            self.done["composite"] += 1
+            self._put("composited", item)
+        self._put("composited", None)
+
+    def _encode(self, proc: subprocess.Popen):
+        while (item := self._get(self.queues["composited"])) is not None:
+            buffer = item[1]
+            start = time.perf_counter()
+            proc.stdin.write(buffer.data)
+            self.busy["encode"] += time.perf_counter() - start
+            self.done["encode"] += 1
+            self.pool.put(buffer)
+
+    def _run_stage(self, func, *args):
+        try:
+            func(*args)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            self.errors.append(e)
+            self.stop.set()
+
+    def run(
+        self,
+        output_file: str,
+        encoder_args: List[str],
+        threads: int = None,
+        extra_outputs: List[List[str]] = None,
+        inputs: List[str] = None,
+    ) -> dict:
+        """
+        extra_outputs are the options and file name of further outputs of the same ffmpeg run
+        (e.g. a scaled rendition), they are fed from the same frames. inputs are further input arguments,
+        the frames are always input 0.
+        """
+        cmd = [
+            ffmpeg_utils.ffmpeg_binary(),
+            "-hide_banner",
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-pix_fmt",
+            "rgb24",
+            "-s",
+            f"{self.width}x{self.height}",
+            "-r",
+            f"{self.fps:.02f}",
+            "-an",
+            "-i",
+            "-",
+            *(inputs or []),
+            *encoder_args,
+        ]
+        if threads:
+            cmd.extend(["-threads", str(threads)])
+        cmd.extend(["-pix_fmt", "yuv420p", output_file])
+        for extra_output in extra_outputs or []:
+            cmd.extend(extra_output)
+        logger.debug(f"running ffmpeg: {' '.join(cmd)}")
+
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        workers = [
+            threading.Thread(target=self._run_stage, args=(self._decode,), name="pipeline-decode"),
+            threading.Thread(target=self._run_stage, args=(self._composite,), name="pipeline-composite"),
+            threading.Thread(target=self._run_stage, args=(self._encode, proc), name="pipeline-encode"),
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if self.errors:
+            proc.kill()
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+        stderr = proc.stderr.read().decode(errors="ignore")
+        proc.wait()
+        if proc.returncode != 0 and (not self.errors or isinstance(self.errors[0], OSError)):
+            # a broken pipe only means the encoder failed first
+            raise RuntimeError(f"ffmpeg failed ({proc.returncode}): {stderr}")
+        if self.errors:
+            raise self.errors[0]
+        return self.report(time.perf_counter() - start)
+
+    def report(self, elapsed: float) -> dict:
+        stats = {
+            "frames": self.done["encode"],
+            "elapsed": elapsed,
+            "fps": self.done["encode"] / elapsed if elapsed else 0,
+            "stages": {
+                stage: {
+                    # frames per second of busy time, what the stage could sustain on its own
+                    "fps": self.done[stage] / self.busy[stage] if self.busy[stage] else 0,
+                    "busy": self.busy[stage] / elapsed if elapsed else 0,
+                }
+                for stage in stages
+            },
+            "queues": {
+                name: occupancy[0] / occupancy[1] if occupancy[1] else 0
+                for name, occupancy in self.occupancy.items()
+            },
+        }
+        stats["bottleneck"] = max(stages, key=lambda stage: self.busy[stage])
+        logger.info(
+            f"frame pipeline: {stats['frames']} frames in {elapsed:.1f}s ({stats['fps']:.1f} fps), "
+            + ", ".join(
+                f"{stage} {s['fps']:.0f} fps busy {s['busy']:.0%}" for stage, s in stats["stages"].items()
+            )
+            + ", queues "
+            + ", ".join(f"{name} {value:.1f}/{self.queue_size}" for name, value in stats["queues"].items())
+            + f", bottleneck: {stats['bottleneck']}"
+        )
+        return stats
+
+
+def write_frames(
+    clip,
+    output_file: str,
+    fps: float,
+    encoder_args: List[str],
+    composite: Callable[[np.ndarray, float], np.ndarray] = None,
+    threads: int = None,
+    queue_size: int = 4,
+    extra_outputs: List[List[str]] = None,
+    inputs: List[str] = None,
+) -> dict:
+    """
+    encode the frames of a clip, composite is applied to each frame in place. the clip's audio is not
+    read, an audio track can come from inputs. returns the pipeline stats.
+    """
+    return FramePipeline(clip, fps, composite, queue_size).run(output_file, encoder_args, threads, extra_outputs, inputs)
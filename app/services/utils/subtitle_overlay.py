@@ -0,0 +1,139 @@
+from bisect import bisect_right
+from typing import List
+
+import numpy as np
+from moviepy import Clip
+
+
+class OverlayImage:
+    def __init__(self, start: float, end: float, x: int, y: int, rgb: np.ndarray, alpha: np.ndarray):
+        self.start = start
+        self.end = end
+        self.x = x
+        self.y = y
+        self.rgb = rgb
+        self.alpha = alpha
+
+    @property
+    def size(self):
+        return self.rgb.shape[1], self.rgb.shape[0]
+
+
+class SubtitleOverlay:
+    """
+    subtitle track rendered once into cropped RGBA images with time ranges.
+    the active images for a frame are found by binary search on the start times
+    and alpha-blended into their bounding box only.
+    """
+
+    def __init__(self, images: List[OverlayImage]):
+        self.images = sorted(images, key=lambda image: image.start)
+        self.starts = [image.start for image in self.images]
+        # running maximum of end times, lets the lookup stop early with overlapping lines
+        self.max_ends = []
+        max_end = float("-inf")
+        for image in self.images:
+            max_end = max(max_end, image.end)
+            self.max_ends.append(max_end)
+
+    def __len__(self):
+        return len(self.images)
+
+    def active(self, t: float) -> List[OverlayImage]:
+        result = []
+        i = bisect_right(self.starts, t) - 1
+        while i >= 0 and self.max_ends[i] > t:
+            image = self.images[i]
+            if image.end > t:
+                result.append(image)
+            i -= 1
+        result.reverse()
+        return result
+
+    def blit(self, frame: np.ndarray, t: float) -> np.ndarray:
+        images = self.active(t)
+        if not images:
+            return frame
+
+        frame = np.array(frame, dtype=np.uint8, copy=True)
+        self._blend(frame, images)
+        return frame
+
+    def blit_into(self, frame: np.ndarray, t: float) -> np.ndarray:
+        """
+        blend the active images into frame in place, for frames from a buffer pool.
+        """
+        images = self.active(t)
+        if images:
+            self._blend(frame, images)
+        return frame
+
+    @staticmethod
+    def _blend(frame: np.ndarray, images: List[OverlayImage]):
+        frame_h, frame_w = frame.shape[:2]
+        for image in images:
+            w, h = image.size
+            x1, y1 = max(image.x, 0), max(image.y, 0)
+            x2, y2 = min(image.x + w, frame_w), min(image.y + h, frame_h)
+            if x1 >= x2 or y1 >= y2:
+                continue
+            ix, iy = x1 - image.x, y1 - image.y
+            rgb = image.rgb[iy : iy + y2 - y1, ix : ix + x2 - x1]
+            alpha = image.alpha[iy : iy + y2 - y1, ix : ix + x2 - x1]
+            region = frame[y1:y2, x1:x2].astype(np.float32)
+            region += (rgb - region) * alpha
+            frame[y1:y2, x1:x2] = region.astype(np.uint8)
+
+
+def _resolve_position(value, size: int, frame_size: int) -> int:
+    if value == "center":
+        return int((frame_size - size) / 2)
+    if value in ("left", "top"):
+        return 0
+    if value in ("right", "bottom"):
+        return frame_size - size
+    return int(value)
+
+
+def render_overlay_image(clip: Clip, video_width: int, video_height: int) -> OverlayImage | None:
+    """
+    rasterize a positioned text clip once, cropped to the visible pixels.
+    """
+    rgb = clip.get_frame(0)[:, :, :3].astype(np.float32)
+    if clip.mask is not None:
+        alpha = clip.mask.get_frame(0).astype(np.float32)
+    else:
+        alpha = np.ones(rgb.shape[:2], dtype=np.float32)
+
+    visible_rows = np.flatnonzero(alpha.max(axis=1) > 0)
+    visible_cols = np.flatnonzero(alpha.max(axis=0) > 0)
+    if not len(visible_rows) or not len(visible_cols):
+        return None
+    top, bottom = visible_rows[0], visible_rows[-1] + 1
+    left, right = visible_cols[0], visible_cols[-1] + 1
+
+    h, w = alpha.shape
+    pos_x, pos_y = clip.pos(0)
+    x = _resolve_position(pos_x, w, video_width)
+    y = _resolve_position(pos_y, h, video_height)
+    return OverlayImage(
+        start=clip.start,
+        end=clip.end if clip.end is not None else clip.start + clip.duration,
+        x=x + left,
+        y=y + top,
+        rgb=rgb[top:bottom, left:right],
+        alpha=alpha[top:bottom, left:right, np.newaxis],
+    )
+
+
+def build_subtitle_overlay(text_clips: List[Clip], video_width: int, video_height: int) -> SubtitleOverlay:
+    images = []
+    for clip in text_clips:
+        image = render_overlay_image(clip, video_width, video_height)
+        if image:
+            images.append(image)
+    return SubtitleOverlay(images)
+
+
+def apply_overlay(clip: Clip, overlay: SubtitleOverlay) -> Clip:
+    return clip.transform(lambda get_frame, t: overlay.blit(get_frame(t), t))
@@ -19,3 +19,18 @@ def slidein_transition(clip: Clip, t: float, side: str) -> Clip:
 # SlideOut
 def slideout_transition(clip: Clip, t: float, side: str) -> Clip:
     return clip.with_effects([vfx.SlideOut(t, side)])
+
+
+# ffmpeg xfade transition that plays the same role at the boundary between two clips
+def xfade_transition(transition: str, side: str = "left") -> str:
+    if transition == "FadeIn":
+        return "fade"
+    if transition == "FadeOut":
+        return "fadeblack"
+    if transition == "SlideIn":
+        # the next clip enters from the given side
+        return {"left": "slideright", "right": "slideleft", "top": "slidedown", "bottom": "slideup"}.get(side, "slideright")
+    if transition == "SlideOut":
+        # the previous clip leaves towards the given side
+        return {"left": "slideleft", "right": "slideright", "top": "slideup", "bottom": "slidedown"}.get(side, "slideleft")
+    return "fade"
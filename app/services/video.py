@@ -1,39 +1,54 @@
 import glob
 import itertools
+import multiprocessing
 import os
 import random
-import gc
 import shutil
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import List
+import numpy as np
 from loguru import logger
 from moviepy import (
-    AudioFileClip,
-    ColorClip,
-    CompositeAudioClip,
     CompositeVideoClip,
-    ImageClip,
     TextClip,
     VideoFileClip,
-    afx,
     concatenate_videoclips,
 )
-from moviepy.video.tools.subtitles import SubtitlesClip
+from moviepy.video.tools.subtitles import SubtitlesClip, file_to_subtitles
 from PIL import ImageFont
 
+from app.config import config
 from app.models import const
 from app.models.schema import (
     MaterialInfo,
+    Timeline,
+    TimelineClip,
     VideoAspect,
     VideoConcatMode,
     VideoParams,
     VideoTransitionMode,
 )
-from app.services.utils import video_effects
+from app.services import bgm_library, clip_cache, media_index
+from app.services.clip_scope import ClipScope, close_clip
+from app.services.manifest import RenderManifest
+from app.services.scratch import TaskScratch
+from app.services.utils import (
+    ass_subtitles,
+    audio_mix,
+    ffmpeg_utils,
+    frame_pipeline,
+    subtitle_overlay,
+    video_effects,
+)
 from app.utils import utils
 
 class SubClippedVideoClip:
-    def __init__(self, file_path, start_time=None, end_time=None, width=None, height=None, duration=None):
+    def __init__(self, file_path, start_time=None, end_time=None, width=None, height=None, duration=None, transition=None):
         self.file_path = file_path
+        # xfade transition into this clip when transitions are rendered in the concat stage
+        self.transition = transition
         self.start_time = start_time
         self.end_time = end_time
         self.width = width
@@ -50,43 +65,55 @@ class SubClippedVideoClip:
 audio_codec = "aac"
 video_codec = "libx264"
 fps = 30
+transition_duration = 1
+# the planner never cuts the last segment of a video shorter than this
+min_segment_duration = 0.5
+
+# named x264 trade-offs between speed and quality, extended or overridden by [encoder_profiles] in config.toml
+encoder_profiles = {
+    # internal review renders, a fraction of the standard encode time
+    "draft": {"preset": "ultrafast", "crf": 30, "tune": "fastdecode", "gop": 60, "audio_bitrate": "64k"},
+    # same output as the x264 and aac defaults
+    "standard": {"preset": "medium", "crf": 23, "tune": "", "gop": 250, "audio_bitrate": "128k"},
+    "archive": {"preset": "slow", "crf": 18, "tune": "film", "gop": 250, "audio_bitrate": "320k"},
+}
+
+
+def get_encoder_profile(name: str = None) -> dict:
+    name = name or config.app.get("encoder_profile", "standard")
+    profiles = {**encoder_profiles}
+    for profile_name, profile in config.encoder_profiles.items():
+        profiles[profile_name] = {**profiles.get(profile_name, encoder_profiles["standard"]), **profile}
+    if name not in profiles:
+        logger.warning(f"unknown encoder profile: {name}, using standard")
+        name = "standard"
+    return {"name": name, **profiles[name]}
 
-def close_clip(clip):
-    if clip is None:
-        return
-        
-    try:
-        # close main resources
-        if hasattr(clip, 'reader') and clip.reader is not None:
-            clip.reader.close()
-            
-        # close audio resources
-        if hasattr(clip, 'audio') and clip.audio is not None:
-            if hasattr(clip.audio, 'reader') and clip.audio.reader is not None:
-                clip.audio.reader.close()
-            del clip.audio
-            
-        # close mask resources
-        if hasattr(clip, 'mask') and clip.mask is not None:
-            if hasattr(clip.mask, 'reader') and clip.mask.reader is not None:
-                clip.mask.reader.close()
-            del clip.mask
-            
-        # handle child clips in composite clips
-        if hasattr(clip, 'clips') and clip.clips:
-            for child_clip in clip.clips:
-                if child_clip is not clip:  # avoid possible circular references
-                    close_clip(child_clip)
-            
-        # clear clip list
-        if hasattr(clip, 'clips'):
-            clip.clips = []
-            
-    except Exception as e:
-        logger.error(f"failed to close clip: {str(e)}")
-    
-    del clip
-    gc.collect()
+
+def encoder_ffmpeg_params(profile: dict) -> List[str]:
+    ffmpeg_params = ["-crf", str(profile["crf"]), "-g", str(profile["gop"])]
+    if profile.get("tune"):
+        ffmpeg_params.extend(["-tune", profile["tune"]])
+    return ffmpeg_params
+
+
+def encoder_write_args(profile: dict, ffmpeg_params: List[str] = None) -> dict:
+    """
+    keyword arguments for moviepy's write_videofile.
+    """
+    return {
+        "codec": video_codec,
+        "preset": profile["preset"],
+        "audio_bitrate": profile["audio_bitrate"],
+        "ffmpeg_params": encoder_ffmpeg_params(profile) + (ffmpeg_params or []),
+    }
+
+
+def encoder_args(profile: dict) -> List[str]:
+    """
+    video encoder arguments for a plain ffmpeg command.
+    """
+    return ["-c:v", video_codec, "-preset", profile["preset"], *encoder_ffmpeg_params(profile)]
 
 def delete_files(files: List[str] | str):
     if isinstance(files, str):
@@ -98,6 +125,23 @@ def delete_files(files: List[str] | str):
         except:
             pass
 
+def scratch_file(scratch: TaskScratch, output_dir: str, name: str, expected_bytes: int = 0) -> str:
+    # intermediates go to the task scratch space when there is one, next to the outputs otherwise
+    return scratch.path(name, expected_bytes) if scratch else os.path.join(output_dir, name)
+
+
+def expected_video_bytes(width: int, height: int, duration: float) -> int:
+    # about 0.1 bits per pixel, the size of a crf 23 h264 stream
+    return int(width * height * fps * duration * 0.1 / 8)
+
+
+def delete_intermediates(scratch: TaskScratch, files: List[str] | str):
+    if scratch:
+        scratch.delete(files)
+    else:
+        delete_files(files)
+
+
 def get_bgm_file(bgm_type: str = "random", bgm_file: str = ""):
     if not bgm_type:
         return ""
@@ -114,229 +158,982 @@ def get_bgm_file(bgm_type: str = "random", bgm_file: str = ""):
     return ""
 
 
-def combine_videos(
-    combined_video_path: str,
-    video_paths: List[str],
-    audio_file: str,
-    video_aspect: VideoAspect = VideoAspect.portrait,
-    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
-    video_transition_mode: VideoTransitionMode = None,
-    max_clip_duration: int = 5,
-    threads: int = 2,
-) -> str:
-    audio_clip = AudioFileClip(audio_file)
-    audio_duration = audio_clip.duration
-    logger.info(f"audio duration: {audio_duration} seconds")
-    # Required duration of each clip
-    req_dur = audio_duration / len(video_paths)
-    req_dur = max_clip_duration
-    logger.info(f"maximum clip duration: {req_dur} seconds")
-    output_dir = os.path.dirname(combined_video_path)
+def _snap_to_keyframe(keyframes: List[float], time: float, tolerance: float, before: bool = False):
+    """
+    the keyframe closest to time within tolerance, only looking after it (or before it).
+    """
+    if before:
+        i = bisect_right(keyframes, time + 1e-3) - 1
+        if i >= 0 and time - keyframes[i] <= tolerance:
+            return keyframes[i]
+        return None
+    i = bisect_left(keyframes, time - 1e-3)
+    if i < len(keyframes) and keyframes[i] - time <= tolerance:
+        return keyframes[i]
+    return None
 
-    aspect = VideoAspect(video_aspect)
-    video_width, video_height = aspect.to_resolution()
 
-    processed_clips = []
+def get_subclipped_items(
+    video_paths: List[str],
+    max_clip_duration: int = 5,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    keyframe_tolerance: float = 0,
+) -> List[SubClippedVideoClip]:
+    """
+    split the sources into windows of max_clip_duration. with a keyframe tolerance the
+    window boundaries move to keyframes within that distance, so windows can be cut
+    from the source without decoding it.
+    """
     subclipped_items = []
-    video_duration = 0
     for video_path in video_paths:
-        clip = VideoFileClip(video_path)
-        clip_duration = clip.duration
-        clip_w, clip_h = clip.size
-        close_clip(clip)
-        
+        info = media_index.index.get(video_path)
+        clip_duration = info["duration"]
+        clip_w, clip_h = info["width"], info["height"]
+        keyframes = media_index.index.get_keyframes(video_path) if keyframe_tolerance > 0 else []
+
         start_time = 0
 
         while start_time < clip_duration:
-            end_time = min(start_time + max_clip_duration, clip_duration)            
+            snapped = _snap_to_keyframe(keyframes, start_time, keyframe_tolerance) if keyframes else None
+            if snapped is not None:
+                start_time = snapped
+            end_time = min(start_time + max_clip_duration, clip_duration)
+            if keyframes and end_time < clip_duration:
+                # end where the next window can start on a keyframe
+                snapped = _snap_to_keyframe(keyframes, end_time, keyframe_tolerance, before=True)
+                if snapped is not None and snapped > start_time:
+                    end_time = snapped
             if clip_duration - start_time >= max_clip_duration:
                 subclipped_items.append(SubClippedVideoClip(file_path= video_path, start_time=start_time, end_time=end_time, width=clip_w, height=clip_h))
-            start_time = end_time    
+            start_time = end_time
             if video_concat_mode.value == VideoConcatMode.sequential.value:
                 break
 
     # random subclipped_items order
     if video_concat_mode.value == VideoConcatMode.random.value:
         random.shuffle(subclipped_items)
-        
+
     logger.debug(f"total subclipped items: {len(subclipped_items)}")
-    
-    # Add downloaded clips over and over until the duration of the audio (max_duration) has been reached
-    for i, subclipped_item in enumerate(subclipped_items):
-        if video_duration > audio_duration:
+    return subclipped_items
+
+
+def resolve_transition(video_transition_mode: VideoTransitionMode = None):
+    """
+    pick the concrete transition and slide side for one clip, so that the choice
+    can be recorded in a timeline instead of being made while rendering.
+    """
+    shuffle_side = random.choice(["left", "right", "top", "bottom"])
+    if not video_transition_mode or video_transition_mode.value == VideoTransitionMode.none.value:
+        return None, shuffle_side
+    if video_transition_mode.value == VideoTransitionMode.shuffle.value:
+        transition = random.choice(
+            [
+                VideoTransitionMode.fade_in.value,
+                VideoTransitionMode.fade_out.value,
+                VideoTransitionMode.slide_in.value,
+                VideoTransitionMode.slide_out.value,
+            ]
+        )
+        return transition, shuffle_side
+    return video_transition_mode.value, shuffle_side
+
+
+def apply_transition(clip, transition: str = None, side: str = "left"):
+    if transition == VideoTransitionMode.fade_in.value:
+        return video_effects.fadein_transition(clip, transition_duration)
+    if transition == VideoTransitionMode.fade_out.value:
+        return video_effects.fadeout_transition(clip, transition_duration)
+    if transition == VideoTransitionMode.slide_in.value:
+        return video_effects.slidein_transition(clip, transition_duration, side)
+    if transition == VideoTransitionMode.slide_out.value:
+        return video_effects.slideout_transition(clip, transition_duration, side)
+    return clip
+
+
+def use_xfade(video_transition_mode: VideoTransitionMode = None) -> bool:
+    """
+    whether transitions are rendered by ffmpeg as overlapping xfades while joining the clips,
+    instead of per-frame moviepy effects on every clip. opt-in, the moviepy effects are the default.
+    """
+    if not video_transition_mode or video_transition_mode.value == VideoTransitionMode.none.value:
+        return False
+    return config.app.get("transition_renderer", "moviepy") == "xfade"
+
+
+def fit_size(clip_w: int, clip_h: int, video_width: int, video_height: int):
+    """
+    size of a source scaled to fit inside the target while keeping its aspect ratio.
+    """
+    if clip_w * video_height == clip_h * video_width:
+        return video_width, video_height
+    if clip_w / clip_h > video_width / video_height:
+        scale_factor = video_width / clip_w
+    else:
+        scale_factor = video_height / clip_h
+    return int(clip_w * scale_factor), int(clip_h * scale_factor)
+
+
+def open_video(file_path: str, video_width: int, video_height: int):
+    """
+    open a source without audio, decoded by ffmpeg straight at the size it is shown in the target.
+    """
+    info = media_index.index.get(file_path)
+    target_resolution = None
+    if info["width"] and info["height"]:
+        target_resolution = fit_size(info["width"], info["height"], video_width, video_height)
+    return VideoFileClip(file_path, audio=False, target_resolution=target_resolution)
+
+
+def letterbox_clip(clip, video_width: int, video_height: int):
+    """
+    center the clip on a black frame of the target size. every frame is copied into
+    a canvas allocated once per clip, the borders are never touched again.
+    """
+    clip_w, clip_h = clip.size
+    x = int((video_width - clip_w) / 2)
+    y = int((video_height - clip_h) / 2)
+    canvas = np.zeros((video_height, video_width, 3), dtype=np.uint8)
+
+    def pad(frame):
+        h, w = frame.shape[:2]
+        canvas[y : y + h, x : x + w] = frame[:, :, :3]
+        return canvas
+
+    return clip.image_transform(pad)
+
+
+def resize_clip(clip, video_width: int, video_height: int):
+    # Not all videos are same size, so we need to resize them
+    clip_w, clip_h = clip.size
+    if clip_w == video_width and clip_h == video_height:
+        return clip
+
+    new_width, new_height = fit_size(clip_w, clip_h, video_width, video_height)
+    logger.debug(f"resizing clip, source: {clip_w}x{clip_h}, scaled: {new_width}x{new_height}, target: {video_width}x{video_height}")
+
+    if (new_width, new_height) != (clip_w, clip_h):
+        clip = clip.resized(new_size=(new_width, new_height))
+    if (new_width, new_height) == (video_width, video_height):
+        return clip
+    return letterbox_clip(clip, video_width, video_height)
+
+
+def normalize_subclip(
+    file_path: str,
+    start_time: float,
+    end_time: float,
+    video_width: int,
+    video_height: int,
+    transition: str = None,
+    side: str = "left",
+    max_clip_duration: int = 5,
+    clip_file: str = "",
+    encoder_profile: str = None,
+    stream_copy: bool = False,
+) -> float:
+    """
+    cut, resize and apply the transition to one window of a source video and
+    write it to clip_file. returns the duration of the written clip.
+    with stream_copy the window of a source that already matches the target
+    is copied without decoding, it must start on a keyframe.
+    """
+    if stream_copy and not transition:
+        ffmpeg_utils.cut(file_path, start_time, end_time - start_time, clip_file, fps=fps)
+        return ffmpeg_utils.probe(clip_file)["duration"]
+
+    # the combine stage collects garbage once for all its clips
+    with ClipScope("normalize", collect=False) as scope:
+        clip = scope.track(open_video(file_path, video_width, video_height))
+        clip = clip.subclipped(start_time, end_time)
+        clip = resize_clip(clip, video_width, video_height)
+        clip = apply_transition(clip, transition, side)
+
+        if clip.duration > max_clip_duration:
+            clip = clip.subclipped(0, max_clip_duration)
+
+        # wirte clip to temp file
+        clip.write_videofile(
+            clip_file,
+            logger=None,
+            fps=fps,
+            **encoder_write_args(get_encoder_profile(encoder_profile)),
+        )
+        return clip.duration
+
+
+def _normalize_subclip_safe(job: tuple):
+    try:
+        return normalize_subclip(*job)
+    except Exception as e:
+        logger.error(f"failed to process clip: {str(e)}")
+        return None
+
+
+def _clip_cache_key(item: SubClippedVideoClip, video_width, video_height, transition, side, max_clip_duration, profile) -> str:
+    if not clip_cache.cache.enabled:
+        return ""
+    if transition not in (VideoTransitionMode.slide_in.value, VideoTransitionMode.slide_out.value):
+        # the side only matters for slide transitions
+        side = None
+    try:
+        return clip_cache.cache.make_key(
+            item.file_path,
+            item.start_time,
+            item.end_time,
+            width=video_width,
+            height=video_height,
+            transition=transition,
+            side=side,
+            max_clip_duration=max_clip_duration,
+            fps=fps,
+            codec=video_codec,
+            encoder=encoder_args(profile),
+        )
+    except Exception as e:
+        logger.warning(f"failed to build clip cache key: {str(e)}")
+        return ""
+
+
+def _matches_target(info: dict, video_width: int, video_height: int) -> bool:
+    """
+    whether a source can be used as it is: same size, frame rate, codec and pixel format
+    as the clips normalize_subclip writes.
+    """
+    return (
+        info["codec"] == "h264"
+        and (info["width"], info["height"]) == (video_width, video_height)
+        and round(info["fps"], 3) == fps
+        and info["pix_fmt"] == "yuv420p"
+    )
+
+
+def _can_copy_window(item: SubClippedVideoClip, keyframes: List[float], max_clip_duration: int) -> bool:
+    # the window has to start on a keyframe and end on one (or at the end of the source)
+    if not keyframes or item.duration > max_clip_duration + 1e-3:
+        return False
+    if _snap_to_keyframe(keyframes, item.start_time, 1e-3) is None:
+        return False
+    source_duration = media_index.index.get(item.file_path)["duration"]
+    return (
+        item.end_time >= source_duration - 1e-3
+        or _snap_to_keyframe(keyframes, item.end_time, 1e-3) is not None
+    )
+
+
+def _subclip_key(item: SubClippedVideoClip) -> tuple:
+    return item.file_path, item.start_time, item.end_time
+
+
+def _manifest_clip_key(item: SubClippedVideoClip) -> str:
+    return repr(_subclip_key(item))
+
+
+def plan_segments(
+    order: List[SubClippedVideoClip],
+    duration: float,
+    overlap: float = 0,
+    failed: set = None,
+) -> List[SubClippedVideoClip]:
+    """
+    the exact source segments one variant encodes to cover duration, without touching any media.
+    the windows are used in order and looped when they are too short, the last segment is cut where
+    the duration is covered so nothing past it is encoded. failed holds the (file_path, start_time)
+    of windows that could not be normalized, the next windows take their place.
+    overlap is the time every segment after the first shares with the previous one.
+    """
+    windows = [item for item in order if (item.file_path, item.start_time) not in (failed or ())]
+    segments = []
+    covered = 0
+    if not windows:
+        return segments
+    for item in itertools.cycle(windows):
+        if covered >= duration - 1e-3:
             break
-        
-        logger.debug(f"processing clip {i+1}: {subclipped_item.width}x{subclipped_item.height}, current duration: {video_duration:.2f}s, remaining: {audio_duration - video_duration:.2f}s")
-        
-        try:
-            clip = VideoFileClip(subclipped_item.file_path).subclipped(subclipped_item.start_time, subclipped_item.end_time)
-            clip_duration = clip.duration
-            # Not all videos are same size, so we need to resize them
-            clip_w, clip_h = clip.size
-            if clip_w != video_width or clip_h != video_height:
-                clip_ratio = clip.w / clip.h
-                video_ratio = video_width / video_height
-                logger.debug(f"resizing clip, source: {clip_w}x{clip_h}, ratio: {clip_ratio:.2f}, target: {video_width}x{video_height}, ratio: {video_ratio:.2f}")
-                
-                if clip_ratio == video_ratio:
-                    clip = clip.resized(new_size=(video_width, video_height))
-                else:
-                    if clip_ratio > video_ratio:
-                        scale_factor = video_width / clip_w
-                    else:
-                        scale_factor = video_height / clip_h
-
-                    new_width = int(clip_w * scale_factor)
-                    new_height = int(clip_h * scale_factor)
-
-                    background = ColorClip(size=(video_width, video_height), color=(0, 0, 0)).with_duration(clip_duration)
-                    clip_resized = clip.resized(new_size=(new_width, new_height)).with_position("center")
-                    clip = CompositeVideoClip([background, clip_resized])
-                    
-            shuffle_side = random.choice(["left", "right", "top", "bottom"])
-            if video_transition_mode.value == VideoTransitionMode.none.value:
-                clip = clip
-            elif video_transition_mode.value == VideoTransitionMode.fade_in.value:
-                clip = video_effects.fadein_transition(clip, 1)
-            elif video_transition_mode.value == VideoTransitionMode.fade_out.value:
-                clip = video_effects.fadeout_transition(clip, 1)
-            elif video_transition_mode.value == VideoTransitionMode.slide_in.value:
-                clip = video_effects.slidein_transition(clip, 1, shuffle_side)
-            elif video_transition_mode.value == VideoTransitionMode.slide_out.value:
-                clip = video_effects.slideout_transition(clip, 1, shuffle_side)
-            elif video_transition_mode.value == VideoTransitionMode.shuffle.value:
-                transition_funcs = [
-                    lambda c: video_effects.fadein_transition(c, 1),
-                    lambda c: video_effects.fadeout_transition(c, 1),
-                    lambda c: video_effects.slidein_transition(c, 1, shuffle_side),
-                    lambda c: video_effects.slideout_transition(c, 1, shuffle_side),
-                ]
-                shuffle_transition = random.choice(transition_funcs)
-                clip = shuffle_transition(clip)
-
-            if clip.duration > max_clip_duration:
-                clip = clip.subclipped(0, max_clip_duration)
-                
-            # wirte clip to temp file
-            clip_file = f"{output_dir}/temp-clip-{i+1}.mp4"
-            clip.write_videofile(clip_file, logger=None, fps=fps, codec=video_codec)
-            
-            close_clip(clip)
-        
-            processed_clips.append(SubClippedVideoClip(file_path=clip_file, duration=clip.duration, width=clip_w, height=clip_h))
-            video_duration += clip.duration
-            
-        except Exception as e:
-            logger.error(f"failed to process clip: {str(e)}")
-    
-    # loop processed clips until the video duration matches or exceeds the audio duration.
-    if video_duration < audio_duration:
-        logger.warning(f"video duration ({video_duration:.2f}s) is shorter than audio duration ({audio_duration:.2f}s), looping clips to match audio length.")
-        base_clips = processed_clips.copy()
-        for clip in itertools.cycle(base_clips):
-            if video_duration >= audio_duration:
-                break
-            processed_clips.append(clip)
-            video_duration += clip.duration
-        logger.info(f"video duration: {video_duration:.2f}s, audio duration: {audio_duration:.2f}s, looped {len(processed_clips)-len(base_clips)} clips")
-     
-    # merge video clips progressively, avoid loading all videos at once to avoid memory overflow
-    logger.info("starting clip merging process")
-    if not processed_clips:
+        shared = overlap if segments else 0
+        remaining = duration - covered + shared
+        if item.duration > remaining:
+            # the tail only takes part in the transition into it
+            segment_duration = min(item.duration, max(remaining, min_segment_duration, overlap))
+            item = SubClippedVideoClip(
+                file_path=item.file_path,
+                start_time=item.start_time,
+                end_time=round(item.start_time + segment_duration, 3),
+                width=item.width,
+                height=item.height,
+            )
+        segments.append(item)
+        covered += item.duration - shared
+    if len(segments) > len(windows):
+        logger.warning(
+            f"the sources cover less than {duration:.2f}s, looping {len(segments) - len(windows)} segments"
+        )
+    return segments
+
+
+def _plan_to_dict(
+    video_paths: List[str],
+    items: List[SubClippedVideoClip],
+    orders: List[List[SubClippedVideoClip]],
+    duration: float = 0,
+    overlap: float = 0,
+    segments: List[List[SubClippedVideoClip]] = None,
+) -> dict:
+    positions = {id(item): i for i, item in enumerate(items)}
+    return {
+        "video_paths": list(video_paths),
+        "items": [
+            [item.file_path, item.start_time, item.end_time, item.width, item.height, item.duration]
+            for item in items
+        ],
+        "orders": [[positions[id(item)] for item in order] for order in orders],
+        "duration": duration,
+        "overlap": overlap,
+        "segments": [
+            [[segment.file_path, segment.start_time, segment.end_time, segment.width, segment.height] for segment in variant]
+            for variant in segments or []
+        ],
+    }
+
+
+def _segments_from_dict(plan: dict) -> List[List[SubClippedVideoClip]]:
+    return [
+        [
+            SubClippedVideoClip(file_path=file_path, start_time=start_time, end_time=end_time, width=width, height=height)
+            for file_path, start_time, end_time, width, height in variant
+        ]
+        for variant in plan["segments"]
+    ]
+
+
+def _plan_from_dict(plan: dict):
+    items = [
+        SubClippedVideoClip(file_path=file_path, start_time=start_time, end_time=end_time, width=width, height=height, duration=duration)
+        for file_path, start_time, end_time, width, height, duration in plan["items"]
+    ]
+    orders = [[items[i] for i in order] for order in plan["orders"]]
+    return items, orders
+
+
+def _restore_pool(manifest: RenderManifest, items: List[SubClippedVideoClip]) -> dict:
+    """
+    normalized clips (and failed windows) recorded by an interrupted run of the same plan.
+    """
+    clips = manifest.get_clips()
+    pool = {}
+    for item in items:
+        clip = clips.get(_manifest_clip_key(item))
+        if clip is None:
+            continue
+        if not clip["file_path"]:
+            pool[_subclip_key(item)] = None
+            continue
+        pool[_subclip_key(item)] = SubClippedVideoClip(
+            file_path=clip["file_path"],
+            duration=clip["duration"],
+            width=item.width,
+            height=item.height,
+            transition=clip.get("transition"),
+        )
+    if pool:
+        logger.info(f"render manifest: {sum(1 for clip in pool.values() if clip)} normalized clips restored")
+    return pool
+
+
+def _plan_variant(
+    segments: List[SubClippedVideoClip],
+    order: List[SubClippedVideoClip],
+    pool: dict,
+    audio_duration: float,
+    overlap: float = 0,
+):
+    """
+    the planned segments of one variant.
+    returns the normalized clips it uses and the segments that still have to be normalized.
+    when a window of the plan failed, the variant is planned again from its clip order without
+    the failed windows, so the next ones take their place.
+    """
+    failed = {(key[0], key[1]) for key, clip in pool.items() if clip is None}
+    if any((segment.file_path, segment.start_time) in failed for segment in segments):
+        segments = plan_segments(order, audio_duration, overlap, failed)
+    clips = []
+    pending = []
+    for segment in segments:
+        key = _subclip_key(segment)
+        if key in pool:
+            clips.append(pool[key])
+        else:
+            pending.append(segment)
+    return clips, pending
+
+
+def _plan_overlap(items: List[SubClippedVideoClip], video_transition_mode: VideoTransitionMode = None) -> float:
+    # xfade transitions overlap adjacent clips, they can take at most half of the shortest clip
+    if not use_xfade(video_transition_mode) or not items:
+        return 0
+    return min(transition_duration, min(item.duration for item in items) / 2)
+
+
+def plan_video_variants(
+    video_paths: List[str],
+    audio_duration: float,
+    count: int = 1,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    video_transition_mode: VideoTransitionMode = None,
+    max_clip_duration: int = 5,
+    manifest: RenderManifest = None,
+) -> dict:
+    """
+    plan every variant before anything is encoded: the source windows, the order each variant
+    uses them in and the exact segments that cover the audio. the plan is a plain dict that can be
+    stored in the task state, the plan recorded by an interrupted run is reused.
+    """
+    plan = manifest.get_plan() if manifest else None
+    if plan and plan["video_paths"] == list(video_paths) and len(plan["orders"]) == count:
+        # the random clip order has to be the same as in the interrupted run
+        logger.info("render manifest: resuming the recorded clip plan")
+        if plan.get("segments"):
+            return plan
+        items, orders = _plan_from_dict(plan)
+    else:
+        plan = None
+        items = get_subclipped_items(
+            video_paths=video_paths,
+            max_clip_duration=max_clip_duration,
+            video_concat_mode=video_concat_mode,
+            keyframe_tolerance=float(config.app.get("keyframe_tolerance", 0)),
+        )
+        orders = [items]
+        for _ in range(count - 1):
+            if video_concat_mode.value == VideoConcatMode.random.value:
+                orders.append(random.sample(items, len(items)))
+            else:
+                orders.append(items)
+
+    # a couple of frames more, cuts on keyframes can come out a frame short
+    duration = audio_duration + 2 / fps
+    overlap = _plan_overlap(items, video_transition_mode)
+    segments = [plan_segments(order, duration, overlap) for order in orders]
+    if segments and segments[0]:
+        logger.info(
+            f"clip plan: {len(items)} windows, {', '.join(str(len(variant)) for variant in segments)} segments "
+            f"covering {duration:.2f}s"
+        )
+    result = _plan_to_dict(video_paths, items, orders, duration, overlap, segments)
+    if manifest and not plan:
+        manifest.set_plan(result)
+    return result
+
+
+def _normalize_pool_items(
+    items: List[SubClippedVideoClip],
+    pool: dict,
+    output_dir: str,
+    video_width: int,
+    video_height: int,
+    video_transition_mode: VideoTransitionMode,
+    max_clip_duration: int,
+    profile: dict,
+    executor: ProcessPoolExecutor = None,
+    xfade: bool = False,
+    copy_keyframes: dict = None,
+    manifest: RenderManifest = None,
+    scratch: TaskScratch = None,
+):
+    # reuse clips normalized by earlier tasks, only the misses are encoded
+    copy_keyframes = copy_keyframes or {}
+    cache_keys = {}
+    jobs = []
+    xfade_transitions = {}
+    # clips restored from a render manifest keep their files, new clips never overwrite them
+    used_names = {os.path.basename(clip.file_path) for clip in pool.values() if clip}
+    clip_index = len(pool)
+
+    def add_to_pool(item, clip_file, duration):
+        key = _subclip_key(item)
+        pool[key] = SubClippedVideoClip(file_path=clip_file, duration=duration, width=item.width, height=item.height, transition=xfade_transitions.get(key))
+        if manifest:
+            manifest.add_clip(_manifest_clip_key(item), clip_file, duration=duration, transition=xfade_transitions.get(key))
+
+    for item in items:
+        key = _subclip_key(item)
+        transition, side = resolve_transition(video_transition_mode)
+        if xfade:
+            # the transition is added while joining, the clip itself stays plain
+            xfade_transitions[key] = video_effects.xfade_transition(transition, side)
+            transition = None
+        clip_index += 1
+        while f"temp-clip-{clip_index}.mp4" in used_names:
+            clip_index += 1
+        clip_file = scratch_file(
+            scratch,
+            output_dir,
+            f"temp-clip-{clip_index}.mp4",
+            expected_video_bytes(video_width, video_height, min(item.duration, max_clip_duration)),
+        )
+        stream_copy = not transition and _can_copy_window(item, copy_keyframes.get(item.file_path), max_clip_duration)
+        # copying a window is cheaper than looking it up in the cache
+        cache_key = "" if stream_copy else _clip_cache_key(item, video_width, video_height, transition, side, max_clip_duration, profile)
+        if cache_key and clip_cache.cache.get(cache_key, clip_file):
+            add_to_pool(item, clip_file, min(item.end_time - item.start_time, max_clip_duration))
+            continue
+        cache_keys[key] = cache_key
+        jobs.append(
+            (
+                item,
+                clip_file,
+                (
+                    item.file_path,
+                    item.start_time,
+                    item.end_time,
+                    video_width,
+                    video_height,
+                    transition,
+                    side,
+                    max_clip_duration,
+                    clip_file,
+                    profile["name"],
+                    stream_copy,
+                ),
+            )
+        )
+    if len(jobs) < len(items):
+        logger.info(f"clip cache: {len(items) - len(jobs)} of {len(items)} clips reused")
+
+    if any(job[-1] for _, _, job in jobs):
+        logger.info(f"stream copy: {sum(1 for _, _, job in jobs if job[-1])} of {len(jobs)} clips cut without decoding")
+    job_args = [job for _, _, job in jobs]
+    if executor:
+        results = executor.map(_normalize_subclip_safe, job_args)
+    else:
+        results = map(_normalize_subclip_safe, job_args)
+    # results are collected in submission order, so the output is deterministic
+    for (item, clip_file, _), duration in zip(jobs, results):
+        key = _subclip_key(item)
+        if duration is None:
+            pool[key] = None
+            if manifest:
+                manifest.add_clip(_manifest_clip_key(item))
+            continue
+        logger.debug(f"processed clip {clip_file}: {item.width}x{item.height}, duration: {duration:.2f}s")
+        add_to_pool(item, clip_file, duration)
+        if cache_keys[key]:
+            clip_cache.cache.put(cache_keys[key], clip_file)
+
+
+def _xfade_variant(
+    combined_video_path: str,
+    items: List[SubClippedVideoClip],
+    video_width: int,
+    video_height: int,
+    video_transition_mode: VideoTransitionMode,
+    profile: dict,
+    threads: int,
+    overlap: float,
+) -> str:
+    """
+    cut, fit, transition and join the planned segments of one variant in a single ffmpeg run,
+    no frame passes through python.
+    """
+    if not items:
         logger.warning("no clips available for merging")
         return combined_video_path
-    
+    video_duration = sum(item.duration for item in items) - overlap * (len(items) - 1)
+    transitions = [
+        video_effects.xfade_transition(*resolve_transition(video_transition_mode))
+        for _ in items[1:]
+    ]
+    logger.info(f"merging {len(items)} source windows, total duration: {video_duration:.2f}s => {combined_video_path}")
+    ffmpeg_utils.xfade_concat(
+        file_paths=[item.file_path for item in items],
+        durations=[item.duration for item in items],
+        transitions=transitions,
+        output_file=combined_video_path,
+        transition_duration=overlap,
+        encoder_args=encoder_args(profile),
+        fps=fps,
+        threads=threads,
+        start_times=[item.start_time for item in items],
+        size=(video_width, video_height),
+    )
+    return combined_video_path
+
+
+def _concat_variant(
+    combined_video_path: str,
+    processed_clips: List[SubClippedVideoClip],
+    profile: dict,
+    threads: int,
+    overlap: float = 0,
+) -> str:
+    video_duration = sum(clip.duration for clip in processed_clips) - overlap * (len(processed_clips) - 1)
+    clip_files = [clip.file_path for clip in processed_clips]
+
     # if there is only one clip, use it directly
     if len(processed_clips) == 1:
         logger.info("using single clip directly")
-        shutil.copy(processed_clips[0].file_path, combined_video_path)
-        delete_files(processed_clips)
-        logger.info("video combining completed")
+        shutil.copy(clip_files[0], combined_video_path)
         return combined_video_path
-    
-    # create initial video file as base
-    base_clip_path = processed_clips[0].file_path
-    temp_merged_video = f"{output_dir}/temp-merged-video.mp4"
-    temp_merged_next = f"{output_dir}/temp-merged-next.mp4"
-    
-    # copy first clip as initial merged video
-    shutil.copy(base_clip_path, temp_merged_video)
-    
-    # merge remaining video clips one by one
-    for i, clip in enumerate(processed_clips[1:], 1):
-        logger.info(f"merging clip {i}/{len(processed_clips)-1}, duration: {clip.duration:.2f}s")
-        
+
+    # join all normalized clips in a single pass instead of re-encoding a growing file
+    logger.info(f"merging {len(clip_files)} clips, total duration: {video_duration:.2f}s => {combined_video_path}")
+    if overlap:
+        ffmpeg_utils.xfade_concat(
+            file_paths=clip_files,
+            durations=[clip.duration for clip in processed_clips],
+            transitions=[clip.transition or "fade" for clip in processed_clips[1:]],
+            output_file=combined_video_path,
+            transition_duration=overlap,
+            encoder_args=encoder_args(profile),
+            fps=fps,
+            threads=threads,
+        )
+        return combined_video_path
+    ffmpeg_utils.concat(
+        file_paths=clip_files,
+        output_file=combined_video_path,
+        encoder_args=encoder_args(profile),
+        fps=fps,
+        threads=threads,
+    )
+    return combined_video_path
+
+
+def combine_video_variants(
+    combined_video_paths: List[str],
+    video_paths: List[str],
+    audio_file: str,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    video_transition_mode: VideoTransitionMode = None,
+    max_clip_duration: int = 5,
+    threads: int = 2,
+    max_workers: int = 1,
+    encoder_profile: str = None,
+    variant_workers: int = 1,
+    manifest: RenderManifest = None,
+    scratch: TaskScratch = None,
+    plan: dict = None,
+) -> List[str]:
+    """
+    combine one video per output path from a single pool of normalized subclips.
+    the variants only differ in clip order, so every subclip is decoded and encoded
+    once no matter how many variants use it. only the segments of the plan (see
+    plan_video_variants, made here when none is given) are encoded.
+    with a manifest, the clip plan, every normalized clip and every combined variant are
+    checkpointed, and an interrupted run resumes from the intact checkpoints.
+    """
+    audio_duration = media_index.index.get(audio_file)["duration"]
+    logger.info(f"audio duration: {audio_duration} seconds")
+    logger.info(f"maximum clip duration: {max_clip_duration} seconds")
+    output_dir = os.path.dirname(combined_video_paths[0])
+
+    aspect = VideoAspect(video_aspect)
+    video_width, video_height = aspect.to_resolution()
+    profile = get_encoder_profile(encoder_profile)
+    logger.info(f"encoder profile: {profile['name']}")
+
+    keyframe_tolerance = float(config.app.get("keyframe_tolerance", 0))
+    if not plan:
+        plan = plan_video_variants(
+            video_paths,
+            audio_duration,
+            len(combined_video_paths),
+            video_concat_mode,
+            video_transition_mode,
+            max_clip_duration,
+            manifest,
+        )
+    subclipped_items, orders = _plan_from_dict(plan)
+    # the variants encode exactly the planned segments, covering the audio plus a margin
+    segments = _segments_from_dict(plan)
+    audio_duration = plan["duration"]
+
+    jobs = list(zip(combined_video_paths, orders, segments))
+    if manifest:
+        jobs = [job for job in jobs if not manifest.has_file(job[0])]
+        if len(jobs) < len(combined_video_paths):
+            logger.info(f"render manifest: {len(combined_video_paths) - len(jobs)} variants already combined")
+        if not jobs:
+            logger.info("video combining completed")
+            return combined_video_paths
+
+    xfade = use_xfade(video_transition_mode)
+    overlap = plan["overlap"]
+    if xfade:
+        logger.info(f"rendering transitions with xfade, overlap: {overlap:.2f}s")
+
+    if xfade:
+        # ffmpeg renders each variant straight from the sources, variants that fail
+        # (e.g. a source ffmpeg cannot seek in) fall back to the normalized clip pool below
+        def xfade_variant(job):
+            combined_video_path, _, variant_segments = job
+            try:
+                _xfade_variant(
+                    combined_video_path,
+                    variant_segments,
+                    video_width,
+                    video_height,
+                    video_transition_mode,
+                    profile,
+                    threads,
+                    overlap,
+                )
+                if manifest:
+                    manifest.add_file(combined_video_path)
+                return None
+            except Exception as e:
+                logger.warning(f"failed to render {combined_video_path} from the sources, using normalized clips: {str(e)}")
+                return job
+
+        failed = [
+            job
+            for job in _run_variants(xfade_variant, jobs, variant_workers)
+            if job
+        ]
+        if not failed:
+            logger.info("video combining completed")
+            return combined_video_paths
+        jobs = failed
+    remaining_paths = [combined_video_path for combined_video_path, _, _ in jobs]
+    orders = [order for _, order, _ in jobs]
+    segments = [variant_segments for _, _, variant_segments in jobs]
+
+    # windows of sources that already have the target format are copied instead of re-encoded
+    copy_keyframes = {}
+    if keyframe_tolerance > 0:
+        for video_path in dict.fromkeys(video_paths):
+            if _matches_target(media_index.index.get(video_path), video_width, video_height):
+                copy_keyframes[video_path] = media_index.index.get_keyframes(video_path)
+        if copy_keyframes:
+            logger.info(f"{len(copy_keyframes)} of {len(set(video_paths))} sources match the target format")
+
+    executor = None
+    if max_workers > 1:
+        # spawn instead of fork, the api server runs tasks in threads
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"normalizing clips with {max_workers} worker processes")
+
+    # normalize what the variants still need until all of them cover the audio,
+    # failed clips are replaced by the next items of the same variant
+    pool = {}
+    if manifest:
+        # trimmed tail segments are clips of their own
+        planned = [segment for variant_segments in segments for segment in variant_segments]
+        pool = _restore_pool(manifest, subclipped_items + planned)
+    # the clips are opened and closed by normalize_subclip, in process or in the workers, so this
+    # scope tracks none of them, it only collects garbage once for the whole pool
+    with ClipScope("combine"):
         try:
-            # load current base video and next clip to merge
-            base_clip = VideoFileClip(temp_merged_video)
-            next_clip = VideoFileClip(clip.file_path)
-            
-            # merge these two clips
-            merged_clip = concatenate_videoclips([base_clip, next_clip])
-
-            # save merged result to temp file
-            merged_clip.write_videofile(
-                filename=temp_merged_next,
-                threads=threads,
-                logger=None,
-                temp_audiofile_path=output_dir,
-                audio_codec=audio_codec,
-                fps=fps,
-            )
-            close_clip(base_clip)
-            close_clip(next_clip)
-            close_clip(merged_clip)
-            
-            # replace base file with new merged file
-            delete_files(temp_merged_video)
-            os.rename(temp_merged_next, temp_merged_video)
-            
-        except Exception as e:
-            logger.error(f"failed to merge clip: {str(e)}")
-            continue
-    
-    # after merging, rename final result to target file name
-    os.rename(temp_merged_video, combined_video_path)
-    
+            while True:
+                pending = {}
+                for variant_segments, order in zip(segments, orders):
+                    _, items = _plan_variant(variant_segments, order, pool, audio_duration, overlap)
+                    for item in items:
+                        pending.setdefault(_subclip_key(item), item)
+                if not pending:
+                    break
+                _normalize_pool_items(
+                    list(pending.values()),
+                    pool,
+                    output_dir,
+                    video_width,
+                    video_height,
+                    video_transition_mode,
+                    max_clip_duration,
+                    profile,
+                    executor,
+                    xfade,
+                    copy_keyframes,
+                    manifest,
+                    scratch,
+                )
+        finally:
+            if executor:
+                executor.shutdown()
+
+    logger.info(f"clip pool: {sum(1 for clip in pool.values() if clip)} clips shared by {len(remaining_paths)} variants")
+    variants = [
+        _plan_variant(variant_segments, order, pool, audio_duration, overlap)[0]
+        for variant_segments, order in zip(segments, orders)
+    ]
+
+    def concat_variant(args):
+        combined_video_path, clips = args
+        if not clips:
+            logger.warning("no clips available for merging")
+            return combined_video_path
+        _concat_variant(combined_video_path, clips, profile, threads, overlap)
+        if manifest:
+            manifest.add_file(combined_video_path)
+        return combined_video_path
+
+    logger.info("starting clip merging process")
+    clip_files = [clip.file_path for clip in pool.values() if clip]
+    try:
+        _run_variants(concat_variant, list(zip(remaining_paths, variants)), variant_workers)
+    except Exception:
+        # checkpointed clips are kept for a resumed run
+        if not manifest:
+            delete_intermediates(scratch, clip_files)
+        raise
     # clean temp files
-    clip_files = [clip.file_path for clip in processed_clips]
-    delete_files(clip_files)
-            
+    delete_intermediates(scratch, clip_files)
+    if manifest:
+        manifest.clear_clips()
+
     logger.info("video combining completed")
-    return combined_video_path
+    return combined_video_paths
 
 
-def wrap_text(text, max_width, font="Arial", fontsize=60):
-    # Create ImageFont
-    font = ImageFont.truetype(font, fontsize)
+def combine_videos(
+    combined_video_path: str,
+    video_paths: List[str],
+    audio_file: str,
+    video_aspect: VideoAspect = VideoAspect.portrait,
+    video_concat_mode: VideoConcatMode = VideoConcatMode.random,
+    video_transition_mode: VideoTransitionMode = None,
+    max_clip_duration: int = 5,
+    threads: int = 2,
+    max_workers: int = 1,
+    encoder_profile: str = None,
+) -> str:
+    return combine_video_variants(
+        combined_video_paths=[combined_video_path],
+        video_paths=video_paths,
+        audio_file=audio_file,
+        video_aspect=video_aspect,
+        video_concat_mode=video_concat_mode,
+        video_transition_mode=video_transition_mode,
+        max_clip_duration=max_clip_duration,
+        threads=threads,
+        max_workers=max_workers,
+        encoder_profile=encoder_profile,
+    )[0]
 
-    def get_text_size(inner_text):
-        inner_text = inner_text.strip()
-        left, top, right, bottom = font.getbbox(inner_text)
-        return right - left, bottom - top
 
-    width, height = get_text_size(text)
+@lru_cache(maxsize=32)
+def load_font(font_path: str, fontsize: int) -> ImageFont.FreeTypeFont:
+    # fonts are shared by every subtitle line of every task in this process
+    return ImageFont.truetype(font_path, fontsize)
+
+
+@lru_cache(maxsize=65536)
+def _text_metrics(font_path: str, fontsize: int, text: str):
+    """
+    memoized (advance, ink left, ink right) of a word or a single glyph.
+    """
+    font = load_font(font_path, fontsize)
+    left, _, right, _ = font.getbbox(text) if text else (0, 0, 0, 0)
+    return font.getlength(text), left, right
+
+
+@lru_cache(maxsize=4096)
+def _text_size(font_path: str, fontsize: int, text: str):
+    left, top, right, bottom = load_font(font_path, fontsize).getbbox(text.strip())
+    return right - left, bottom - top
+
+
+@lru_cache(maxsize=65536)
+def _pair_kerning(font_path: str, fontsize: int, before: str, separator: str, after: str) -> float:
+    """
+    memoized kerning between the last glyph of a line and the first glyph of the next item.
+    """
+    font = load_font(font_path, fontsize)
+    pair = font.getlength(before + separator + after)
+    return pair - font.getlength(before) - font.getlength(separator) - font.getlength(after)
+
+
+class _LineWidth:
+    """
+    width of a line that grows by one item at a time, built from the cumulative
+    advance of the previous items and the ink box of the first and last visible
+    ones, with the kerning between the last glyph of the line and the first glyph
+    of a new item measured as a pair. getbbox rounds the ink box to whole pixels
+    after placing it, so the estimate can be off by up to a pixel, fits() measures
+    the joined text when it is that close to the limit.
+    """
+
+    def __init__(self, font_path: str, fontsize: int, separator: str = ""):
+        self.font_path = font_path
+        self.fontsize = fontsize
+        self.separator_text = separator
+        self.separator = self._metrics(separator)[0] if separator else 0
+        self.reset()
+
+    def _metrics(self, text):
+        return _text_metrics(self.font_path, self.fontsize, text)
+
+    def _kerning(self, item) -> float:
+        if not self.tail or not item:
+            return 0
+        return _pair_kerning(self.font_path, self.fontsize, self.tail, self.separator_text, item[0])
+
+    def reset(self):
+        self.count = 0
+        self.pen = 0
+        self.left = 0
+        self.right = 0
+        # last character of the line, the left side of the next kerning pair
+        self.tail = ""
+
+    def measure(self, item) -> float:
+        if not item.strip():
+            # surrounding whitespace is stripped before measuring
+            return self.right - self.left if self.count else 0
+        advance, left, right = self._metrics(item)
+        if not self.count:
+            return right - left
+        return self.pen + self.separator + self._kerning(item) + right - self.left
+
+    def fits(self, item, max_width, text) -> bool:
+        """
+        whether the line fits in max_width with item appended, text is the line with item.
+        """
+        width = self.measure(item)
+        if abs(width - max_width) > 1:
+            return width <= max_width
+        return _text_size(self.font_path, self.fontsize, text)[0] <= max_width
+
+    def append(self, item):
+        advance, left, right = self._metrics(item)
+        if not self.count:
+            if item.strip():
+                self.count, self.pen, self.left, self.right = 1, advance, left, right
+                self.tail = item[-1]
+            return
+        start = self.pen + self.separator + self._kerning(item)
+        self.pen = start + advance
+        self.tail = (self.separator_text + item)[-1:] or self.tail
+        if item.strip():
+            self.count += 1
+            self.right = start + right
+
+
+def wrap_text(text, max_width, font="Arial", fontsize=60):
+    width, height = _text_size(font, fontsize, text)
     if width <= max_width:
         return text, height
 
     processed = True
-
     _wrapped_lines_ = []
-    words = text.split(" ")
-    _txt_ = ""
-    for word in words:
-        _before = _txt_
-        _txt_ += f"{word} "
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
+    _line_ = []
+    line_width = _LineWidth(font, fontsize, separator=" ")
+    for word in text.split(" "):
+        if line_width.fits(word, max_width, " ".join(_line_ + [word])):
+            _line_.append(word)
+            line_width.append(word)
             continue
-        else:
-            if _txt_.strip() == word.strip():
-                processed = False
-                break
-            _wrapped_lines_.append(_before)
-            _txt_ = f"{word} "
-    _wrapped_lines_.append(_txt_)
+        if not "".join(_line_).strip():
+            # a single word wider than the line, fall back to per-character wrapping
+            processed = False
+            break
+        _wrapped_lines_.append(" ".join(_line_))
+        _line_ = [word]
+        line_width.reset()
+        line_width.append(word)
+    _wrapped_lines_.append(" ".join(_line_))
     if processed:
         _wrapped_lines_ = [line.strip() for line in _wrapped_lines_]
         result = "\n".join(_wrapped_lines_).strip()
@@ -344,52 +1141,43 @@ def wrap_text(text, max_width, font="Arial", fontsize=60):
         return result, height
 
     _wrapped_lines_ = []
-    chars = list(text)
     _txt_ = ""
-    for word in chars:
-        _txt_ += word
-        _width, _height = get_text_size(_txt_)
-        if _width <= max_width:
+    line_width = _LineWidth(font, fontsize)
+    for char in text:
+        _txt_ += char
+        fits = line_width.fits(char, max_width, _txt_)
+        line_width.append(char)
+        if fits:
             continue
-        else:
-            _wrapped_lines_.append(_txt_)
-            _txt_ = ""
+        _wrapped_lines_.append(_txt_)
+        _txt_ = ""
+        line_width.reset()
     _wrapped_lines_.append(_txt_)
     result = "\n".join(_wrapped_lines_).strip()
     height = len(_wrapped_lines_) * height
     return result, height
 
 
-def generate_video(
-    video_path: str,
-    audio_path: str,
-    subtitle_path: str,
-    output_file: str,
-    params: VideoParams,
-):
-    aspect = VideoAspect(params.video_aspect)
-    video_width, video_height = aspect.to_resolution()
-
-    logger.info(f"generating video: {video_width} x {video_height}")
-    logger.info(f"  ① video: {video_path}")
-    logger.info(f"  ② audio: {audio_path}")
-    logger.info(f"  ③ subtitle: {subtitle_path}")
-    logger.info(f"  ④ output: {output_file}")
-
-    # https://github.com/harry0703/MoneyPrinterTurbo/issues/217
-    # PermissionError: [WinError 32] The process cannot access the file because it is being used by another process: 'final-1.mp4.tempTEMP_MPY_wvf_snd.mp3'
-    # write into the same directory as the output file
-    output_dir = os.path.dirname(output_file)
+def get_font_path(params: VideoParams) -> str:
+    if not params.subtitle_enabled:
+        return ""
+    if not params.font_name:
+        params.font_name = "STHeitiMedium.ttc"
+    font_path = os.path.join(utils.font_dir(), params.font_name)
+    if os.name == "nt":
+        font_path = font_path.replace("\\", "/")
+    return font_path
 
-    font_path = ""
-    if params.subtitle_enabled:
-        if not params.font_name:
-            params.font_name = "STHeitiMedium.ttc"
-        font_path = os.path.join(utils.font_dir(), params.font_name)
-        if os.name == "nt":
-            font_path = font_path.replace("\\", "/")
 
-        logger.info(f"  ⑤ font: {font_path}")
+def create_subtitle_clips(
+    subtitle_path: str,
+    params: VideoParams,
+    video_width: int,
+    video_height: int,
+    font_path: str,
+) -> list:
+    if not subtitle_path or not os.path.exists(subtitle_path):
+        return []
 
     def create_text_clip(subtitle_item):
         params.font_size = int(params.font_size)
@@ -435,11 +1223,6 @@ def generate_video(
             _clip = _clip.with_position(("center", "center"))
         return _clip
 
-    video_clip = VideoFileClip(video_path).without_audio()
-    audio_clip = AudioFileClip(audio_path).with_effects(
-        [afx.MultiplyVolume(params.voice_volume)]
-    )
-
     def make_textclip(text):
         return TextClip(
             text=text,
@@ -447,85 +1230,683 @@ def generate_video(
             font_size=params.font_size,
         )
 
-    if subtitle_path and os.path.exists(subtitle_path):
-        sub = SubtitlesClip(
-            subtitles=subtitle_path, encoding="utf-8", make_textclip=make_textclip
+    sub = SubtitlesClip(
+        subtitles=subtitle_path, encoding="utf-8", make_textclip=make_textclip
+    )
+    text_clips = []
+    for item in sub.subtitles:
+        clip = create_text_clip(subtitle_item=item)
+        text_clips.append(clip)
+    return text_clips
+
+
+def create_ass_subtitles(
+    subtitle_path: str,
+    params: VideoParams,
+    video_width: int,
+    video_height: int,
+    font_path: str,
+) -> str:
+    """
+    convert the srt into an ASS file styled like the TextClip subtitles.
+    lines are wrapped with wrap_text so CJK text breaks the same way.
+    """
+    params.font_size = int(params.font_size)
+    max_width = video_width * 0.9
+    items = []
+    for (start, end), phrase in file_to_subtitles(subtitle_path, encoding="utf-8"):
+        wrapped_txt, _ = wrap_text(
+            phrase, max_width=max_width, font=font_path, fontsize=params.font_size
+        )
+        items.append((start, end, wrapped_txt))
+
+    ass_path = f"{os.path.splitext(subtitle_path)[0]}-{video_width}x{video_height}.ass"
+    content = ass_subtitles.build_ass(items, params, video_width, video_height, font_path)
+    return ass_subtitles.write_ass(ass_path, content)
+
+
+def prepare_subtitles(
+    subtitle_path: str,
+    params: VideoParams,
+    video_width: int,
+    video_height: int,
+    font_path: str,
+):
+    """
+    build the subtitle track once, returns a function that adds it to a clip,
+    extra ffmpeg params for the encoder and, for the "overlay" renderer, a function
+    that blends the subtitles into a frame in place (None otherwise).
+    the "ass" renderer leaves the clip untouched and burns the subtitles in while encoding.
+    """
+    if not subtitle_path or not os.path.exists(subtitle_path):
+        return lambda clip: clip, [], None
+
+    renderer = params.subtitle_renderer or config.app.get("subtitle_renderer", "overlay")
+    if renderer == "ass":
+        ass_path = create_ass_subtitles(
+            subtitle_path, params, video_width, video_height, font_path
         )
-        text_clips = []
-        for item in sub.subtitles:
-            clip = create_text_clip(subtitle_item=item)
-            text_clips.append(clip)
-        video_clip = CompositeVideoClip([video_clip, *text_clips])
+        logger.info(f"burning in ass subtitles: {ass_path}")
+        vf = ass_subtitles.subtitles_filter(ass_path, os.path.dirname(font_path))
+        return lambda clip: clip, ["-vf", vf], None
 
-    bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
+    text_clips = create_subtitle_clips(
+        subtitle_path, params, video_width, video_height, font_path
+    )
+    if not text_clips:
+        return lambda clip: clip, [], None
+
+    if renderer == "textclip":
+        # subtitles must not extend the video beyond the narration
+        return (
+            lambda clip: CompositeVideoClip([clip, *text_clips]).with_duration(clip.duration),
+            [],
+            None,
+        )
+
+    # rasterize every line once instead of compositing all text clips on each frame
+    overlay = subtitle_overlay.build_subtitle_overlay(text_clips, video_width, video_height)
+    for clip in text_clips:
+        close_clip(clip)
+    logger.info(f"subtitle overlay track: {len(overlay)} lines")
+    return lambda clip: subtitle_overlay.apply_overlay(clip, overlay), [], overlay.blit_into
+
+
+def mix_audio(
+    audio_path: str,
+    params: VideoParams,
+    duration: float,
+    bgm_file: str,
+    output_file: str,
+) -> str:
+    """
+    mix the narration and the bgm once into a wav track that every variant muxes.
+    the samples are mixed with numpy, no audio passes through moviepy while encoding.
+    """
+    ducked_gain = params.bgm_ducking
+    if ducked_gain is None:
+        ducked_gain = float(config.app.get("bgm_ducking", 1.0))
+    bgm = None
     if bgm_file:
         try:
-            bgm_clip = AudioFileClip(bgm_file).with_effects(
-                [
-                    afx.MultiplyVolume(params.bgm_volume),
-                    afx.AudioFadeOut(3),
-                    afx.AudioLoop(duration=video_clip.duration),
-                ]
-            )
-            audio_clip = CompositeAudioClip([audio_clip, bgm_clip])
+            # sliced from the decoded library copy of the song, normalized to the target loudness
+            bgm = bgm_library.library.samples(bgm_file, duration)
         except Exception as e:
             logger.error(f"failed to add bgm: {str(e)}")
-
-    video_clip = video_clip.with_audio(audio_clip)
-    video_clip.write_videofile(
+    return audio_mix.mix(
+        audio_path,
         output_file,
-        audio_codec=audio_codec,
-        temp_audiofile_path=output_dir,
-        threads=params.n_threads or 2,
-        logger=None,
+        voice_volume=params.voice_volume,
+        bgm=bgm,
+        bgm_volume=params.bgm_volume,
+        ducked_gain=ducked_gain,
+    )
+
+
+class RenderTracks:
+    """
+    subtitle track and audio mix of a task, shared by every rendered variant.
+    """
+
+    def __init__(
+        self,
+        apply_subtitles,
+        subtitle_params: List[str],
+        audio_file: str,
+        scratch: TaskScratch = None,
+        composite_subtitles=None,
+    ):
+        self.apply_subtitles = apply_subtitles
+        self.subtitle_params = subtitle_params
+        # in-place frame compositor of the subtitles for the frame pipeline, None when they are part of the clip
+        self.composite_subtitles = composite_subtitles
+        self.audio_file = audio_file
+        # the video tracks written before muxing go to the same scratch space as the audio mix
+        self.scratch = scratch
+
+    def close(self):
+        delete_intermediates(self.scratch, self.audio_file)
+
+
+def prepare_tracks(
+    audio_path: str,
+    subtitle_path: str,
+    params: VideoParams,
+    video_width: int,
+    video_height: int,
+    duration: float,
+    bgm_file: str,
+    output_dir: str,
+    scratch: TaskScratch = None,
+) -> RenderTracks:
+    font_path = get_font_path(params)
+    if font_path:
+        logger.info(f"  ⑤ font: {font_path}")
+    apply_subtitles, subtitle_params, composite_subtitles = prepare_subtitles(
+        subtitle_path, params, video_width, video_height, font_path
+    )
+    audio_file = mix_audio(
+        audio_path,
+        params,
+        duration=duration,
+        bgm_file=bgm_file,
+        output_file=scratch_file(
+            scratch,
+            output_dir,
+            f"audio-mix-{video_width}x{video_height}.wav",
+            int(duration * audio_mix.sample_rate * audio_mix.channels * 2),
+        ),
+    )
+    return RenderTracks(apply_subtitles, subtitle_params, audio_file, scratch, composite_subtitles)
+
+
+# the poster is the frame at this share of the video, past the opening transition
+poster_position = 1 / 3
+# thumbnails of the sprite sheet: columns x rows, each this wide
+sprite_columns = 5
+sprite_rows = 5
+sprite_width = 180
+
+
+def rendition_sizes(width: int, height: int, renditions: List[int] = None) -> dict:
+    """
+    the size of each rendition keyed by its short side, renditions not smaller than the video are skipped.
+    """
+    sizes = {}
+    short_side = min(width, height)
+    for rendition in sorted(set(renditions or []), reverse=True):
+        if rendition >= short_side:
+            logger.warning(f"rendition {rendition}p is not smaller than {width} x {height}, skipped")
+            continue
+        scale = rendition / short_side
+        # libx264 needs even dimensions
+        sizes[rendition] = (max(int(width * scale) // 2 * 2, 2), max(int(height * scale) // 2 * 2, 2))
+    return sizes
+
+
+def extra_output_files(output_file: str, params: VideoParams, width: int, height: int) -> List[str]:
+    """
+    the renditions, poster and sprite sheet written next to output_file.
+    """
+    base = os.path.splitext(output_file)[0]
+    files = [f"{base}-{rendition}p.mp4" for rendition in rendition_sizes(width, height, params.video_renditions)]
+    if params.video_poster:
+        files.append(f"{base}-poster.jpg")
+    if params.video_sprite:
+        files.append(f"{base}-sprite.jpg")
+    return files
+
+
+def final_output_files(output_file: str, params: VideoParams) -> List[str]:
+    """
+    the final video followed by the extra outputs that were written for it.
+    """
+    width, height = VideoAspect(params.video_aspect).to_resolution()
+    return [output_file] + [
+        file for file in extra_output_files(output_file, params, width, height) if os.path.isfile(file)
+    ]
+
+
+def hls_playlist_file(output_file: str) -> str:
+    """
+    the hls playlist written next to output_file while it is encoded, its segments share its directory.
+    """
+    return os.path.join(f"{os.path.splitext(output_file)[0]}-hls", "index.m3u8")
+
+
+def _extra_outputs(video_clip, tracks: RenderTracks, output_file: str, params: VideoParams, profile: dict, video_fps: int):
+    """
+    ffmpeg outputs fed from the same frames as the final video, and the (video track, output file)
+    pairs of the renditions that still need the audio.
+    """
+    width, height = video_clip.size
+    # the ass subtitles are burnt in by a filter of the main output, the extra outputs repeat it
+    vf = ""
+    if "-vf" in tracks.subtitle_params:
+        vf = tracks.subtitle_params[tracks.subtitle_params.index("-vf") + 1] + ","
+    base = os.path.splitext(output_file)[0]
+    name = os.path.basename(base)
+    outputs = []
+    renditions = []
+    for rendition, (w, h) in rendition_sizes(width, height, params.video_renditions).items():
+        video_file = scratch_file(
+            tracks.scratch,
+            os.path.dirname(output_file),
+            f"{name}-{rendition}p-video.mp4",
+            expected_video_bytes(w, h, video_clip.duration),
+        )
+        outputs.append(
+            [
+                # the audio mix can be an input too, the renditions get it when muxed
+                "-map",
+                "0:v",
+                "-vf",
+                f"{vf}scale={w}:{h}",
+                *encoder_args(profile),
+                "-threads",
+                str(params.n_threads or 2),
+                "-pix_fmt",
+                "yuv420p",
+                video_file,
+            ]
+        )
+        renditions.append((video_file, f"{base}-{rendition}p.mp4"))
+    if params.video_poster:
+        frame = int(video_clip.duration * video_fps * poster_position)
+        outputs.append(
+            ["-vf", f"{vf}select=eq(n\\,{frame})", "-frames:v", "1", "-q:v", "2", "-update", "1", f"{base}-poster.jpg"]
+        )
+    if params.video_sprite:
+        count = sprite_columns * sprite_rows
+        outputs.append(
+            [
+                "-vf",
+                f"{vf}fps={count}/{video_clip.duration:.3f},scale={sprite_width}:-2,tile={sprite_columns}x{sprite_rows}",
+                "-frames:v",
+                "1",
+                "-q:v",
+                "3",
+                "-update",
+                "1",
+                f"{base}-sprite.jpg",
+            ]
+        )
+    return outputs, renditions
+
+
+def write_final_video(
+    video_clip,
+    tracks: RenderTracks,
+    output_file: str,
+    params: VideoParams,
+    video_fps: int = fps,
+):
+    """
+    encode the picture with the shared subtitles and mux the shared audio mix next to it.
+    the renditions, poster and sprite sheet of params are encoded from the same frames in the same pass.
+    with video_hls the audio mix is encoded along and the final video is written together with an hls
+    playlist that can be played while the encode runs.
+    """
+    name = os.path.splitext(os.path.basename(output_file))[0]
+    profile = get_encoder_profile(params.encoder_profile)
+    queue_size = int(config.app.get("frame_queue_size", 4))
+    extra_outputs, renditions = _extra_outputs(video_clip, tracks, output_file, params, profile, video_fps)
+    if extra_outputs or params.video_hls:
+        # only the pipeline feeds several outputs
+        queue_size = max(queue_size, 1)
+
+    inputs = []
+    video_args = encoder_args(profile) + tracks.subtitle_params
+    if params.video_hls:
+        # one encode muxed into the final video and the playlist, nothing is muxed afterwards
+        segment_time = config.app.get("hls_segment_time", 4)
+        playlist_file = hls_playlist_file(output_file)
+        shutil.rmtree(os.path.dirname(playlist_file), ignore_errors=True)
+        os.makedirs(os.path.dirname(playlist_file))
+        video_file = ffmpeg_utils.hls_tee_target(output_file, playlist_file, segment_time)
+        inputs = ["-i", tracks.audio_file]
+        video_args = [
+            "-map",
+            "0:v",
+            "-map",
+            "1:a",
+            *video_args,
+            "-force_key_frames",
+            f"expr:gte(t,n_forced*{segment_time})",
+            "-c:a",
+            audio_codec,
+            "-b:a",
+            profile["audio_bitrate"],
+            "-shortest",
+            "-flags",
+            "+global_header",
+            "-f",
+            "tee",
+        ]
+        muxes = renditions
+        logger.info(f"streaming {output_file} to {playlist_file}")
+    else:
+        video_file = scratch_file(
+            tracks.scratch,
+            os.path.dirname(output_file),
+            f"{name}-video.mp4",
+            expected_video_bytes(video_clip.w, video_clip.h, video_clip.duration),
+        )
+        muxes = [(video_file, output_file)] + renditions
+
+    if queue_size <= 0 or not tracks.composite_subtitles:
+        video_clip = tracks.apply_subtitles(video_clip)
+    try:
+        if queue_size > 0:
+            # decoding, compositing the subtitles and feeding the encoder run on their own threads
+            frame_pipeline.write_frames(
+                video_clip,
+                video_file,
+                video_fps,
+                video_args,
+                composite=tracks.composite_subtitles,
+                threads=params.n_threads or 2,
+                queue_size=queue_size,
+                extra_outputs=extra_outputs,
+                inputs=inputs,
+            )
+        else:
+            video_clip.write_videofile(
+                video_file,
+                audio=False,
+                threads=params.n_threads or 2,
+                logger=None,
+                fps=video_fps,
+                **encoder_write_args(profile, tracks.subtitle_params),
+            )
+    finally:
+        close_clip(video_clip)
+    try:
+        for track_file, mux_file in muxes:
+            ffmpeg_utils.mux(
+                track_file,
+                tracks.audio_file,
+                mux_file,
+                audio_args=["-c:a", audio_codec, "-b:a", profile["audio_bitrate"]],
+            )
+    finally:
+        delete_intermediates(tracks.scratch, [track_file for track_file, _ in muxes])
+    return output_file
+
+
+def _run_variants(func, jobs: list, max_workers: int = 1) -> list:
+    # the heavy lifting happens in ffmpeg and numpy, so threads are enough
+    if max_workers > 1 and len(jobs) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(func, jobs))
+    return [func(job) for job in jobs]
+
+
+def generate_videos(
+    video_paths: List[str],
+    audio_path: str,
+    subtitle_path: str,
+    output_files: List[str],
+    params: VideoParams,
+    max_workers: int = 1,
+    scratch: TaskScratch = None,
+) -> List[str]:
+    """
+    render one final video per combined video, sharing a single subtitle track and audio mix.
+    """
+    aspect = VideoAspect(params.video_aspect)
+    video_width, video_height = aspect.to_resolution()
+
+    logger.info(f"generating {len(video_paths)} videos: {video_width} x {video_height}")
+    logger.info(f"  ① video: {', '.join(video_paths)}")
+    logger.info(f"  ② audio: {audio_path}")
+    logger.info(f"  ③ subtitle: {subtitle_path}")
+    logger.info(f"  ④ output: {', '.join(output_files)}")
+
+    # https://github.com/harry0703/MoneyPrinterTurbo/issues/217
+    # PermissionError: [WinError 32] The process cannot access the file because it is being used by another process: 'final-1.mp4.tempTEMP_MPY_wvf_snd.mp3'
+    # write into the same directory as the output file
+    output_dir = os.path.dirname(output_files[0])
+
+    # the bgm runs as long as the longest variant, shorter ones cut it while muxing
+    duration = max(media_index.index.get(video_path)["duration"] for video_path in video_paths)
+    bgm_file = get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file)
+    tracks = prepare_tracks(
+        audio_path,
+        subtitle_path,
+        params,
+        video_width,
+        video_height,
+        duration=duration,
+        bgm_file=bgm_file,
+        output_dir=output_dir,
+        scratch=scratch,
+    )
+
+    with ClipScope("final videos") as scope:
+
+        def render(job):
+            video_path, output_file = job
+            video_clip = scope.track(VideoFileClip(video_path, audio=False))
+            return write_final_video(video_clip, tracks, output_file, params)
+
+        try:
+            return _run_variants(render, list(zip(video_paths, output_files)), max_workers)
+        finally:
+            tracks.close()
+
+
+def generate_video(
+    video_path: str,
+    audio_path: str,
+    subtitle_path: str,
+    output_file: str,
+    params: VideoParams,
+):
+    return generate_videos([video_path], audio_path, subtitle_path, [output_file], params)[0]
+
+
+def build_timeline(
+    video_paths: List[str],
+    audio_file: str,
+    subtitle_path: str,
+    params: VideoParams,
+) -> Timeline:
+    """
+    describe the whole final video (clips, transitions, subtitles and audio mix)
+    without rendering anything, so it can be encoded in a single pass.
+    """
+    aspect = VideoAspect(params.video_aspect)
+    video_width, video_height = aspect.to_resolution()
+
+    audio_duration = media_index.index.get(audio_file)["duration"]
+
+    subclipped_items = get_subclipped_items(
+        video_paths=video_paths,
+        max_clip_duration=params.video_clip_duration,
+        video_concat_mode=VideoConcatMode(params.video_concat_mode),
+    )
+    transition_mode = (
+        VideoTransitionMode(params.video_transition_mode)
+        if params.video_transition_mode
+        else None
+    )
+
+    timeline_clips = []
+    for item in plan_segments(subclipped_items, audio_duration):
+        transition, side = resolve_transition(transition_mode)
+        timeline_clips.append(
+            TimelineClip(
+                file_path=item.file_path,
+                start_time=item.start_time,
+                end_time=item.end_time,
+                transition=transition,
+                transition_side=side,
+            )
+        )
+
+    return Timeline(
+        width=video_width,
+        height=video_height,
+        fps=fps,
+        duration=audio_duration,
+        clips=timeline_clips,
+        audio_file=audio_file,
+        subtitle_path=subtitle_path or "",
+        bgm_file=get_bgm_file(bgm_type=params.bgm_type, bgm_file=params.bgm_file),
+    )
+
+
+def render_timeline(
+    timeline: Timeline,
+    output_file: str,
+    params: VideoParams,
+    tracks: RenderTracks = None,
+    scratch: TaskScratch = None,
+) -> str:
+    """
+    render a timeline straight to the final mp4 with exactly one encode.
+    tracks prepared for other timelines of the same task can be passed in to share them.
+    """
+    logger.info(f"rendering timeline: {timeline.width} x {timeline.height}, {len(timeline.clips)} clips => {output_file}")
+    if not timeline.clips:
+        raise ValueError("timeline has no clips to render")
+
+    own_tracks = tracks is None
+    if own_tracks:
+        tracks = prepare_tracks(
+            timeline.audio_file,
+            timeline.subtitle_path,
+            params,
+            timeline.width,
+            timeline.height,
+            duration=timeline.duration,
+            bgm_file=timeline.bgm_file,
+            output_dir=os.path.dirname(output_file),
+            scratch=scratch,
+        )
+
+    # open every source once, subclips of the same file share its reader.
+    # timelines rendered together by render_timelines share the collection of their stage
+    sources = {}
+    clips = []
+    with ClipScope("timeline", collect=own_tracks) as scope:
+        try:
+            for item in timeline.clips:
+                if item.file_path not in sources:
+                    sources[item.file_path] = scope.track(
+                        open_video(item.file_path, timeline.width, timeline.height)
+                    )
+                clip = sources[item.file_path].subclipped(item.start_time, item.end_time)
+                clip = resize_clip(clip, timeline.width, timeline.height)
+                clip = apply_transition(clip, item.transition, item.transition_side)
+                clips.append(clip)
+
+            video_clip = concatenate_videoclips(clips)
+            if video_clip.duration > timeline.duration:
+                video_clip = video_clip.subclipped(0, timeline.duration)
+            write_final_video(video_clip, tracks, output_file, params, video_fps=timeline.fps)
+        finally:
+            if own_tracks:
+                tracks.close()
+    logger.info(f"timeline rendered: {output_file}")
+    return output_file
+
+
+def render_timelines(
+    timelines: List[Timeline],
+    output_files: List[str],
+    params: VideoParams,
+    max_workers: int = 1,
+    scratch: TaskScratch = None,
+) -> List[str]:
+    """
+    render timelines of the same task, the subtitle track and audio mix are built once.
+    """
+    first = timelines[0]
+    tracks = prepare_tracks(
+        first.audio_file,
+        first.subtitle_path,
+        params,
+        first.width,
+        first.height,
+        duration=max(timeline.duration for timeline in timelines),
+        bgm_file=first.bgm_file,
+        output_dir=os.path.dirname(output_files[0]),
+        scratch=scratch,
+    )
+    with ClipScope("timelines"):
+        try:
+            return _run_variants(
+                lambda job: render_timeline(job[0], job[1], params, tracks),
+                list(zip(timelines, output_files)),
+                max_workers,
+            )
+        finally:
+            tracks.close()
+
+
+def render_preview(
+    timeline: Timeline,
+    output_file: str,
+    params: VideoParams,
+    scale: float = 1 / 3,
+    preview_fps: int = 12,
+    scratch: TaskScratch = None,
+) -> str:
+    """
+    render a reduced-resolution, low-fps proxy of the timeline with the draft profile.
+    the timeline itself is left untouched so it can be promoted to a full render later.
+    """
+    # libx264 needs even dimensions
+    width = max(int(timeline.width * scale) // 2 * 2, 2)
+    height = max(int(timeline.height * scale) // 2 * 2, 2)
+    preview_timeline = timeline.model_copy(
+        update={"width": width, "height": height, "fps": min(preview_fps, timeline.fps)}
+    )
+    preview_params = params.model_copy(
+        update={
+            "font_size": max(int(params.font_size * scale), 8),
+            "stroke_width": max(int(round(params.stroke_width * scale)), 1) if params.stroke_width else 0,
+            "encoder_profile": "draft",
+            "video_renditions": None,
+            "video_poster": False,
+            "video_sprite": False,
+            "video_hls": False,
+        }
+    )
+    logger.info(f"rendering preview: {width} x {height}, {preview_timeline.fps} fps")
+    return render_timeline(preview_timeline, output_file, preview_params, scratch=scratch)
+
+
+def _image_to_video(material: MaterialInfo, clip_duration: float, profile: dict) -> MaterialInfo:
+    logger.info(f"processing image: {material.url}")
+    video_file = f"{material.url}.mp4"
+    # zoom from 100% to 100% + 3% per second of the clip, centered, like the previous resize lambda
+    ffmpeg_utils.image_to_video(
+        material.url,
+        video_file,
+        duration=clip_duration,
+        zoom=clip_duration * 0.03,
+        encoder_args=encoder_args(profile),
         fps=fps,
     )
-    video_clip.close()
-    del video_clip
+    material.url = video_file
+    logger.success(f"image processed: {video_file}")
+    return material
 
 
-def preprocess_video(materials: List[MaterialInfo], clip_duration=4):
+def preprocess_video(
+    materials: List[MaterialInfo],
+    clip_duration=4,
+    encoder_profile: str = None,
+    max_workers: int = 1,
+):
+    profile = get_encoder_profile(encoder_profile)
+    images = []
     for material in materials:
         if not material.url:
             continue
 
         ext = utils.parse_extension(material.url)
-        try:
-            clip = VideoFileClip(material.url)
-        except Exception:
-            clip = ImageClip(material.url)
-
-        width = clip.size[0]
-        height = clip.size[1]
+        info = media_index.index.get(material.url)
+        width = info["width"]
+        height = info["height"]
         if width < 480 or height < 480:
             logger.warning(f"low resolution material: {width}x{height}, minimum 480x480 required")
             continue
 
         if ext in const.FILE_TYPE_IMAGES:
-            logger.info(f"processing image: {material.url}")
-            # Create an image clip and set its duration to 3 seconds
-            clip = (
-                ImageClip(material.url)
-                .with_duration(clip_duration)
-                .with_position("center")
-            )
-            # Apply a zoom effect using the resize method.
-            # A lambda function is used to make the zoom effect dynamic over time.
-            # The zoom effect starts from the original size and gradually scales up to 120%.
-            # t represents the current time, and clip.duration is the total duration of the clip (3 seconds).
-            # Note: 1 represents 100% size, so 1.2 represents 120% size.
-            zoom_clip = clip.resized(
-                lambda t: 1 + (clip_duration * 0.03) * (t / clip.duration)
-            )
+            images.append(material)
+
+    # every image is converted by its own ffmpeg process, threads are enough to run them in parallel
+    def convert(material):
+        return _image_to_video(material, clip_duration, profile)
 
-            # Optionally, create a composite video clip containing the zoomed clip.
-            # This is useful when you want to add other elements to the video.
-            final_clip = CompositeVideoClip([zoom_clip])
-
-            # Output the video to a file.
-            video_file = f"{material.url}.mp4"
-            final_clip.write_videofile(video_file, fps=30, logger=None)
-            close_clip(clip)
-            material.url = video_file
-            logger.success(f"image processed: {video_file}")
-    return materials
\ No newline at end of file
+    if max_workers > 1 and len(images) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(convert, images))
+    else:
+        for material in images:
+            convert(material)
+    return materials
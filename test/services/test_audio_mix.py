@@ -0,0 +1,70 @@
+import unittest
+import os
+import sys
+import tempfile
+import wave
+from pathlib import Path
+
+import numpy as np
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services.utils import audio_mix, ffmpeg_utils
+
+
+class TestAudioMix(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _tone(self, name, duration, frequency=440):
+        file_path = os.path.join(self.temp_dir.name, name)
+        ffmpeg_utils.run_ffmpeg(
+            ["-f", "lavfi", "-i", f"sine=frequency={frequency}:duration={duration}", file_path]
+        )
+        return file_path
+
+    def test_loop(self):
+        samples = np.arange(10, dtype=np.float32).reshape(5, 2)
+        # plays up to frame 4 once, then repeats frames 1 to 3
+        looped = audio_mix.loop(samples, 9, loop_start=1, loop_end=4)
+        self.assertEqual(looped.shape, (9, 2))
+        np.testing.assert_array_equal(looped[:4], samples[:4])
+        np.testing.assert_array_equal(looped[4:7], samples[1:4])
+        np.testing.assert_array_equal(audio_mix.loop(samples, 2), samples[:2])
+
+    def test_ducking_gain(self):
+        rate = audio_mix.sample_rate
+        voice = np.zeros((4 * rate, 2), dtype=np.float32)
+        # narration between 1s and 2s
+        voice[rate : 2 * rate] = 0.5
+        gain = audio_mix.ducking_gain(voice, len(voice), 0.25)
+        self.assertEqual(len(gain), len(voice))
+        self.assertAlmostEqual(gain[int(0.5 * rate)], 1.0, places=3)
+        self.assertAlmostEqual(gain[int(1.5 * rate)], 0.25, places=3)
+        # held through the end of the narration, released afterwards
+        self.assertAlmostEqual(gain[int(2.1 * rate)], 0.25, places=3)
+        self.assertAlmostEqual(gain[int(3.5 * rate)], 1.0, places=3)
+
+    def test_mix(self):
+        voice_file = self._tone("voice.mp3", 2)
+        bgm = audio_mix.loop(audio_mix.decode_pcm(self._tone("bgm.mp3", 1, frequency=220)), 3 * audio_mix.sample_rate)
+        output_file = os.path.join(self.temp_dir.name, "mix.wav")
+        audio_mix.mix(voice_file, output_file, bgm=bgm, bgm_volume=0.2, ducked_gain=0.3)
+        with wave.open(output_file, "rb") as f:
+            self.assertEqual(f.getnchannels(), audio_mix.channels)
+            self.assertEqual(f.getframerate(), audio_mix.sample_rate)
+            # the bgm is looped to 3s, beyond the 2s narration
+            self.assertAlmostEqual(f.getnframes() / f.getframerate(), 3, delta=0.05)
+            samples = np.frombuffer(f.readframes(f.getnframes()), dtype="<i2")
+        tail = samples.reshape(-1, 2)[int(2.2 * audio_mix.sample_rate) : int(2.5 * audio_mix.sample_rate)]
+        # only the bgm plays after the narration
+        self.assertGreater(np.abs(tail).max(), 0)
+        self.assertLess(np.abs(tail).max(), 0.25 * 32767)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services.bgm_library import BgmLibrary
+from app.services.utils import audio_mix, ffmpeg_utils
+
+
+class TestBgmLibrary(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.song_dir = os.path.join(self.temp_dir.name, "songs")
+        os.makedirs(self.song_dir)
+        self.library = BgmLibrary(
+            db_file=os.path.join(self.temp_dir.name, "bgm_library.db"),
+            cache_dir=os.path.join(self.temp_dir.name, "cache_bgm"),
+            target_loudness=-20.0,
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _song(self, name, volume=0.5):
+        # 1s of silence, 2s of tone, 1s of silence
+        file_path = os.path.join(self.song_dir, name)
+        ffmpeg_utils.run_ffmpeg(
+            [
+                "-f",
+                "lavfi",
+                "-i",
+                "sine=frequency=440:duration=2",
+                "-af",
+                f"volume={volume},adelay=1000:all=1,apad=pad_dur=1",
+                file_path,
+            ]
+        )
+        return file_path
+
+    def test_get(self):
+        song = self._song("song.mp3")
+        info = self.library.get(song)
+        self.assertAlmostEqual(info["duration"], 4, delta=0.1)
+        self.assertTrue(-30 < info["loudness"] < -5)
+        self.assertAlmostEqual(info["loop_start"] / audio_mix.sample_rate, 1, delta=0.05)
+        self.assertAlmostEqual(info["loop_end"] / audio_mix.sample_rate, 3, delta=0.05)
+        # the second access reads the index instead of decoding again
+        mtime = os.path.getmtime(info["pcm_file"])
+        self.assertEqual(self.library.get(song)["pcm_file"], info["pcm_file"])
+        self.assertEqual(os.path.getmtime(info["pcm_file"]), mtime)
+
+    def test_samples_are_looped_and_normalized(self):
+        quiet = self.library.get(self._song("quiet.mp3", volume=0.5))
+        loud = self.library.get(self._song("loud.mp3", volume=2.0))
+        self.assertGreater(loud["loudness"] - quiet["loudness"], 10)
+
+        rate = audio_mix.sample_rate
+        quiet_samples = self.library.samples(quiet["path"], 10)
+        loud_samples = self.library.samples(loud["path"], 10)
+        self.assertEqual(quiet_samples.shape, (10 * rate, audio_mix.channels))
+        self.assertEqual(quiet_samples.dtype, np.float32)
+        # the tone repeats without the silence around it
+        self.assertGreater(np.abs(quiet_samples[int(4.5 * rate) : int(5 * rate)]).max(), 0)
+        # both songs are brought to the same loudness
+        quiet_peak = np.abs(quiet_samples).max()
+        loud_peak = np.abs(loud_samples).max()
+        self.assertAlmostEqual(quiet_peak / loud_peak, 1, delta=0.1)
+
+    def test_refresh(self):
+        first = self._song("first.mp3")
+        self.assertEqual(len(self.library.refresh(self.song_dir)), 1)
+        self._song("second.mp3")
+        songs = self.library.refresh(self.song_dir)
+        self.assertEqual(len(songs), 2)
+
+        pcm_file = self.library.get(first)["pcm_file"]
+        os.remove(first)
+        self.assertEqual(len(self.library.refresh(self.song_dir)), 1)
+        self.assertFalse(os.path.exists(pcm_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services.clip_cache import ClipCache
+
+resources_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "resources")
+
+
+class TestClipCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source_file = os.path.join(resources_dir, "2.png.mp4")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _make_clip(self, name, size):
+        clip_file = os.path.join(self.temp_dir.name, name)
+        with open(clip_file, "wb") as f:
+            f.write(b"\0" * size)
+        return clip_file
+
+    def test_key_depends_on_window_and_target(self):
+        key = ClipCache.make_key(self.source_file, 0, 3, width=1080, height=1920)
+        self.assertEqual(key, ClipCache.make_key(self.source_file, 0, 3, width=1080, height=1920))
+        self.assertNotEqual(key, ClipCache.make_key(self.source_file, 3, 6, width=1080, height=1920))
+        self.assertNotEqual(key, ClipCache.make_key(self.source_file, 0, 3, width=1920, height=1080))
+
+    def test_get_and_put(self):
+        cache = ClipCache(os.path.join(self.temp_dir.name, "cache"), max_size=1024)
+        target_file = os.path.join(self.temp_dir.name, "target.mp4")
+        self.assertFalse(cache.get("missing", target_file))
+
+        cache.put("a", self._make_clip("a.mp4", 100))
+        self.assertTrue(cache.get("a", target_file))
+        self.assertEqual(os.path.getsize(target_file), 100)
+
+        # the materialized clip can be deleted without touching the cache
+        os.remove(target_file)
+        self.assertTrue(cache.get("a", target_file))
+
+    def test_lru_eviction(self):
+        cache = ClipCache(os.path.join(self.temp_dir.name, "cache"), max_size=250)
+        target_file = os.path.join(self.temp_dir.name, "target.mp4")
+        cache.put("a", self._make_clip("a.mp4", 100))
+        time.sleep(0.05)
+        cache.put("b", self._make_clip("b.mp4", 100))
+        time.sleep(0.05)
+        # "a" becomes the most recently used entry
+        self.assertTrue(cache.get("a", target_file))
+        time.sleep(0.05)
+        cache.put("c", self._make_clip("c.mp4", 100))
+
+        self.assertTrue(cache.get("a", target_file))
+        self.assertFalse(cache.get("b", target_file))
+        self.assertTrue(cache.get("c", target_file))
+
+    def test_disabled(self):
+        cache = ClipCache(os.path.join(self.temp_dir.name, "cache"), max_size=0)
+        cache.put("a", self._make_clip("a.mp4", 100))
+        self.assertFalse(cache.get("a", os.path.join(self.temp_dir.name, "target.mp4")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import gc
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from moviepy import ColorClip, CompositeVideoClip, VideoFileClip
+
+from app.models.schema import VideoConcatMode
+from app.services import clip_scope
+from app.services import video as vd
+from app.services.clip_scope import ClipScope, close_clip
+from app.services.utils import ffmpeg_utils
+
+resources_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "resources")
+
+
+class TestClipScope(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.video_file = os.path.join(cls.temp_dir.name, "color.mp4")
+        ColorClip((64, 64), color=(255, 0, 0), duration=2).write_videofile(
+            cls.video_file, fps=10, logger=None
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def test_close_clip(self):
+        clip = VideoFileClip(self.video_file)
+        composite = CompositeVideoClip([clip, clip.subclipped(0, 1)])
+        proc = clip.reader.proc
+        with mock.patch.object(clip_scope.gc, "collect") as collect:
+            close_clip(composite)
+            # closing twice is harmless
+            close_clip(composite)
+        collect.assert_not_called()
+        self.assertIsNotNone(proc.poll())
+        self.assertIsNone(clip.reader.proc)
+        self.assertEqual(composite.clips, [])
+
+    def test_scope_closes_on_failure_and_collects_once(self):
+        with mock.patch.object(clip_scope.gc, "collect", return_value=0) as collect:
+            with self.assertRaises(RuntimeError):
+                with ClipScope("test") as scope:
+                    clips = [scope.track(VideoFileClip(self.video_file)) for _ in range(3)]
+                    with ClipScope("nested", collect=False) as nested:
+                        nested.track(clips[0].subclipped(0, 1))
+                    raise RuntimeError("render failed")
+        self.assertEqual(collect.call_count, 1)
+        for clip in clips:
+            self.assertIsNone(clip.reader.proc)
+        self.assertEqual(scope.clips, [])
+
+    def test_combine_videos_collections_benchmark(self):
+        """benchmark of the collector time in combine_videos, which has a single combine stage"""
+        audio_file = os.path.join(self.temp_dir.name, "audio.mp3")
+        ffmpeg_utils.run_ffmpeg(["-f", "lavfi", "-i", "sine=frequency=440:duration=6", audio_file])
+        video_paths = [os.path.join(resources_dir, f"{i}.png.mp4") for i in (2, 3)]
+
+        full_collections = []
+        collector_start = [0.0]
+
+        def on_collect(phase, info):
+            if phase == "start":
+                collector_start[0] = time.perf_counter()
+            elif info["generation"] == 2:
+                full_collections.append(time.perf_counter() - collector_start[0])
+
+        # only the explicit collections are counted, the automatic ones depend on allocation counts
+        gc.disable()
+        gc.callbacks.append(on_collect)
+        start = time.perf_counter()
+        try:
+            # every 1s clip is normalized in process, none come from the clip cache
+            with mock.patch.object(vd.clip_cache.cache, "max_size", 0):
+                vd.combine_videos(
+                    os.path.join(self.temp_dir.name, "combined.mp4"),
+                    video_paths,
+                    audio_file,
+                    video_concat_mode=VideoConcatMode.sequential,
+                    max_clip_duration=1,
+                    encoder_profile="draft",
+                )
+        finally:
+            gc.callbacks.remove(on_collect)
+            gc.enable()
+        wall = time.perf_counter() - start
+        print(
+            f"combine_videos: {wall:.1f} s, {len(full_collections)} full collections, "
+            f"{sum(full_collections) * 1000:.0f} ms in the collector"
+        )
+
+        # the clips are closed one by one, the combine stage collects once
+        self.assertLessEqual(len(full_collections), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from moviepy import VideoClip, VideoFileClip
+
+from app.services.utils import ffmpeg_utils, frame_pipeline
+
+
+def _gradient(t):
+    frame = np.zeros((48, 64, 3), dtype=np.uint8)
+    frame[:, :, 0] = int(t * 100) % 256
+    frame[:, :, 1] = np.arange(64, dtype=np.uint8)[None, :] * 4
+    return frame
+
+
+class TestFramePipeline(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_write_frames(self):
+        clip = VideoClip(_gradient, duration=2)
+        output_file = os.path.join(self.temp_dir.name, "out.mp4")
+
+        def composite(frame, t):
+            # a white box where subtitles would go, blended in place
+            frame[40:46, 8:56] = 255
+            return frame
+
+        stats = frame_pipeline.write_frames(
+            clip, output_file, 10, ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "0"], composite, queue_size=2
+        )
+        self.assertEqual(stats["frames"], 20)
+        self.assertIn(stats["bottleneck"], frame_pipeline.stages)
+        for stage in frame_pipeline.stages:
+            self.assertIn("fps", stats["stages"][stage])
+        # the consumer can take a frame before its put is measured, so an average of 0 is possible
+        for occupancy in stats["queues"].values():
+            self.assertTrue(0 <= occupancy <= 2)
+
+        result = VideoFileClip(output_file)
+        try:
+            self.assertEqual(result.size, [64, 48])
+            self.assertAlmostEqual(result.duration, 2, delta=0.15)
+            frame = result.get_frame(1.0)
+            self.assertGreater(frame[42, 30].min(), 240)
+            expected = _gradient(1.0)
+            self.assertLess(np.abs(frame[:30].astype(int) - expected[:30]).mean(), 6)
+        finally:
+            result.close()
+
+    def test_extra_outputs(self):
+        clip = VideoClip(_gradient, duration=2)
+        output_file = os.path.join(self.temp_dir.name, "out.mp4")
+        small_file = os.path.join(self.temp_dir.name, "small.mp4")
+        poster_file = os.path.join(self.temp_dir.name, "poster.jpg")
+        args = ["-c:v", "libx264", "-preset", "ultrafast"]
+        frame_pipeline.write_frames(
+            clip,
+            output_file,
+            10,
+            args,
+            queue_size=1,
+            extra_outputs=[
+                ["-vf", "scale=32:24", *args, "-pix_fmt", "yuv420p", small_file],
+                ["-vf", "select=eq(n\\,5)", "-frames:v", "1", "-update", "1", poster_file],
+            ],
+        )
+        # every output is fed from the same frames
+        for file_path, size in ((output_file, [64, 48]), (small_file, [32, 24])):
+            result = VideoFileClip(file_path)
+            try:
+                self.assertEqual(result.size, size)
+                self.assertAlmostEqual(result.duration, 2, delta=0.15)
+            finally:
+                result.close()
+        self.assertGreater(os.path.getsize(poster_file), 0)
+
+    def test_hls_tee(self):
+        clip = VideoClip(_gradient, duration=3)
+        # the tee muxer needs colons escaped in file names and option values
+        output_dir = os.path.join(self.temp_dir.name, "task:1")
+        os.makedirs(os.path.join(output_dir, "hls"))
+        output_file = os.path.join(output_dir, "final.mp4")
+        playlist_file = os.path.join(output_dir, "hls", "index.m3u8")
+        frame_pipeline.write_frames(
+            clip,
+            ffmpeg_utils.hls_tee_target(output_file, playlist_file, 1),
+            10,
+            [
+                "-map", "0:v", "-map", "1:a",
+                "-c:v", "libx264", "-preset", "ultrafast", "-force_key_frames", "expr:gte(t,n_forced*1)",
+                "-c:a", "aac", "-shortest", "-flags", "+global_header", "-f", "tee",
+            ],
+            queue_size=1,
+            inputs=["-f", "lavfi", "-i", "sine=duration=5"],
+        )
+        self.assertTrue(ffmpeg_utils.probe(output_file)["has_audio"])
+        with open(playlist_file) as f:
+            playlist = f.read()
+        self.assertIn("#EXT-X-ENDLIST", playlist)
+        self.assertEqual(playlist.count(".m4s"), 3)
+        self.assertTrue(os.path.isfile(os.path.join(output_dir, "hls", "segment-00000.m4s")))
+
+    def test_stage_failure(self):
+        clip = VideoClip(_gradient, duration=2)
+        output_file = os.path.join(self.temp_dir.name, "failed.mp4")
+
+        def composite(frame, t):
+            if t >= 1:
+                raise ValueError("composite failed")
+            return frame
+
+        with self.assertRaises(ValueError):
+            frame_pipeline.write_frames(
+                clip, output_file, 10, ["-c:v", "libx264", "-preset", "ultrafast"], composite, queue_size=2
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import VideoParams
+from app.services import video as vd
+from app.services.manifest import RenderManifest, params_fingerprint
+
+
+class TestRenderManifest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.manifest_file = os.path.join(self.temp_dir.name, "manifest.json")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write(self, name, content):
+        file_path = os.path.join(self.temp_dir.name, name)
+        with open(file_path, "wb") as f:
+            f.write(content)
+        return file_path
+
+    def test_stage_checkpoints(self):
+        audio_file = self._write("audio.mp3", b"audio")
+        manifest = RenderManifest(self.manifest_file)
+        manifest.reset("params")
+        self.assertIsNone(manifest.get_stage("audio"))
+        manifest.complete_stage("audio", {"audio_file": audio_file, "audio_duration": 8}, [audio_file, ""])
+
+        # a new process reads the checkpoint back from disk
+        manifest = RenderManifest(self.manifest_file)
+        self.assertEqual(manifest.fingerprint, "params")
+        self.assertEqual(manifest.get_stage("audio")["audio_duration"], 8)
+
+        # a file with the same size but different content invalidates the stage
+        self._write("audio.mp3", b"AUDIO")
+        self.assertIsNone(manifest.get_stage("audio"))
+
+    def test_clip_checkpoints(self):
+        clip_file = self._write("temp-clip-1.mp4", b"clip")
+        manifest = RenderManifest(self.manifest_file)
+        manifest.add_clip("a", clip_file, duration=3, transition="fade")
+        manifest.add_clip("b")
+        manifest.add_clip("c", self._write("temp-clip-2.mp4", b"clip"), duration=3)
+        os.remove(os.path.join(self.temp_dir.name, "temp-clip-2.mp4"))
+
+        clips = RenderManifest(self.manifest_file).get_clips()
+        self.assertEqual(sorted(clips), ["a", "b"])
+        self.assertEqual(clips["a"]["transition"], "fade")
+        self.assertIsNone(clips["b"]["file_path"])
+
+        manifest.clear_clips()
+        self.assertEqual(manifest.get_clips(), {})
+
+    def test_clip_plan(self):
+        items = [
+            vd.SubClippedVideoClip(file_path=f"{i}.mp4", start_time=0, end_time=3, width=1080, height=1920)
+            for i in range(3)
+        ]
+        orders = [items, [items[2], items[0], items[1]]]
+        manifest = RenderManifest(self.manifest_file)
+        manifest.set_plan(vd._plan_to_dict(["0.mp4", "1.mp4", "2.mp4"], items, orders))
+
+        plan = RenderManifest(self.manifest_file).get_plan()
+        restored_items, restored_orders = vd._plan_from_dict(plan)
+        self.assertEqual([vd._subclip_key(item) for item in restored_items], [vd._subclip_key(item) for item in items])
+        self.assertEqual([item.file_path for item in restored_orders[1]], ["2.mp4", "0.mp4", "1.mp4"])
+        # every order refers to the same item objects, as random.sample does
+        self.assertIs(restored_orders[0][2], restored_orders[1][0])
+
+        # a recorded clip is restored into the pool of a resumed run
+        clip_file = self._write("temp-clip-1.mp4", b"clip")
+        manifest.add_clip(vd._manifest_clip_key(restored_items[1]), clip_file, duration=3)
+        pool = vd._restore_pool(manifest, restored_items)
+        self.assertEqual(pool[vd._subclip_key(restored_items[1])].file_path, clip_file)
+
+    def test_params_fingerprint(self):
+        params = VideoParams(video_subject="test", video_count=2)
+        restored = VideoParams(**params.dict(exclude_none=True))
+        self.assertEqual(
+            params_fingerprint(params.dict(exclude_none=True)),
+            params_fingerprint(restored.dict(exclude_none=True)),
+        )
+        params.video_count = 3
+        self.assertNotEqual(
+            params_fingerprint(params.dict(exclude_none=True)),
+            params_fingerprint(restored.dict(exclude_none=True)),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services.media_index import MediaIndex
+
+resources_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "resources")
+
+
+class TestMediaIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.index = MediaIndex(os.path.join(self.temp_dir.name, "media_index.db"))
+        self.video_file = os.path.join(self.temp_dir.name, "video.mp4")
+        shutil.copyfile(os.path.join(resources_dir, "2.png.mp4"), self.video_file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_get_video(self):
+        info = self.index.get(self.video_file)
+        print(info)
+        self.assertAlmostEqual(info["duration"], 3.0, delta=0.1)
+        self.assertEqual((info["width"], info["height"]), (580, 751))
+        self.assertEqual(info["fps"], 30.0)
+        self.assertEqual(info["codec"], "h264")
+        self.assertFalse(info["has_audio"])
+        self.assertIsNone(info["keyframes"])
+
+        # served from the index the second time
+        self.assertEqual(self.index._load(*self.index._identity(self.video_file))["width"], 580)
+
+    def test_get_image(self):
+        info = self.index.get(os.path.join(resources_dir, "1.png"))
+        self.assertEqual((info["width"], info["height"]), (580, 751))
+
+    def test_keyframes(self):
+        keyframes = self.index.get_keyframes(self.video_file)
+        print(keyframes)
+        self.assertTrue(keyframes)
+        self.assertEqual(keyframes[0], 0.0)
+        self.assertEqual(self.index.get(self.video_file)["keyframes"], keyframes)
+
+    def test_stale_entry(self):
+        self.index.get(self.video_file)
+        shutil.copyfile(os.path.join(resources_dir, "1.png"), self.video_file)
+        info = self.index.get(self.video_file)
+        self.assertEqual(info["codec"], "png")
+
+    def test_connection_closed(self):
+        with self.index._connect() as conn:
+            conn.execute("SELECT 1")
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.models.schema import AudioRequest, VideoParams
+from app.services import memory_budget
+
+
+class TestMemoryBudget(unittest.TestCase):
+    def test_estimate_task_memory(self):
+        portrait = VideoParams(video_subject="test", video_aspect="9:16", subtitle_renderer="overlay")
+        estimate = memory_budget.estimate_task_memory(portrait)
+        self.assertGreater(estimate, memory_budget.light_task_mb)
+
+        # a preview renders a fraction of the pixels
+        self.assertLess(memory_budget.estimate_task_memory(portrait, stop_at="preview"), estimate)
+        # tasks that stop before rendering only need the light task memory
+        self.assertEqual(
+            memory_budget.estimate_task_memory(AudioRequest(video_script="test"), stop_at="audio"),
+            memory_budget.light_task_mb,
+        )
+
+        # subtitle images grow with the script, burned in ass subtitles need none
+        long_script = portrait.model_copy(update={"video_script": "word " * 2000})
+        self.assertGreater(memory_budget.estimate_task_memory(long_script), estimate)
+        ass = long_script.model_copy(update={"subtitle_renderer": "ass"})
+        self.assertLess(memory_budget.estimate_task_memory(ass), memory_budget.estimate_task_memory(long_script))
+
+    def test_process_tree_rss(self):
+        if not os.path.isdir("/proc"):
+            self.skipTest("/proc is not available")
+        before = memory_budget.process_tree_rss()
+        self.assertGreater(before, 0)
+
+        # a child process holding 200 MB is counted
+        child = subprocess.Popen(
+            [sys.executable, "-c", "import time; data = bytearray(200 * 1024 * 1024); time.sleep(30)"]
+        )
+        try:
+            deadline = time.time() + 10
+            while time.time() < deadline:
+                if memory_budget.process_tree_rss() - before > 150 * 1024 * 1024:
+                    break
+                time.sleep(0.1)
+            self.assertGreater(memory_budget.process_tree_rss() - before, 150 * 1024 * 1024)
+        finally:
+            child.kill()
+            child.wait()
+
+
+if __name__ == "__main__":
+    unittest.main()
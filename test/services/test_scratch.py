@@ -0,0 +1,80 @@
+import unittest
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# add project root to python path
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from app.services.scratch import ScratchSpace
+from app.utils import utils
+
+
+class TestScratchSpace(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.temp_dir.name, "scratch")
+        self.task_id = f"test-scratch-{os.getpid()}"
+
+    def tearDown(self):
+        ScratchSpace(self.root).cleanup(self.task_id)
+        task_dir = os.path.join(utils.task_dir(), self.task_id)
+        if os.path.isdir(task_dir):
+            os.rmdir(task_dir)
+        self.temp_dir.cleanup()
+
+    def _write(self, file_path, size):
+        with open(file_path, "wb") as f:
+            f.write(b"\0" * size)
+        return file_path
+
+    def test_path_and_cleanup(self):
+        space = ScratchSpace(self.root)
+        scratch = space.open(self.task_id)
+        clip_file = self._write(scratch.path("temp-clip-1.mp4"), 1000)
+        self.assertEqual(os.path.dirname(clip_file), os.path.join(self.root, self.task_id))
+
+        self._write(scratch.path("temp-clip-2.mp4"), 500)
+        scratch.delete([clip_file])
+        self.assertFalse(os.path.exists(clip_file))
+        # the peak includes the clip deleted above
+        self.assertEqual(scratch.peak_bytes, 1500)
+
+        scratch.close()
+        self.assertFalse(os.path.exists(os.path.join(self.root, self.task_id)))
+
+    def test_quota_spills_into_task_dir(self):
+        space = ScratchSpace(self.root, task_quota=1000)
+        scratch = space.open(self.task_id)
+        clip_file = scratch.path("temp-clip-1.mp4", expected_bytes=800)
+        self.assertEqual(os.path.dirname(clip_file), os.path.join(self.root, self.task_id))
+        # the first clip is not written yet, its expected size already counts
+        spilled = scratch.path("temp-clip-2.mp4", expected_bytes=300)
+        self.assertEqual(spilled, os.path.join(utils.task_dir(self.task_id), "scratch", "temp-clip-2.mp4"))
+        self._write(clip_file, 700)
+        self._write(spilled, 300)
+        self.assertEqual(scratch.used_bytes, 1000)
+        self.assertEqual(os.path.dirname(scratch.path("temp-clip-3.mp4", expected_bytes=200)), os.path.join(self.root, self.task_id))
+
+        scratch.close()
+        self.assertFalse(os.path.exists(spilled))
+
+    def test_cleanup_orphans(self):
+        space = ScratchSpace(self.root)
+        finished, interrupted = f"{self.task_id}-finished", f"{self.task_id}-interrupted"
+        for task_id in (finished, interrupted):
+            self._write(os.path.join(space.open(task_id).scratch_dir, "temp-clip-1.mp4"), 10)
+            space.release(task_id, keep=True)
+        running = space.open(self.task_id)
+
+        # tasks running in this process and the ones keep() asks for are left alone
+        space.cleanup_orphans(keep=lambda task_id: task_id == interrupted)
+        self.assertEqual(sorted(os.listdir(self.root)), sorted([interrupted, self.task_id]))
+        running.close()
+        for task_id in (finished, interrupted):
+            os.rmdir(os.path.join(utils.task_dir(), task_id))
+
+
+if __name__ == "__main__":
+    unittest.main()
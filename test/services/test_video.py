@@ -4,12 +4,14 @@ import os
 import sys
 from pathlib import Path
 from moviepy import (
+    ColorClip,
     VideoFileClip,
 )
 # add project root to python path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
-from app.models.schema import MaterialInfo
+from app.models.schema import MaterialInfo, VideoParams
 from app.services import video as vd
+from app.services.utils import ass_subtitles, ffmpeg_utils, subtitle_overlay
 from app.utils import utils
 
 resources_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "resources")
@@ -47,10 +49,29 @@ class TestVideoService(unittest.TestCase):
         if os.path.exists(materials[0].url):
             os.remove(materials[0].url)
     
+    def test_preprocess_video_parallel(self):
+        import shutil
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            materials = []
+            for i in (2, 3):
+                image_file = os.path.join(temp_dir, f"{i}.png")
+                shutil.copy(os.path.join(resources_dir, f"{i}.png"), image_file)
+                materials.append(MaterialInfo(provider="local", url=image_file))
+
+            materials = vd.preprocess_video(materials, clip_duration=3, max_workers=2)
+            for material in materials:
+                self.assertTrue(material.url.endswith(".png.mp4"))
+                info = ffmpeg_utils.probe(material.url)
+                self.assertAlmostEqual(info["duration"], 3.0, delta=0.1)
+                # libx264 needs even dimensions, the 580x751 image is cropped by one row
+                self.assertEqual((info["width"], info["height"]), (580, 750))
+
     def test_wrap_text(self):
         """test text wrapping function"""
         try:
-            font_path = os.path.join(utils.font_dir(), "STHeitiMedium.ttc")
+            font_path = os.path.join(utils.font_dir(), "Charm-Bold.ttf")
             if not os.path.exists(font_path):
                 self.fail(f"font file not found: {font_path}")
                 
@@ -81,5 +102,292 @@ class TestVideoService(unittest.TestCase):
         except Exception as e:
             self.fail(f"test wrap_text failed: {str(e)}")
 
+    def test_wrap_text_benchmark(self):
+        """microbenchmark of wrap_text over the test_wrap_text inputs"""
+        import time
+
+        font_path = os.path.join(utils.font_dir(), "Charm-Bold.ttf")
+        # (text, max_width), size 30
+        cases = [
+            ("This is a test text for wrapping long sentences in english language", 300),
+            ("这是一段用来测试中文长句换行的文本内容，应该会根据宽度限制进行换行处理", 300),
+            # no spaces, wrapped per character across accents and punctuation
+            ("aXfgbbà!…d!WijT,", 100),
+        ]
+        vd.load_font.cache_clear()
+        vd._text_metrics.cache_clear()
+        vd._text_size.cache_clear()
+        vd._pair_kerning.cache_clear()
+        # output of the uncached wrap_text for this font, width and size
+        expected = [
+            ("This is a test text for\nwrapping long sentences\nin english language", 120),
+            ("这是一段用来测试中文长句换行的文\n本内容，应该会根据宽度限制进行换\n行处理", 69),
+            ("aXfgbbà!\n…d!WijT\n,", 120),
+        ]
+
+        start = time.perf_counter()
+        results = [vd.wrap_text(text, max_width, font_path, 30) for text, max_width in cases]
+        cold = time.perf_counter() - start
+        self.assertEqual(results, expected)
+
+        rounds = 200
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for i, (text, max_width) in enumerate(cases):
+                self.assertEqual(vd.wrap_text(text, max_width, font_path, 30), expected[i])
+        warm = (time.perf_counter() - start) / rounds
+        print(f"wrap_text: cold {cold * 1000:.3f} ms, warm {warm * 1000:.3f} ms per round")
+
+        # the font is loaded once for every call with the same path and size
+        self.assertEqual(vd.load_font.cache_info().misses, 1)
+
+    def test_concat_clips(self):
+        clip_files = [os.path.join(resources_dir, f"{i}.png.mp4") for i in range(1, 4)]
+        output_file = os.path.join(resources_dir, "concat-test.mp4")
+        try:
+            # identical encoding parameters, so the clips are joined by stream copy
+            self.assertTrue(ffmpeg_utils.can_stream_copy(clip_files))
+            ffmpeg_utils.concat(clip_files, output_file)
+            info = ffmpeg_utils.probe(output_file)
+            print(info)
+            self.assertAlmostEqual(info["duration"], 9.0, delta=0.2)
+            self.assertEqual((info["width"], info["height"]), (580, 751))
+        finally:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+
+    def test_xfade_concat(self):
+        clip_files = [os.path.join(resources_dir, f"{i}.png.mp4") for i in range(2, 4)]
+        output_file = os.path.join(resources_dir, "xfade-test.mp4")
+        try:
+            # cut 2s windows from the sources, fit them into 360x640 and overlap them by 0.5s
+            ffmpeg_utils.xfade_concat(
+                clip_files,
+                durations=[2, 2],
+                transitions=[vd.video_effects.xfade_transition("SlideIn", "left")],
+                output_file=output_file,
+                transition_duration=0.5,
+                start_times=[0.5, 0.5],
+                size=(360, 640),
+            )
+            info = ffmpeg_utils.probe(output_file)
+            self.assertAlmostEqual(info["duration"], 3.5, delta=0.2)
+            self.assertEqual((info["width"], info["height"]), (360, 640))
+        finally:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+
+    def test_snap_to_keyframe(self):
+        keyframes = [0.0, 1.5, 3.2, 4.5]
+        self.assertEqual(vd._snap_to_keyframe(keyframes, 3.0, 0.5), 3.2)
+        self.assertEqual(vd._snap_to_keyframe(keyframes, 3.0, 0.5, before=True), None)
+        self.assertEqual(vd._snap_to_keyframe(keyframes, 5.0, 0.5, before=True), 4.5)
+        self.assertEqual(vd._snap_to_keyframe(keyframes, 2.0, 0.5), None)
+
+    def test_stream_copy_cut(self):
+        source_file = os.path.join(resources_dir, "2.png.mp4")
+        output_file = os.path.join(resources_dir, "cut-test.mp4")
+        try:
+            ffmpeg_utils.cut(source_file, 0, 2, output_file, fps=30)
+            info = ffmpeg_utils.probe(output_file)
+            self.assertAlmostEqual(info["duration"], 2.0, delta=0.1)
+            # the cut clip keeps the source encoding, so it can be joined with it by stream copy
+            self.assertTrue(ffmpeg_utils.can_stream_copy([source_file, output_file]))
+        finally:
+            if os.path.exists(output_file):
+                os.remove(output_file)
+
+    def test_decodes_tail(self):
+        import tempfile
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            video_file = os.path.join(temp_dir, "video.mp4")
+            truncated_file = os.path.join(temp_dir, "truncated.mp4")
+            # the header is written first, like the stock videos that are downloaded
+            ffmpeg_utils.run_ffmpeg(
+                [
+                    "-f", "lavfi", "-i", "testsrc2=s=320x180:d=4:r=30",
+                    "-c:v", "libx264", "-pix_fmt", "yuv420p", "-movflags", "+faststart", video_file,
+                ]
+            )
+            with open(video_file, "rb") as f:
+                data = f.read()
+            with open(truncated_file, "wb") as f:
+                f.write(data[: len(data) * 2 // 3])
+
+            # probe can not tell them apart
+            self.assertAlmostEqual(ffmpeg_utils.probe(truncated_file)["duration"], 4.0, delta=0.1)
+            self.assertTrue(ffmpeg_utils.decodes_tail(video_file, 4.0))
+            self.assertFalse(ffmpeg_utils.decodes_tail(truncated_file, 4.0))
+
+    def test_resize_clip_letterbox(self):
+        self.assertEqual(vd.fit_size(1920, 1080, 1080, 1920), (1080, 607))
+        self.assertEqual(vd.fit_size(720, 1280, 1080, 1920), (1080, 1920))
+
+        clip = ColorClip(size=(1080, 607), color=(255, 0, 0)).with_duration(1)
+        letterboxed = vd.resize_clip(clip, 1080, 1920)
+        self.assertEqual(tuple(letterboxed.size), (1080, 1920))
+        frame = letterboxed.get_frame(0.5)
+        self.assertEqual(frame.shape, (1920, 1080, 3))
+        self.assertEqual(frame[0, 0].tolist(), [0, 0, 0])
+        self.assertEqual(frame[960, 540].tolist(), [255, 0, 0])
+
+    def test_plan_variant(self):
+        items = [
+            vd.SubClippedVideoClip(file_path=f"{i}.mp4", start_time=0, end_time=3, width=1080, height=1920)
+            for i in range(4)
+        ]
+        pool = {}
+        segments = vd.plan_segments(items, 5)
+        clips, pending = vd._plan_variant(segments, items, pool, audio_duration=5)
+        self.assertEqual(clips, [])
+        self.assertEqual([item.file_path for item in pending], ["0.mp4", "1.mp4"])
+
+        # a failed clip is replaced by the next item of the same order
+        pool[vd._subclip_key(items[0])] = None
+        pool[vd._subclip_key(items[1])] = vd.SubClippedVideoClip(file_path="clip-1.mp4", duration=3)
+        clips, pending = vd._plan_variant(segments, items, pool, audio_duration=5)
+        self.assertEqual([clip.file_path for clip in clips], ["clip-1.mp4"])
+        self.assertEqual([item.file_path for item in pending], ["2.mp4"])
+
+        # another order reuses the clips already in the pool
+        order = [items[1], items[0], items[3]]
+        clips, pending = vd._plan_variant(vd.plan_segments(order, 5), order, pool, audio_duration=5)
+        self.assertEqual([clip.file_path for clip in clips], ["clip-1.mp4"])
+        self.assertEqual([item.file_path for item in pending], ["3.mp4"])
+
+    def test_plan_segments(self):
+        windows = [
+            vd.SubClippedVideoClip(file_path=f"{i}.mp4", start_time=2, end_time=5, width=1080, height=1920)
+            for i in range(3)
+        ]
+        # the last segment is cut where the duration is covered
+        segments = vd.plan_segments(windows, 7)
+        self.assertEqual([(s.file_path, s.start_time, s.end_time) for s in segments], [("0.mp4", 2, 5), ("1.mp4", 2, 5), ("2.mp4", 2, 3)])
+
+        # too short sources are looped, failed windows are skipped
+        segments = vd.plan_segments(windows, 10, failed={("1.mp4", 2)})
+        self.assertEqual([s.file_path for s in segments], ["0.mp4", "2.mp4", "0.mp4", "2.mp4"])
+        self.assertAlmostEqual(sum(s.duration for s in segments), 10)
+
+        # with overlapping transitions every segment after the first gives up the overlap
+        segments = vd.plan_segments(windows, 8, overlap=1)
+        self.assertAlmostEqual(sum(s.duration for s in segments) - 1 * (len(segments) - 1), 8)
+        # the tail only spans the transition into it, the video ends with the duration
+        segments = vd.plan_segments(windows, 5.1, overlap=1)
+        self.assertAlmostEqual(segments[-1].duration, 1.1)
+        self.assertAlmostEqual(sum(s.duration for s in segments) - 1 * (len(segments) - 1), 5.1)
+
+        self.assertEqual(vd.plan_segments([], 10), [])
+        plan = vd._plan_to_dict(["0.mp4"], windows, [windows], 7, 0, [vd.plan_segments(windows, 7)])
+        self.assertEqual(plan["segments"][0][-1], ["2.mp4", 2, 3, 1080, 1920])
+        # the stored segments are the ones that get encoded
+        restored = vd._segments_from_dict(plan)[0]
+        self.assertEqual([(s.file_path, s.start_time, s.end_time) for s in restored], [("0.mp4", 2, 5), ("1.mp4", 2, 5), ("2.mp4", 2, 3)])
+
+    def test_encoder_profiles(self):
+        draft = vd.get_encoder_profile("draft")
+        self.assertEqual(draft["preset"], "ultrafast")
+        write_args = vd.encoder_write_args(draft)
+        self.assertEqual(write_args["preset"], "ultrafast")
+        self.assertIn("-crf", write_args["ffmpeg_params"])
+        self.assertIn("-tune", write_args["ffmpeg_params"])
+
+        # the standard profile has no tune option
+        self.assertNotIn("-tune", vd.encoder_args(vd.get_encoder_profile("standard")))
+        # unknown profiles fall back to standard
+        self.assertEqual(vd.get_encoder_profile("unknown")["name"], "standard")
+
+    def test_rendition_sizes(self):
+        sizes = vd.rendition_sizes(1080, 1920, [480, 720, 1080])
+        # the full size is not a rendition, the others keep the aspect ratio with even dimensions
+        self.assertEqual(sizes, {720: (720, 1280), 480: (480, 852)})
+
+        params = VideoParams(video_subject="test", video_renditions=[720], video_poster=True)
+        self.assertEqual(
+            vd.extra_output_files("final-1.mp4", params, 1920, 1080),
+            ["final-1-720p.mp4", "final-1-poster.jpg"],
+        )
+
+    def test_subtitle_overlay(self):
+        import numpy as np
+
+        def make_image(start, end, value):
+            return subtitle_overlay.OverlayImage(
+                start=start,
+                end=end,
+                x=2,
+                y=2,
+                rgb=np.full((2, 4, 3), value, dtype=np.float32),
+                alpha=np.ones((2, 4, 1), dtype=np.float32),
+            )
+
+        overlay = subtitle_overlay.SubtitleOverlay(
+            [make_image(1.0, 2.0, 100), make_image(0.0, 5.0, 200), make_image(3.0, 4.0, 50)]
+        )
+        self.assertEqual([image.start for image in overlay.active(1.5)], [0.0, 1.0])
+        self.assertEqual([image.start for image in overlay.active(2.5)], [0.0])
+        self.assertEqual(overlay.active(6.0), [])
+
+        frame = np.zeros((8, 8, 3), dtype=np.uint8)
+        result = overlay.blit(frame, 3.5)
+        # the later line is drawn on top and the frame outside the box is untouched
+        self.assertEqual(result[2, 2, 0], 50)
+        self.assertEqual(result[0, 0, 0], 0)
+        self.assertEqual(frame[2, 2, 0], 0)
+
+    def test_ass_subtitles(self):
+        self.assertEqual(ass_subtitles.ass_color("#FF8000"), "&H000080FF")
+        self.assertEqual(ass_subtitles.ass_time(3723.456), "1:02:03.46")
+
+        params = VideoParams(video_subject="test", subtitle_position="bottom")
+        font_path = os.path.join(utils.font_dir(), "Charm-Bold.ttf")
+        content = ass_subtitles.build_ass(
+            [(0.0, 1.5, "first line\nsecond {line}")], params, 1080, 1920, font_path
+        )
+        self.assertIn("PlayResX: 1080", content)
+        self.assertIn(
+            "Dialogue: 0,0:00:00.00,0:00:01.50,Default,,0,0,0,,first line\\Nsecond \\{line\\}",
+            content,
+        )
+
+    def test_ass_escaping(self):
+        import tempfile
+
+        import numpy as np
+        from PIL import Image
+
+        self.assertEqual(ass_subtitles._escape_text("{a}\\b"), "\\{a\\}\\\u2060b")
+
+        params = VideoParams(video_subject="test", subtitle_position="top", font_size=40, stroke_width=0)
+        font_dir = utils.font_dir()
+        font_path = os.path.join(font_dir, "Charm-Bold.ttf")
+
+        def text_rows(text):
+            # rows of the frame libass draws text on
+            with tempfile.TemporaryDirectory() as temp_dir:
+                ass_path = ass_subtitles.write_ass(
+                    os.path.join(temp_dir, "test.ass"),
+                    ass_subtitles.build_ass([(0.0, 1.0, text)], params, 480, 320, font_path),
+                )
+                frame_file = os.path.join(temp_dir, "frame.png")
+                ffmpeg_utils.run_ffmpeg(
+                    [
+                        "-f", "lavfi", "-i", "color=c=black:s=480x320:d=1",
+                        "-vf", ass_subtitles.subtitles_filter(ass_path, font_dir),
+                        "-frames:v", "1", "-update", "1", frame_file,
+                    ]
+                )
+                frame = np.asarray(Image.open(frame_file).convert("L"))
+            rows = np.flatnonzero(frame.max(axis=1) > 128)
+            return rows[-1] - rows[0] if len(rows) else 0
+
+        # a literal "\N" and braces stay on one line, a real line break makes two
+        one_line = text_rows("C:\\New {x}")
+        two_lines = text_rows("C:\nNew x")
+        self.assertGreater(one_line, 0)
+        self.assertGreater(two_lines, one_line * 1.5)
+
+
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
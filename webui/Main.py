@@ -219,7 +219,10 @@ if start_button:
         if video_files:
             player_cols = st.columns(len(video_files) * 2 + 1)
             for i, url in enumerate(video_files):
-                player_cols[i * 2 + 1].video(url)
+                if url.endswith(".jpg"):
+                    player_cols[i * 2 + 1].image(url)
+                else:
+                    player_cols[i * 2 + 1].video(url)
     except Exception:
         pass
 